@@ -16,9 +16,21 @@ from routes.globus.globus import globus_blueprint
 from routes.export.export import export_select_blueprint
 from routes.export.export import export_review_blueprint
 from routes.export.export import export_donor_blueprint
-# bulk DOI comparison - deprecated because of performance issues in web application
-# from routes.doi.doi import doi_select_blueprint
-# from routes.doi.doi import doi_review_blueprint
+from routes.export.export import export_jobs_blueprint
+from routes.export.export import export_quality_blueprint
+from routes.export.export import export_query_blueprint
+# bulk DOI comparison, run as a resumable background job
+from routes.doi.doi import doi_select_blueprint
+from routes.doi.doi import doi_review_blueprint
+from routes.doi.doi import doi_jobs_blueprint
+from routes.doi.doi import doi_results_blueprint
+# curation of a worklist of donors
+from routes.worklist.worklist import worklist_select_blueprint
+from routes.worklist.worklist import worklist_move_blueprint
+# bulk update from an uploaded TSV, run as a background job
+from routes.bulk.bulk import bulk_select_blueprint
+from routes.bulk.bulk import bulk_review_blueprint
+from routes.bulk.bulk import bulk_jobs_blueprint
 
 
 # Configure consistent logging. This is done at the beginning of each module instead of with a superclass of
@@ -59,9 +71,21 @@ class DonorUI:
         self.app.register_blueprint(export_select_blueprint)
         self.app.register_blueprint(export_review_blueprint)
         self.app.register_blueprint(export_donor_blueprint)
+        self.app.register_blueprint(export_jobs_blueprint)
+        self.app.register_blueprint(export_quality_blueprint)
+        self.app.register_blueprint(export_query_blueprint)
         # bulk DOI comparison endpoints
-        # self.app.register_blueprint(doi_select_blueprint)
-        # self.app.register_blueprint(doi_review_blueprint)
+        self.app.register_blueprint(doi_select_blueprint)
+        self.app.register_blueprint(doi_review_blueprint)
+        self.app.register_blueprint(doi_jobs_blueprint)
+        self.app.register_blueprint(doi_results_blueprint)
+        # worklist curation endpoints
+        self.app.register_blueprint(worklist_select_blueprint)
+        self.app.register_blueprint(worklist_move_blueprint)
+        # bulk update endpoints
+        self.app.register_blueprint(bulk_select_blueprint)
+        self.app.register_blueprint(bulk_review_blueprint)
+        self.app.register_blueprint(bulk_jobs_blueprint)
 
         # Register the custom JSON pretty print filter.
         self.app.jinja_env.filters['tojson_pretty'] = to_pretty_json
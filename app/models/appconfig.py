@@ -95,10 +95,12 @@ class AppConfig:
 
         return listfields
 
-    def getfield(self, key: str) -> str:
+    def getfield(self, key: str, default: str = None) -> str:
         """
         Reads from the app.cfg to return a single value.
         :param key: key in the app.cfg file.
+        :param default: optional value to return if the key is not in the app.cfg. Used for optional
+                        settings, so that existing configuration files do not need to be updated.
         :return: string value, extracted from the tuple obtained from the app.cfg corresponding to the key.
         """
         field = ''
@@ -108,6 +110,8 @@ class AppConfig:
                 field = t[1].replace("'", "")
 
         if field == '':
+            if default is not None:
+                return default
             abort(400, f'Missing key {key} in application configuration file.')
 
         return field
@@ -0,0 +1,25 @@
+"""
+Form used to upload a TSV of donor metadata for a bulk update.
+"""
+
+from wtforms import Form, SelectField, FileField
+from models.appconfig import AppConfig
+
+
+class BulkForm(Form):
+
+    # Read the app.cfg file outside the Flask application context.
+    cfg = AppConfig()
+
+    # Application context for entity-api URLs, corresponding to a consortium.
+    # This field will be used to build the appropriate endpoint URL.
+    consortia = cfg.getfieldlist(prefix='CONTEXT_')
+    consortium = SelectField('Globus Consortium', choices=consortia)
+
+    # TSV in the format of the export. The file is read by the route from the request files.
+    bulkfile = FileField('Donor metadata TSV (format of the TSV export)')
+
+    # Clear validation errors. This handles the common use case in which the user returns to the search form after
+    # seeing a 4XX error.
+    consortium.errors = []
+    bulkfile.errors = []
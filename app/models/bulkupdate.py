@@ -0,0 +1,347 @@
+"""
+Bulk update of donor metadata from an uploaded TSV file.
+
+The TSV is in the flattened schema of the export (MetadataFrame): a row for each metadata element of a donor,
+with columns id and source_name (living_donor_data or organ_donor_data) followed by the keys of the element.
+The rows are grouped by donor id and converted back to donor metadata objects, which are applied with
+PUT calls to the entity-api. Before the update, the metadata of each donor in the file is compared with the
+donor's current metadata, so that the differences can be reviewed and confirmed; donors without differences
+are not updated.
+
+The updates run as a background job (JobManager). PUT calls are made by a bounded pool of threads, and are
+spaced so that the calls to a host do not exceed a rate limit. The job writes a per-donor status report.
+
+Optional keys of the app.cfg file set:
+- BULK_WORKERS: the number of concurrent PUT calls (default 4)
+- BULK_RATE: the maximum number of PUT calls per second to an entity-api host (default 2)
+- BULK_RETRIES: the number of retries of a PUT that fails with a 429 or 5XX error (default 2)
+
+"""
+import os
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import pandas as pd
+import requests
+import deepdiff
+
+from werkzeug.exceptions import HTTPException
+
+# Helper classes
+from models.appconfig import AppConfig
+from models.entity import Entity
+from models.loaddonordata import loaddonordata
+
+# Configure consistent logging. This is done at the beginning of each module instead of with a superclass of
+# logger to avoid the need to overload function calls to logger.
+logging.basicConfig(format='[%(asctime)s] %(levelname)s in %(module)s: %(message)s',
+                    level=logging.INFO, datefmt='%Y-%m-%d %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+# Columns of the export that identify the donor and the key of the metadata object; the other columns are
+# keys of metadata elements.
+KEYCOLUMNS = ['id', 'source_name']
+SOURCENAMES = ['living_donor_data', 'organ_donor_data']
+# Errors for which a PUT is retried.
+RETRYCODES = [429, 500, 502, 503, 504]
+
+
+class RateLimiter:
+
+    # Spaces calls to a host so that they do not exceed a rate. Limiters are shared by all jobs in the
+    # application process, keyed by host.
+    _limiters = {}
+    _lock = threading.Lock()
+
+    def __init__(self, rate: float):
+        """
+        :param rate: maximum number of calls per second
+        """
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.next = 0.0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def gethostlimiter(cls, host: str, rate: float):
+        """
+        Returns the shared rate limiter for a host.
+        :param host: host name
+        :param rate: maximum number of calls per second, used when the limiter is created
+        """
+        with cls._lock:
+            if host not in cls._limiters:
+                cls._limiters[host] = RateLimiter(rate=rate)
+            return cls._limiters[host]
+
+    def wait(self):
+        """
+        Blocks until the next call is allowed.
+        """
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next)
+            self.next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def readbulkfile(stream) -> pd.DataFrame:
+    """
+    Reads an uploaded TSV of flattened donor metadata. All values are read as strings, and empty cells as
+    empty strings, as in the export.
+    :param stream: file or file-like object
+    :return: DataFrame
+    """
+
+    dfupdate = pd.read_csv(stream, sep='\t', dtype=str, keep_default_na=False)
+    dfupdate.columns = [col.strip() for col in dfupdate.columns]
+    missing = [col for col in KEYCOLUMNS + ['concept_id'] if col not in dfupdate.columns]
+    if len(missing) > 0:
+        raise ValueError(f'The file is missing columns: {", ".join(missing)}. '
+                         f'The file should be in the format of the TSV export.')
+    # Drop blank lines.
+    return dfupdate[dfupdate['id'].str.strip() != '']
+
+
+def getbulkmetadata(dfupdate: pd.DataFrame, consortium: str) -> tuple:
+    """
+    Converts flattened donor metadata to donor metadata objects.
+    :param dfupdate: DataFrame from readbulkfile
+    :param consortium: consortium (e.g., CONTEXT_HUBMAP) for which the ids must be valid
+    :return: tuple of:
+             dict of metadata objects (e.g., {'organ_donor_data': [elements]}), keyed by donor id
+             dict of error messages for donors that cannot be converted, keyed by donor id
+    """
+
+    prefix = {'CONTEXT_HUBMAP': 'HBM', 'CONTEXT_SENNET': 'SNT'}.get(consortium)
+    elementcolumns = [col for col in dfupdate.columns if col not in KEYCOLUMNS]
+
+    dictmetadata = {}
+    dicterrors = {}
+    dfupdate = dfupdate.assign(id=dfupdate['id'].str.strip().str.upper(),
+                               source_name=dfupdate['source_name'].str.strip())
+    for donorid, dfdonor in dfupdate.groupby('id', sort=False):
+        sourcenames = dfdonor['source_name'].unique()
+        if donorid[0:3] != prefix:
+            dicterrors[donorid] = 'Incorrect consortium for donor ID.'
+        elif len(sourcenames) != 1 or sourcenames[0] not in SOURCENAMES:
+            dicterrors[donorid] = (f'Rows for the donor must have one source_name, either '
+                                   f'{" or ".join(SOURCENAMES)}; found {", ".join(sourcenames)}.')
+        else:
+            # A column can be in the file only because of the elements of other donors. Elements keep the
+            # columns with a value in any element of the donor, including empty values. Keys that are empty in
+            # every element of the donor--e.g., the start_datetime of elements saved by the Edit form--are
+            # restored from the current metadata before the update (withemptykeys).
+            donorcolumns = [col for col in elementcolumns if (dfdonor[col].str.strip() != '').any()]
+            listelement = dfdonor[donorcolumns].to_dict(orient='records')
+            dictmetadata[donorid] = {sourcenames[0]: listelement}
+
+    return dictmetadata, dicterrors
+
+
+def getbulkdiffs(dictmetadata: dict, token: str) -> pd.DataFrame:
+    """
+    Compares the metadata of each donor in a bulk update with the donor's current metadata. The current
+    metadata is loaded in a batch (loaddonordata).
+    :param dictmetadata: dict of metadata objects keyed by donor id (getbulkmetadata)
+    :param token: globus groups_token for the consortium
+    :return: DataFrame with columns:
+             id: donor id
+             status: changed, unchanged, or not found
+             changes: the differences from the current metadata (DeepDiff, as JSON), or the reason that the
+                      donor was not found
+    """
+
+    dictdonors, dicterrors = loaddonordata(donorids=list(dictmetadata), token=token)
+
+    listdiff = []
+    for donorid, metadata in dictmetadata.items():
+        donordata = dictdonors.get(donorid)
+        if donordata is None:
+            listdiff.append({'id': donorid, 'status': 'not found',
+                             'changes': dicterrors.get(donorid, f'Donor {donorid} could not be loaded.')})
+        elif donordata.metadata is None:
+            listdiff.append({'id': donorid, 'status': 'changed', 'changes': 'from no metadata to some metadata'})
+        else:
+            status, changes = comparemetadata(current=donordata.metadata, metadata=metadata)
+            listdiff.append({'id': donorid, 'status': status, 'changes': changes})
+
+    return pd.DataFrame(listdiff, columns=['id', 'status', 'changes'])
+
+
+def comparemetadata(current: dict, metadata: dict) -> tuple:
+    """
+    Compares the metadata of a donor in a bulk update with the donor's current metadata.
+    The flattened export cannot distinguish a key with an empty value from a key that an element does not have,
+    so keys with empty values are ignored on both sides.
+    :param current: current metadata object of the donor
+    :param metadata: metadata object from the bulk update (getbulkmetadata)
+    :return: tuple of the status (changed or unchanged) and the differences (DeepDiff, as JSON)
+    """
+
+    diff = deepdiff.DeepDiff(_withoutempty(current), _withoutempty(metadata))
+    if diff == {}:
+        return 'unchanged', ''
+    return 'changed', diff.to_json()
+
+
+def _withoutempty(metadata: dict) -> dict:
+    """
+    Returns a copy of a metadata object without the keys of elements that have empty values.
+    :param metadata: metadata object--e.g., {'organ_donor_data': [elements]}
+    """
+
+    dictreturn = {}
+    for sourcename, listelement in metadata.items():
+        # Missing values are exported as empty strings.
+        dictreturn[sourcename] = [{key: value for key, value in element.items()
+                                   if value is not None and str(value).strip() != ''}
+                                  for element in listelement]
+    return dictreturn
+
+
+def withemptykeys(current: dict, metadata: dict) -> dict:
+    """
+    Adds to the elements of the metadata of a donor in a bulk update the keys with empty values of the
+    corresponding elements of the donor's current metadata, which the flattened export cannot carry. Elements
+    correspond by concept_id, in order.
+    :param current: current metadata object of the donor
+    :param metadata: metadata object from the bulk update (getbulkmetadata)
+    :return: metadata object
+    """
+
+    dictreturn = {}
+    for sourcename, listelement in metadata.items():
+        listcurrent = list(current.get(sourcename, []))
+        listreturn = []
+        for element in listelement:
+            elementnew = dict(element)
+            match = next((m for m in listcurrent if m.get('concept_id') == element.get('concept_id')), None)
+            if match is not None:
+                listcurrent.remove(match)
+                for key, value in match.items():
+                    if key not in elementnew and (value is None or str(value).strip() == ''):
+                        elementnew[key] = value
+            listreturn.append(elementnew)
+        dictreturn[sourcename] = listreturn
+    return dictreturn
+
+
+def updatedonor(donorid: str, metadata: dict, token: str, rate: float, retries: int) -> dict:
+    """
+    Updates the metadata of a donor, waiting for the rate limiter of the entity-api host and retrying
+    transient errors.
+    :param donorid: donor id
+    :param metadata: metadata object
+    :param token: globus groups_token for the consortium
+    :param rate: maximum number of calls per second to the host
+    :param retries: number of retries for transient errors
+    :return: dict of status for the report
+    """
+
+    dictstatus = {'id': donorid, 'status': 'updated', 'code': 200, 'message': '', 'attempts': 0}
+    try:
+        entity = Entity(donorid=donorid, token=token)
+    except HTTPException as e:
+        dictstatus.update({'status': 'failed', 'code': e.code, 'message': e.description})
+        return dictstatus
+    except Exception as e:
+        dictstatus.update({'status': 'failed', 'code': '', 'message': str(e)})
+        return dictstatus
+
+    limiter = RateLimiter.gethostlimiter(host=f'{entity.urlbase}.{entity.consortium}.org', rate=rate)
+    for attempt in range(retries + 1):
+        limiter.wait()
+        dictstatus['attempts'] = attempt + 1
+        try:
+            entity.updatedonormetadata(dict_metadata=metadata)
+            dictstatus.update({'status': 'updated', 'code': 200, 'message': ''})
+            return dictstatus
+        except HTTPException as e:
+            dictstatus.update({'status': 'failed', 'code': e.code, 'message': e.description})
+            if e.code == 403:
+                dictstatus['message'] = (f'{e.description}. The donor is locked--most likely because it is '
+                                         f'associated with a published dataset.')
+            if e.code not in RETRYCODES:
+                return dictstatus
+        except requests.RequestException as e:
+            dictstatus.update({'status': 'failed', 'code': '', 'message': str(e)})
+        except Exception as e:
+            # E.g., abort with a status code that werkzeug does not know raises LookupError.
+            dictstatus.update({'status': 'failed', 'code': '', 'message': str(e)})
+            return dictstatus
+        # Back off before retrying.
+        if attempt < retries:
+            time.sleep(2 ** attempt)
+
+    return dictstatus
+
+
+def runbulkupdate(progress, artifactpath: str, consortium: str, token: str, dictmetadata: dict,
+                  dicterrors: dict, dictskipped: dict = None) -> str:
+    """
+    Applies metadata updates for a set of donors.
+    :param progress: JobProgress for the job
+    :param artifactpath: folder for the report
+    :param consortium: consortium
+    :param token: globus groups_token for the consortium
+    :param dictmetadata: dict of metadata objects keyed by donor id (getbulkmetadata), for the donors to update
+    :param dicterrors: dict of error messages for donors that could not be converted (getbulkmetadata)
+    :param dictskipped: optional dict of the status (getbulkdiffs)--e.g., unchanged--of donors in the file that are
+                        not updated, keyed by donor id
+    :return: path to the CSV report
+    """
+
+    if dictskipped is None:
+        dictskipped = {}
+
+    cfg = AppConfig()
+    workers = max(int(cfg.getfield(key='BULK_WORKERS', default='4')), 1)
+    rate = float(cfg.getfield(key='BULK_RATE', default='2'))
+    retries = int(cfg.getfield(key='BULK_RETRIES', default='2'))
+
+    listreport = [{'id': donorid, 'status': 'invalid', 'code': 400, 'message': msg, 'attempts': 0}
+                  for donorid, msg in dicterrors.items()]
+    listreport = listreport + [{'id': donorid, 'status': status, 'code': '', 'message': '', 'attempts': 0}
+                               for donorid, status in dictskipped.items()]
+    total = len(dictmetadata)
+    updated = 0
+    failed = 0
+
+    # Keep the keys with empty values of the current metadata, which are not in the file.
+    progress(phase='loading current donor metadata', done=0, total=total, updated=0, failed=0,
+             invalid=len(dicterrors), skipped=len(dictskipped))
+    try:
+        dictdonors, _ = loaddonordata(donorids=list(dictmetadata), token=token)
+    except Exception as e:
+        # The updates do not depend on the current metadata.
+        logger.error(e, exc_info=True)
+        dictdonors = {}
+    dictmetadata = {donorid: withemptykeys(current=dictdonors[donorid].metadata, metadata=metadata)
+                    if donorid in dictdonors and dictdonors[donorid].metadata is not None else metadata
+                    for donorid, metadata in dictmetadata.items()}
+
+    progress(phase='updating donor metadata')
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bulk') as executor:
+        futures = {executor.submit(updatedonor, donorid, metadata, token, rate, retries): donorid
+                   for donorid, metadata in dictmetadata.items()}
+        for future in as_completed(futures):
+            try:
+                dictstatus = future.result()
+            except Exception as e:
+                # An error for one donor does not fail the job, so that the report covers the PUTs already made.
+                dictstatus = {'id': futures[future], 'status': 'failed', 'code': '', 'message': str(e),
+                              'attempts': 0}
+            listreport.append(dictstatus)
+            if dictstatus['status'] == 'updated':
+                updated = updated + 1
+            else:
+                failed = failed + 1
+            progress(done=updated + failed, updated=updated, failed=failed)
+
+    artifact = os.path.join(artifactpath, f'{progress.jobid}_report.csv')
+    dfreport = pd.DataFrame(listreport, columns=['id', 'status', 'code', 'message', 'attempts'])
+    dfreport.sort_values(by='id').to_csv(artifact, index=False)
+    return artifact
@@ -0,0 +1,49 @@
+# Memory-compact representation of a DataFrame of flattened donor metadata.
+# In a DataFrame built by SearchAPI.getalldonormetadata, every value is a Python string. The values of columns such
+# as concept_id and units repeat heavily across the donors of a consortium, so the compact representation stores
+# these columns as categoricals, which keep each distinct value once. It also adds a column of data values
+# parsed as numbers, so that numeric comparisons do not parse the strings repeatedly.
+# Because this file is used by both the donor-metadata app and scripts in the
+# validate path, it does not import other helper classes.
+
+import pandas as pd
+
+# Columns with values that repeat heavily across donors.
+COMPACTCOLUMNS = ['concept_id', 'grouping_concept', 'grouping_concept_preferred_term', 'SAB', 'units', 'data_type',
+                  'source_name', 'graph_version']
+# Column of data values parsed as numbers. The column is derived, so it is not exported.
+NUMBERCOLUMN = 'data_value_number'
+
+
+def getcompactframe(dfmetadata: pd.DataFrame) -> pd.DataFrame:
+    """
+    Converts a DataFrame of flattened donor metadata to the compact representation.
+    :param dfmetadata: DataFrame of flattened donor metadata, with string values
+    :return: DataFrame in which the columns in COMPACTCOLUMNS are categoricals, with a column NUMBERCOLUMN of
+             float values of data_value (NaN for values that are not numbers) following data_value
+    """
+
+    dfcompact = dfmetadata.copy()
+    for col in COMPACTCOLUMNS:
+        if col in dfcompact.columns:
+            # Missing values are filled with empty strings throughout the app, which requires the empty string
+            # to be a category. The categories are sorted, so that sorting by a column is alphabetical.
+            categories = pd.Index(dfcompact[col].dropna().astype(str).unique()).union([''])
+            dfcompact[col] = dfcompact[col].astype(pd.CategoricalDtype(categories=categories))
+
+    if 'data_value' in dfcompact.columns and NUMBERCOLUMN not in dfcompact.columns:
+        number = pd.to_numeric(dfcompact['data_value'], errors='coerce').astype('float64')
+        dfcompact.insert(dfcompact.columns.get_loc('data_value') + 1, NUMBERCOLUMN, number)
+
+    return dfcompact
+
+
+def getexportframe(dfmetadata: pd.DataFrame) -> pd.DataFrame:
+    """
+    Returns the columns of a DataFrame of flattened donor metadata that are exported--i.e., without NUMBERCOLUMN.
+    :param dfmetadata: DataFrame of flattened donor metadata, in either representation
+    """
+
+    if NUMBERCOLUMN in dfmetadata.columns:
+        return dfmetadata.drop(columns=[NUMBERCOLUMN])
+    return dfmetadata
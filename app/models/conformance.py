@@ -0,0 +1,114 @@
+# Conformance of flattened donor metadata in provenance with the current valuesets of the Valueset Manager.
+# Metadata elements are written with the valueset content that was current at the time of curation. Valuesets
+# change afterward--concepts are retired, preferred terms or codes change, and the UMLS graph version advances--
+# so that existing elements drift from the valuesets. The functions here build an index of the concepts in all
+# tabs of the Valueset Manager and join it with the flattened metadata of all donors in a consortium in one
+# pass, reporting elements that no longer match.
+# Because this file is used by both the donor-metadata app and scripts in the
+# validate path, it does not import other helper classes.
+
+import pandas as pd
+
+# Columns of an element that are compared with the valueset, and the check for each.
+CONCEPTCOLUMNS = {'preferred_term': 'preferred_term', 'SAB': 'sab_code', 'code': 'sab_code'}
+
+CONFORMANCECOLUMNS = ['tab', 'check', 'id', 'concept_id', 'grouping_concept', 'column', 'metadata_value',
+                      'valueset_value']
+
+
+def getconceptindex(sheets: dict) -> pd.DataFrame:
+    """
+    Builds an index of the concepts in all tabs of the Valueset Manager.
+    :param sheets: dict of DataFrames for the tabs of the Valueset Manager, keyed by tab name
+                   (ValueSetManager.Sheets)
+    :return: DataFrame with columns concept_id, grouping_concept, preferred_term, SAB, code and tab, with a row
+             for each distinct pair of concept and grouping concept
+    """
+
+    listtabs = []
+    for tab, dftab in sheets.items():
+        if 'concept_id' not in dftab.columns or 'grouping_concept' not in dftab.columns:
+            # e.g., the UMLS tab
+            continue
+        dftab = dftab.reindex(columns=['concept_id', 'grouping_concept', 'preferred_term', 'SAB', 'code'])
+        dftab['tab'] = tab
+        listtabs.append(dftab)
+
+    dfindex = pd.concat(listtabs, ignore_index=True).dropna(subset=['concept_id'])
+    dfindex = dfindex.fillna('').astype(str).apply(lambda col: col.str.strip())
+    return dfindex.drop_duplicates(subset=['concept_id', 'grouping_concept'], ignore_index=True)
+
+
+def getconformance(dfalldonormetadata: pd.DataFrame, dfindex: pd.DataFrame,
+                   graph_version: str = None) -> pd.DataFrame:
+    """
+    Compares flattened donor metadata with the current valuesets.
+    :param dfalldonormetadata: DataFrame of flattened metadata for all donors (SearchAPI.getalldonormetadata)
+    :param dfindex: DataFrame from getconceptindex
+    :param graph_version: optional current UMLS graph version (ValueSetManager.umls). If provided, elements with
+                          another graph_version are reported.
+    :return: DataFrame with a row for each element and column that does not conform, with columns:
+             tab: the tab of the valueset for the concept, or for the grouping concept of a retired concept
+             check: retired, grouping_concept, preferred_term, sab_code or graph_version
+             id, concept_id, grouping_concept: identify the element
+             column: the column of the element that does not conform
+             metadata_value, valueset_value: the values in the element and in the valueset
+    """
+
+    columns = ['id', 'concept_id', 'grouping_concept', 'graph_version'] + list(CONCEPTCOLUMNS.keys())
+    dfm = dfalldonormetadata.reindex(columns=columns)
+    dfm = dfm.fillna('').astype(str).apply(lambda col: col.str.strip())
+
+    # Concept-level content is compared with the row in the index for the pair of concept and grouping concept
+    # of the element--a concept can be in more than one tab, with different content. If the index has no row
+    # for the pair, the content is compared with the first row for the concept.
+    valuesetcolumns = list(CONCEPTCOLUMNS.keys()) + ['tab']
+    dfpairs = dfindex.set_index(['concept_id', 'grouping_concept'])[valuesetcolumns].add_prefix('vs_')
+    dfconcepts = dfindex.drop_duplicates(subset=['concept_id']).set_index('concept_id')[valuesetcolumns]
+    dfconcepts = dfconcepts.add_prefix('vs_')
+    dfvaluesets = dfm.join(dfpairs, on=['concept_id', 'grouping_concept'])[dfpairs.columns]
+    ispair = dfvaluesets['vs_tab'].notna()
+    dfvaluesets = dfvaluesets.combine_first(dfm.join(dfconcepts, on='concept_id')[dfconcepts.columns])
+    dfm = pd.concat([dfm, dfvaluesets[dfpairs.columns]], axis=1)
+
+    isretired = dfm['vs_tab'].isna()
+    # The tab of a retired concept is the tab of its grouping concept, if known.
+    dfgroupingtabs = dfindex.drop_duplicates(subset=['grouping_concept']).set_index('grouping_concept')['tab']
+    dfm['tab'] = dfm['vs_tab'].fillna(dfm['grouping_concept'].map(dfgroupingtabs)).fillna('')
+
+    listchecks = [(isretired, 'retired', 'concept_id', dfm['concept_id'],
+                   pd.Series('', index=dfm.index)),
+                  (~isretired & ~ispair, 'grouping_concept', 'grouping_concept', dfm['grouping_concept'],
+                   dfm['concept_id'].map(dfindex.groupby('concept_id')['grouping_concept'].agg(';'.join)))]
+    for column, check in CONCEPTCOLUMNS.items():
+        listchecks.append((~isretired & (dfm[column] != dfm[f'vs_{column}']), check, column, dfm[column],
+                           dfm[f'vs_{column}']))
+    if graph_version is not None:
+        graph_version = str(graph_version).strip()
+        listchecks.append((dfm['graph_version'] != graph_version, 'graph_version', 'graph_version',
+                           dfm['graph_version'], pd.Series(graph_version, index=dfm.index)))
+
+    listissues = []
+    for mask, check, column, metadatavalues, valuesetvalues in listchecks:
+        dfcheck = dfm.loc[mask, ['tab', 'id', 'concept_id', 'grouping_concept']]
+        dfcheck['check'] = check
+        dfcheck['column'] = column
+        dfcheck['metadata_value'] = metadatavalues[mask]
+        dfcheck['valueset_value'] = valuesetvalues[mask].fillna('')
+        listissues.append(dfcheck)
+
+    dfconformance = pd.concat(listissues, ignore_index=True)[CONFORMANCECOLUMNS]
+    return dfconformance.sort_values(by=['tab', 'check', 'concept_id', 'id'], ignore_index=True)
+
+
+def getconformancesummary(dfconformance: pd.DataFrame) -> pd.DataFrame:
+    """
+    Summarizes non-conforming elements by tab and check.
+    :param dfconformance: DataFrame from getconformance
+    :return: DataFrame with columns tab, check, elements (number of non-conforming elements), concepts and
+             donors (numbers of distinct concepts and donors)
+    """
+
+    return dfconformance.groupby(['tab', 'check']).agg(elements=('id', 'size'),
+                                                       concepts=('concept_id', 'nunique'),
+                                                       donors=('id', 'nunique')).reset_index()
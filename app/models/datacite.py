@@ -3,6 +3,8 @@ Class representing interactions with the DataCite API for DOIs.
 """
 import os
 import sys
+import re
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
 
@@ -17,6 +19,24 @@ from metadataframe import MetadataFrame
 from getmetadatabytype import getmetadatabytype
 from getresponsejson import getresponsejson
 
+# Patterns for the vectorized parse of DOI titles in format
+# <type of data> from the <organ> of a <age>-<age unit>-old <race> <sex>.
+# Each pattern reproduces a step of _parsedtitle.
+# The combined race and sex phrase: the text between the first '-old ' and the next '-old ', or the end.
+PATTERN_RACESEX = re.compile(r'-old (.*?)(?=-old |\Z)', re.DOTALL)
+# The sex term: the last space-delimited word of the race and sex phrase.
+PATTERN_SEX = re.compile(r'([^ ]*)\Z')
+# The text of the race and sex phrase before the first occurrence of the sex term. The phrase is matched in
+# the string <sex> <phrase>, so that the backreference finds the sex term (which has no spaces) in the phrase.
+PATTERN_RACEHEAD = re.compile(r'^([^ ]*) (.*?)\1', re.DOTALL)
+# The age unit: the text after the last dash before the first '-old'.
+PATTERN_AGEUNITS = re.compile(r'^(.*?)-old', re.DOTALL)
+PATTERN_LASTDASH = re.compile(r'-([^-]*)\Z')
+# The age: the text between the first 'of a' and the next dash, if the text up to the next 'of a' has a dash.
+PATTERN_AGE = re.compile(r'of a(.*?)(?=of a|\Z)', re.DOTALL)
+PATTERN_FIRSTDASH = re.compile(r'^([^-]*)-')
+
+
 class DataCiteAPI:
 
     def __init__(self, consortium: str):
@@ -102,29 +122,58 @@ class DataCiteAPI:
 
         """
 
-        listret = []
         print('Obtaining all DOI titles for consortium...')
         listtitles = self.getalldatacitetitles()
         if listtitles is None:
             print('Error from DataCite')
             exit(-1)
 
-        for doi in listtitles:
-            title = doi.get('title')
-            if title is not None:
-                dictparse = self._parsedtitle(title=title)
-            listret.append(
-                {
-                    "doi": doi.get('doi'),
-                    "title": title,
-                    "race": dictparse.get('race'),
-                    "sex": dictparse.get('sex'),
-                    "age": dictparse.get('age'),
-                    "ageunits": dictparse.get('ageunits')
-                }
-            )
-
-        return pd.DataFrame(listret).drop_duplicates()
+        dftitles = pd.DataFrame(listtitles, columns=['doi', 'title'])
+        dfparse = self.parsetitles(titles=dftitles['title'])
+
+        return pd.concat([dftitles, dfparse], axis=1).drop_duplicates()
+
+    def parsetitles(self, titles: pd.Series) -> pd.DataFrame:
+        """
+        Parses the age, age unit, sex, and race terms from a Series of DOI title strings.
+        This is a vectorized version of _parsedtitle, with the same results for titles that _parsedtitle
+        can parse.
+        :param titles: Series of DOI title strings
+        :return: DataFrame with the index of titles and columns race, sex, age, ageunits, and unparseable
+                 (yes or no).
+        """
+
+        title = titles.fillna('').astype(str).str.lower().str.replace(' donor', '', regex=False)
+
+        # Race and sex.
+        racesex = title.str.extract(PATTERN_RACESEX, expand=False)
+        sex = racesex.str.extract(PATTERN_SEX, expand=False)
+        # The race is the text up to the character before the first occurrence of the sex term in the phrase.
+        # If the phrase starts with the sex term, this is the phrase without its last character.
+        head = (sex + ' ' + racesex).str.extract(PATTERN_RACEHEAD, expand=False)[1]
+        race = pd.Series(np.where(head.str.len() > 0, head.str[:-1], racesex.str[:-1]), index=titles.index)
+
+        # Age unit.
+        beforeold = title.str.extract(PATTERN_AGEUNITS, expand=False)
+        ageunits = beforeold.str.extract(PATTERN_LASTDASH, expand=False).fillna('age unit cannot be parsed')
+
+        # Age.
+        ofa = title.str.extract(PATTERN_AGE, expand=False)
+        age = ofa.str.extract(PATTERN_FIRSTDASH, expand=False).str.strip().fillna('age cannot be parsed')
+
+        # Titles that are missing, do not have an '-old ' phrase, or do not have an 'of a' phrase
+        # cannot be parsed.
+        unparseable = titles.isna() | racesex.isna() | ofa.isna()
+
+        dfparse = pd.DataFrame({'race': race.where(~unparseable, 'race cannot be parsed'),
+                                'sex': sex.where(~unparseable, 'sex cannot be parsed'),
+                                'age': age.where(~unparseable, 'age cannot be parsed'),
+                                'ageunits': ageunits.where(~unparseable, 'ageunits cannot be parsed')},
+                               index=titles.index)
+        dfparse['unparseable'] = np.where(unparseable
+                                          | (dfparse['age'] == 'age cannot be parsed')
+                                          | (dfparse['ageunits'] == 'age unit cannot be parsed'), 'yes', 'no')
+        return dfparse
 
     def _parsedtitle(self, title: str) -> dict:
         """
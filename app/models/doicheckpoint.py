@@ -0,0 +1,134 @@
+"""
+Checkpoint store for the bulk comparison of donor metadata with DOI titles.
+
+Comparing the metadata of every donor in a consortium with the DataCite titles of the donor's published datasets
+requires calls to the search-api and DataCite for each donor, and can take hours. The background DOI job
+records the rows for each donor when the donor is complete, so that:
+- an interrupted job resumes with the donors that were not complete
+- the rows for completed donors can be downloaded while the job runs
+
+The checkpoint is a local SQLite database in the folder of the app.cfg file, keyed by consortium.
+
+Each completed donor is stored with a hash of the donor's DOI-related metadata. A later job reuses the rows of a
+completed donor if neither the hash of the donor's metadata nor the titles of the donor's DOIs changed.
+
+"""
+import os
+import sqlite3
+import time
+from contextlib import closing
+import pandas as pd
+
+# Helper classes
+from models.appconfig import AppConfig
+
+
+class DOICheckpoint:
+
+    # Columns of the rows of DOI metadata for a donor, from SearchAPI.getdonordoimetadata.
+    columns = ['id', 'age', 'ageunits', 'sex', 'race', 'doi_url', 'doi_title']
+
+    def __init__(self, consortium: str):
+
+        cfg = AppConfig()
+        self.dbfile = os.path.join(cfg.path, 'doi_checkpoint.db')
+        self.consortium = consortium
+        self._createtables()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.dbfile, timeout=30)
+
+    def _createtables(self):
+        with closing(self._connect()) as conn:
+            with conn:
+                # Write-ahead logging allows downloads to read while a job writes.
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.execute('CREATE TABLE IF NOT EXISTS donors ('
+                             'consortium TEXT, '
+                             'donorid TEXT, '
+                             'completed REAL, '
+                             'hash TEXT, '  # hash of the DOI-related metadata of the donor
+                             'PRIMARY KEY (consortium, donorid))')
+                # Checkpoints from before donor hashes were stored.
+                columns = [row[1] for row in conn.execute('PRAGMA table_info(donors)').fetchall()]
+                if 'hash' not in columns:
+                    conn.execute("ALTER TABLE donors ADD COLUMN hash TEXT DEFAULT ''")
+                conn.execute('CREATE TABLE IF NOT EXISTS rows ('
+                             'consortium TEXT, '
+                             'donorid TEXT, '
+                             'rownum INTEGER, '
+                             + ', '.join(f'{col} TEXT' for col in self.columns) + ', '
+                             'PRIMARY KEY (consortium, donorid, rownum))')
+
+    def getcompleteddonors(self) -> dict:
+        """
+        Returns the donors for which the comparison is complete.
+        :return: dict of hashes of donor metadata, keyed by donor id
+        """
+
+        with closing(self._connect()) as conn:
+            rows = conn.execute('SELECT donorid, hash FROM donors WHERE consortium=?', (self.consortium,)).fetchall()
+        return {row[0]: row[1] for row in rows}
+
+    def adddonors(self, dictdonors: dict, dicthashes: dict):
+        """
+        Records a batch of completed donors in a single transaction, so that a batch is either recorded
+        completely or not at all. Rows from earlier runs for the donors are replaced.
+        :param dictdonors: dict keyed by donor id; values are lists of dicts of DOI metadata rows for the donor.
+        :param dicthashes: dict of hashes of donor metadata, keyed by donor id
+        """
+
+        now = time.time()
+        listrows = []
+        for donorid, listdonor in dictdonors.items():
+            for rownum, dictrow in enumerate(listdonor):
+                # Values are stored as text. The race of a donor with more than one race is a list.
+                listrows.append((self.consortium, donorid, rownum)
+                                + tuple(str(dictrow.get(col, '')) for col in self.columns))
+
+        placeholders = ', '.join(['?'] * (len(self.columns) + 3))
+        with closing(self._connect()) as conn:
+            with conn:
+                conn.executemany('DELETE FROM rows WHERE consortium=? AND donorid=?',
+                                 [(self.consortium, donorid) for donorid in dictdonors])
+                conn.executemany(f'INSERT INTO rows VALUES ({placeholders})', listrows)
+                conn.executemany('INSERT OR REPLACE INTO donors VALUES (?, ?, ?, ?)',
+                                 [(self.consortium, donorid, now, dicthashes.get(donorid, ''))
+                                  for donorid in dictdonors])
+
+    def gettitles(self) -> pd.DataFrame:
+        """
+        Returns the DOI urls and titles recorded for completed donors.
+        :return: DataFrame with columns donorid, doi_url, doi_title
+        """
+
+        with closing(self._connect()) as conn:
+            rows = conn.execute('SELECT donorid, doi_url, doi_title FROM rows WHERE consortium=?',
+                                (self.consortium,)).fetchall()
+        return pd.DataFrame(rows, columns=['donorid', 'doi_url', 'doi_title'])
+
+    def getrows(self, chunksize: int = 1000):
+        """
+        Reads the rows for completed donors, ordered by donor id.
+        :param chunksize: number of rows in each DataFrame
+        :return: generator of DataFrames with the columns of the checkpoint
+        """
+
+        sql = f"SELECT {', '.join(self.columns)} FROM rows WHERE consortium=? ORDER BY donorid, rownum"
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(sql, (self.consortium,))
+            while True:
+                rows = cursor.fetchmany(chunksize)
+                yield pd.DataFrame(rows, columns=self.columns)
+                if len(rows) < chunksize:
+                    break
+
+    def clear(self):
+        """
+        Deletes the checkpoint for the consortium, so that the comparison starts over.
+        """
+
+        with closing(self._connect()) as conn:
+            with conn:
+                conn.execute('DELETE FROM rows WHERE consortium=?', (self.consortium,))
+                conn.execute('DELETE FROM donors WHERE consortium=?', (self.consortium,))
@@ -0,0 +1,210 @@
+# Vectorized comparison of donor clinical metadata with clinical metadata parsed from the titles of DOIs for
+# the donors' published datasets.
+# April 2025. Because this file is used by both the donor-metadata app and scripts in the
+# validate path, it does not import other helper classes.
+
+import numpy as np
+import pandas as pd
+
+# Grouping concepts of the donor metadata that appear in DOI titles.
+AGE = 'C0001779'
+SEX = 'C1522384'
+RACE = 'C0034510'
+
+
+def getdonordoiterms(dfalldonormetadata: pd.DataFrame) -> pd.DataFrame:
+    """
+    Extracts from flattened donor metadata the terms that appear in DOI titles, for all donors at once.
+    Equivalent to SearchAPI.getalldonordoimetadata with geturls=False.
+    :param dfalldonormetadata: DataFrame of flattened metadata for all donors (SearchAPI.getalldonormetadata)
+    :return: DataFrame with columns id, age, ageunits, sex, race. The race of a donor with other than one race
+             is an array of the races.
+    """
+
+    dfmeta = dfalldonormetadata[['id', 'grouping_concept', 'data_value', 'units']]
+    dfdonor = pd.DataFrame({'id': dfmeta['id'].drop_duplicates().sort_values().to_list()})
+
+    # The first age and sex element of each donor.
+    dfage = dfmeta[dfmeta['grouping_concept'] == AGE].drop_duplicates(subset='id')
+    dfage = dfage[['id', 'data_value', 'units']].rename(columns={'data_value': 'age', 'units': 'ageunits'})
+    dfsex = dfmeta[dfmeta['grouping_concept'] == SEX].drop_duplicates(subset='id')
+    dfsex = dfsex[['id', 'data_value']].rename(columns={'data_value': 'sex'})
+    dfsex['sex'] = dfsex['sex'].str.lower()
+
+    # Donors can have more than one race.
+    dfrace = dfmeta[dfmeta['grouping_concept'] == RACE]
+    races = dfrace.groupby('id', sort=False)['data_value'].agg(list)
+    single = races.str.len() == 1
+    races = races.where(~single, races.str[0].str.lower())
+    races = races.where(single, races.map(np.array))
+
+    dfdonor = dfdonor.merge(dfage, how='left', on='id').merge(dfsex, how='left', on='id')
+    dfdonor['race'] = dfdonor['id'].map(races).astype(object)
+    # Donors without a race element have an empty array of races.
+    norace = dfdonor['race'].isna()
+    dfdonor.loc[norace, 'race'] = pd.Series([np.array([])] * norace.sum(), index=dfdonor.index[norace],
+                                            dtype=object)
+    return dfdonor
+
+
+def _categoricalkeys(*keys: pd.Series) -> tuple:
+    """
+    Converts join key columns to a shared categorical type, so that joins compare integer codes
+    instead of strings. The categories are sorted, so that sorting by a key is alphabetical.
+    :param keys: key columns
+    :return: tuple of the converted columns
+    """
+
+    categories = pd.concat(keys).dropna().astype(str).drop_duplicates().sort_values()
+    dtype = pd.CategoricalDtype(categories=categories.to_list())
+    return tuple(key.astype(str).where(key.notna()).astype(dtype) for key in keys)
+
+
+def gettrailingzeros(dfalldonormetadata: pd.DataFrame) -> pd.DataFrame:
+    """
+    Flags donors with any decimal data_value with a trailing zero.
+    :param dfalldonormetadata: DataFrame of flattened metadata for all donors
+    :return: DataFrame with columns id and trailing_zero (yes or no)
+    """
+
+    values = dfalldonormetadata['data_value'].astype(str).str.strip()
+    trailingzero = values.str.endswith('0') & values.str.contains('.', regex=False)
+    dftz = pd.DataFrame({'id': dfalldonormetadata['id'], 'trailing_zero': trailingzero})
+    dftz = dftz.groupby('id', sort=False, as_index=False)['trailing_zero'].any()
+    dftz['trailing_zero'] = np.where(dftz['trailing_zero'], 'yes', 'no')
+    return dftz
+
+
+def getcontenthashes(dfcontent: pd.DataFrame, key: str) -> pd.Series:
+    """
+    Hashes the content of each row of a DataFrame--e.g., the DOI terms of a donor or the title of a DOI--so
+    that a later run can identify rows that did not change.
+    The hash is deterministic across runs.
+    :param dfcontent: DataFrame
+    :param key: the column that identifies a row; the other columns are hashed.
+    :return: Series of hashes as strings, indexed by the values of the key column
+    """
+
+    dfvalues = dfcontent.drop(columns=key).astype(str)
+    hashes = pd.util.hash_pandas_object(dfvalues, index=False).astype(str)
+    hashes.index = dfcontent[key].astype(str)
+    return hashes
+
+
+def _matches(left: pd.Series, right: pd.Series) -> pd.Series:
+    """
+    Compares two columns as strings. Missing values do not match.
+    :return: Series of yes or no
+    """
+
+    match = (left.astype(str) == right.astype(str)) & left.notna() & right.notna()
+    return pd.Series(np.where(match, 'yes', 'no'), index=left.index)
+
+
+def _numbertype(values: pd.Series) -> pd.Series:
+    """
+    Identifies whether string values represent decimal or integer numbers.
+    """
+
+    return pd.Series(np.where(values.astype(str).str.contains('.', regex=False) & values.notna(),
+                              'decimal', 'integer'), index=values.index)
+
+
+def getdoicomparison(dfdois: pd.DataFrame, dfalldonormetadata: pd.DataFrame, dfdonordoiterms: pd.DataFrame,
+                     dfdoititles: pd.DataFrame) -> pd.DataFrame:
+    """
+    Compares donor clinical metadata with clinical metadata parsed from DOI titles.
+    :param dfdois: DataFrame of published datasets, with columns donorid and doi
+    :param dfalldonormetadata: DataFrame of flattened metadata for all donors
+    :param dfdonordoiterms: DataFrame of DOI terms for donors (getdonordoiterms)
+    :param dfdoititles: DataFrame of parsed DOI titles (DataCiteAPI.getdoititles)
+    :return: DataFrame with a row for each DOI of a published dataset
+    """
+
+    # Flag donors with any decimal data_value with a trailing zero.
+    dftz = gettrailingzeros(dfalldonormetadata=dfalldonormetadata)
+
+    # Join on categorical keys.
+    dfdois = dfdois.copy()
+    dfdonordoiterms = dfdonordoiterms.copy()
+    dfdoititles = dfdoititles.copy()
+    dfdois['donorid'], dftz['id'], dfdonordoiterms['id'] = _categoricalkeys(dfdois['donorid'], dftz['id'],
+                                                                             dfdonordoiterms['id'])
+    dfdois['doi'], dfdoititles['doi'] = _categoricalkeys(dfdois['doi'], dfdoititles['doi'])
+
+    dfout = dfdois.merge(dftz, how='left', left_on='donorid', right_on='id').drop('id', axis=1)
+    # Merge doi-donor map with donor metadata.
+    dfout = dfout.merge(dfdonordoiterms, how='left', left_on='donorid', right_on='id')
+    # Merge doi-donor with metadata with parsed doi title information.
+    dfout = dfout.merge(dfdoititles, how='left', on='doi', suffixes=['_donor', '_doi'])
+
+    # Compare terms for race, sex and age from donor metadata with corresponding
+    # terms parsed from the DOI titles.
+    dfout['race_match'] = _matches(dfout['race_doi'], dfout['race_donor'])
+    dfout['sex_match'] = _matches(dfout['sex_doi'], dfout['sex_donor'])
+    dfout['age_match'] = _matches(dfout['age_doi'], dfout['age_donor'])
+    # Age unit is singular in DOI title and plural in donor metadata.
+    dfout['ageunits_match'] = _matches(dfout['ageunits_doi'] + 's', dfout['ageunits_donor'])
+
+    dfout['match'] = np.where(
+        (dfout['race_match'] == 'yes')
+        & (dfout['sex_match'] == 'yes')
+        & (dfout['age_match'] == 'yes')
+        & (dfout['ageunits_match'] == 'yes'),
+        'yes', 'no')
+
+    # Explicitly compare number types of donor and doi age to identify synchronization
+    # issues--e.g., an integer donor age (11) and a decimal DOI age (11.0).
+    dfout['age_donor_type'] = _numbertype(dfout['age_donor'])
+    dfout['age_doi_type'] = _numbertype(dfout['age_doi'])
+
+    # Drop extra id column.
+    return dfout.drop('id', axis=1).sort_values(by='donorid')
+
+
+def getmemoizedcomparison(dfdois: pd.DataFrame, dfalldonormetadata: pd.DataFrame, dfdonordoiterms: pd.DataFrame,
+                          dfdoititles: pd.DataFrame, dfprevious: pd.DataFrame = None) -> pd.DataFrame:
+    """
+    Compares donor clinical metadata with clinical metadata parsed from DOI titles, reusing the results of a
+    previous comparison for DOIs for which neither the donor's metadata nor the DOI title changed.
+    :param dfdois: DataFrame of published datasets, with columns donorid and doi
+    :param dfalldonormetadata: DataFrame of flattened metadata for all donors
+    :param dfdonordoiterms: DataFrame of DOI terms for donors (getdonordoiterms)
+    :param dfdoititles: DataFrame of parsed DOI titles (DataCiteAPI.getdoititles)
+    :param dfprevious: optional result of a previous call
+    :return: DataFrame of getdoicomparison, with columns:
+             donor_hash: hash of the DOI terms and trailing zero flag of the donor
+             title_hash: hash of the DOI title
+             result: reused (from dfprevious) or computed
+    """
+
+    # Content hashes of donors and DOI titles.
+    dfdonor = dfdonordoiterms.merge(gettrailingzeros(dfalldonormetadata=dfalldonormetadata), how='left', on='id')
+    donorhashes = getcontenthashes(dfcontent=dfdonor, key='id')
+    titlehashes = getcontenthashes(dfcontent=dfdoititles[['doi', 'title']].drop_duplicates(subset='doi'), key='doi')
+
+    dfkeys = dfdois[['donorid', 'doi']].astype(str)
+    dfkeys['donor_hash'] = dfkeys['donorid'].map(donorhashes).fillna('')
+    dfkeys['title_hash'] = dfkeys['doi'].map(titlehashes).fillna('')
+
+    # Rows of the previous comparison for the same donor and DOI, with the same hashes.
+    reuse = pd.Series(False, index=dfdois.index)
+    dfreused = None
+    if dfprevious is not None and len(dfprevious) > 0:
+        keys = ['donorid', 'doi', 'donor_hash', 'title_hash']
+        dfprevkeys = dfprevious[keys].astype(str).drop_duplicates()
+        dfprevkeys['previous'] = True
+        reuse = pd.Series(dfkeys.merge(dfprevkeys, how='left', on=keys)['previous'].notna().to_numpy(),
+                          index=dfdois.index)
+        dfreused = dfprevious.astype({'donorid': str, 'doi': str}).merge(dfkeys[reuse.to_numpy()].drop_duplicates(),
+                                                                        how='inner', on=keys)
+        dfreused['result'] = 'reused'
+
+    dfcomputed = getdoicomparison(dfdois=dfdois[~reuse], dfalldonormetadata=dfalldonormetadata,
+                                  dfdonordoiterms=dfdonordoiterms, dfdoititles=dfdoititles)
+    dfcomputed = dfcomputed.astype({'donorid': str, 'doi': str})
+    dfcomputed['donor_hash'] = dfcomputed['donorid'].map(donorhashes).fillna('')
+    dfcomputed['title_hash'] = dfcomputed['doi'].map(titlehashes).fillna('')
+    dfcomputed['result'] = 'computed'
+
+    return pd.concat([dfreused, dfcomputed], ignore_index=True).sort_values(by='donorid')
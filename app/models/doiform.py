@@ -3,7 +3,7 @@ Form used to select a set of donors to which to compare metadata with DOI titles
 for associated datasets.
 """
 
-from wtforms import Form, SelectField, StringField
+from wtforms import Form, SelectField, BooleanField
 from models.appconfig import AppConfig
 
 
@@ -16,8 +16,8 @@ class DOIForm(Form):
     # This field will be used to build the appropriate endpoint URL.
     consortia = cfg.getfieldlist(prefix='CONTEXT_')
     consortium = SelectField('Globus Consortium', choices=consortia)
-    start = StringField('Start position in donor list')
-    batch = StringField('End position in donor list')
+    # The comparison resumes from the donors completed by earlier runs unless the user starts over.
+    restart = BooleanField('Start over (discard donors completed by earlier runs)')
 
     # Clear validation errors. This handles the common use case in which the user returns to the search form after
     # seeing a 4XX error.
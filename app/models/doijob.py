@@ -0,0 +1,100 @@
+# Background job for the comparison of metadata for all donors in a consortium with the DataCite titles of
+# the donors' published datasets. Works with JobManager and DOICheckpoint.
+
+import time
+import logging
+
+# Helper classes
+from models.appconfig import AppConfig
+from models.searchapi import SearchAPI
+from models.doicheckpoint import DOICheckpoint
+from models.datacite import DataCiteAPI
+from models.doicomparison import getdonordoiterms, getcontenthashes
+
+# Configure consistent logging. This is done at the beginning of each module instead of with a superclass of
+# logger to avoid the need to overload function calls to logger.
+logging.basicConfig(format='[%(asctime)s] %(levelname)s in %(module)s: %(message)s',
+                    level=logging.INFO, datefmt='%Y-%m-%d %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+
+def rundoijob(progress, artifactpath: str, consortium: str, token: str, restart: bool = False) -> None:
+    """
+    Builds DOI metadata rows for all donors in a consortium, in batches of donors.
+    The rows for each batch are recorded in the DOI checkpoint when the batch is complete. Donors that are
+    already in the checkpoint--e.g., from a job that was interrupted or an earlier run--are not processed again
+    unless the donor's DOI-related metadata or the DataCite title of one of the donor's DOIs changed.
+
+    Optional keys of the app.cfg file set:
+    - DOI_BATCH: the number of donors in a batch (default 5)
+    - DOI_THROTTLE: seconds to wait after each donor, to limit the rate of calls to DataCite (default 10)
+
+    :param progress: JobProgress for the job
+    :param artifactpath: folder for artifacts (not used; the rows are in the checkpoint)
+    :param consortium: consortium
+    :param token: globus groups_token for the consortium
+    :param restart: if true, clear the checkpoint and process all donors
+    :return: None
+    """
+
+    cfg = AppConfig()
+    batchsize = max(int(cfg.getfield(key='DOI_BATCH', default='5')), 1)
+    throttle = float(cfg.getfield(key='DOI_THROTTLE', default='10'))
+
+    checkpoint = DOICheckpoint(consortium=consortium)
+    if restart:
+        checkpoint.clear()
+
+    progress(phase='searching and flattening donor metadata')
+    search = SearchAPI(consortium=consortium, token=token)
+    # Use the base metadata dataframe to build the DOI-related metadata.
+    search.dfalldonormetadata = search.getalldonormetadata(progress=progress)
+
+    listdonorid = search.dfalldonormetadata['id'].drop_duplicates().to_list()
+    listdonorid.sort()
+    # Hashes of the DOI-related metadata of donors.
+    donorhashes = getcontenthashes(dfcontent=getdonordoiterms(dfalldonormetadata=search.dfalldonormetadata),
+                                   key='id').to_dict()
+
+    # Completed donors for which DataCite has a different title for a DOI than the title in the checkpoint.
+    progress(phase='checking DOI titles in DataCite')
+    changed = set()
+    dftitles = checkpoint.gettitles()
+    if len(dftitles) > 0:
+        listcurrent = DataCiteAPI(consortium=consortium).getalldatacitetitles()
+        dictcurrent = {doi.get('doi'): str(doi.get('title')) for doi in listcurrent}
+        doi = dftitles['doi_url'].str.replace('https://doi.org/', '', regex=False).str.upper()
+        dftitles['current'] = doi.map(dictcurrent)
+        dfchanged = dftitles[dftitles['current'].notna() & (dftitles['current'] != dftitles['doi_title'])]
+        changed = set(dfchanged['donorid'])
+
+    completed = checkpoint.getcompleteddonors()
+    listremaining = [donorid for donorid in listdonorid
+                     if completed.get(donorid) != donorhashes.get(donorid) or donorid in changed]
+    reused = len(listdonorid) - len(listremaining)
+
+    progress(phase='comparing donor metadata with DOI titles', compared=reused, total=len(listdonorid),
+             reused=reused, computed=0, failed=0)
+
+    computed = 0
+    failed = 0
+    for start in range(0, len(listremaining), batchsize):
+        dictbatch = {}
+        dicthashes = {}
+        for donorid in listremaining[start:start + batchsize]:
+            try:
+                dictbatch[donorid] = search.getdonordoimetadata(donorid=donorid, geturls=True)
+                dicthashes[donorid] = donorhashes.get(donorid)
+            except Exception as e:
+                # Record the error as the row of the donor, without the hash of the donor's metadata, so that
+                # the job continues with the other donors and a later run compares the donor again.
+                logger.error(f'DOI comparison failed for donor {donorid}: {e}', exc_info=True)
+                dictbatch[donorid] = [{'id': donorid, 'doi_url': 'error', 'doi_title': str(e)}]
+                dicthashes[donorid] = ''
+                failed = failed + 1
+            time.sleep(throttle)
+        checkpoint.adddonors(dictdonors=dictbatch, dicthashes=dicthashes)
+        computed = computed + len(dictbatch)
+        progress(compared=reused + computed, computed=computed, failed=failed)
+
+    return None
@@ -17,11 +17,14 @@ from models.searchapi import SearchAPI
 
 class DonorData:
 
-    def __init__(self, donorid: str, token: str, isforupdate: bool = False):
+    def __init__(self, donorid: str, token: str, isforupdate: bool = False, dictentity: dict = None):
         """
         :param donorid: ID of a donor in a context.
         :param isforupdate: Is this for an update, or existing metadata?
         :param token: globus groups_token for the consortium's entity-api
+        :param dictentity: optional dict of the donor entity that was already obtained--e.g., by
+                           loaddonordata from the search-api--with keys metadata, entity_type and source_type.
+                           If specified, the metadata is not obtained from the entity-api.
         """
 
         self.donorid = donorid
@@ -35,6 +38,9 @@ class DonorData:
         if isforupdate:
             # This instance will contain new metadata.
             self.metadata = {}
+        elif dictentity is not None:
+            # This instance will contain existing metadata, loaded in a batch.
+            self.metadata = self.entity.getdonormetadatafromentity(rjson=dictentity)
         else:
             # This instance will contain existing metadata.
             self.metadata = self.entity.getdonormetadata()
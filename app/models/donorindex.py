@@ -0,0 +1,205 @@
+"""
+In-memory index of the donors in a stored export, for boolean and range queries.
+
+Filtering the flattened export for questions such as "donors aged 40-60 with HbA1c > 6.5 and type 2 diabetes"
+scans every metadata element for each condition. The index is built once from the flattened DataFrame:
+- for each concept (concept_id), the sorted array of the donors with an element for the concept
+- for each grouping concept with numeric data values (e.g., measurements) and each of its units, the data values
+  in sorted order, with the donor of each value, so that a range is found with a binary search. Values are kept
+  separately by units, because elements of a grouping concept can have different units--e.g., age in years and
+  age in months.
+
+Donors are represented in the index by integer codes, so that conditions are combined with set operations on
+sorted integer arrays.
+
+A query is a JSON object with one of the keys:
+- concept: a concept_id--e.g., {"concept": "C0011860"}
+- range: a grouping concept, with optional bounds gt, gte, lt, lte, and the units of the values--e.g.,
+  {"range": "C0001779", "units": "years", "gte": 40, "lte": 60}. The units can be omitted if the values of the
+  grouping concept have one unit (or none).
+- and, or: a list of queries--e.g., {"and": [{"concept": "C0011860"}, {"range": "C0001779", "units": "years",
+  "gte": 40}]}
+- not: a query
+
+Indexes are shared by all instances of the class in the worker process, keyed by export id. An index refers to its
+export weakly, so that an export that expires from the export cache is not kept in memory by its index; the index
+is discarded with the export. The number of indexes kept is set by the optional QUERY_INDEX_CACHE key of the
+app.cfg file (default 4).
+
+"""
+import threading
+import weakref
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+# Helper classes
+from models.appconfig import AppConfig
+from models.compactframe import NUMBERCOLUMN
+
+# Bounds of a range query, with the side of the binary search for each.
+RANGEBOUNDS = {'gt': 'right', 'gte': 'left', 'lt': 'left', 'lte': 'right'}
+# Separator of grouping concept and units in the keys of the numeric index
+KEYSEPARATOR = '\t'
+
+
+class DonorIndex:
+
+    # Indexes, keyed by export id, in order of use. Each entry is a tuple of a weak reference to the export and the
+    # index.
+    _store = OrderedDict()
+    _lock = threading.Lock()
+
+    def __init__(self, dfexport: pd.DataFrame):
+        """
+        Builds the index.
+        :param dfexport: DataFrame of flattened donor metadata, in either representation
+        """
+
+        donors = dfexport['id'].astype(str).astype('category')
+        self.donorids = donors.cat.categories.to_numpy()
+        donorcodes = donors.cat.codes.to_numpy()
+        self.alldonors = np.arange(len(self.donorids))
+
+        # Concept -> donors
+        dfconcepts = pd.DataFrame({'concept': dfexport['concept_id'].astype(str).str.strip(), 'donor': donorcodes})
+        dfconcepts = dfconcepts.drop_duplicates().sort_values(by=['concept', 'donor'])
+        self.concepts = self._split(keys=dfconcepts['concept'].to_numpy(), values=dfconcepts['donor'].to_numpy())
+
+        # Grouping concept -> units -> sorted numeric values, with donors
+        if NUMBERCOLUMN in dfexport.columns:
+            numbers = dfexport[NUMBERCOLUMN].to_numpy(dtype='float64')
+        else:
+            numbers = pd.to_numeric(dfexport['data_value'], errors='coerce').to_numpy(dtype='float64')
+        if 'units' in dfexport.columns:
+            units = dfexport['units'].astype(str).where(dfexport['units'].notna(), '').str.strip().str.lower()
+        else:
+            units = pd.Series('', index=dfexport.index)
+        dfnumbers = pd.DataFrame({'key': dfexport['grouping_concept'].astype(str).str.strip() + KEYSEPARATOR + units,
+                                  'value': numbers, 'donor': donorcodes})
+        dfnumbers = dfnumbers[np.isfinite(dfnumbers['value'])].sort_values(by=['key', 'value'])
+        values = self._split(keys=dfnumbers['key'].to_numpy(), values=dfnumbers['value'].to_numpy())
+        donorsbyvalue = self._split(keys=dfnumbers['key'].to_numpy(), values=dfnumbers['donor'].to_numpy())
+        self.numbers = {}
+        for key in values:
+            group, unit = key.split(KEYSEPARATOR, 1)
+            self.numbers.setdefault(group, {})[unit] = (values[key], donorsbyvalue[key])
+
+    @staticmethod
+    def _split(keys: np.ndarray, values: np.ndarray) -> dict:
+        """
+        Splits an array of values into arrays keyed by the values of a sorted key array.
+        """
+
+        if len(keys) == 0:
+            return {}
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        return dict(zip(keys[starts], np.split(values, starts[1:])))
+
+    @classmethod
+    def getindex(cls, exportid: str, dfexport: pd.DataFrame):
+        """
+        Returns the index for a stored export, building it if necessary.
+        :param exportid: export id
+        :param dfexport: the stored export DataFrame
+        """
+
+        with cls._lock:
+            # Discard the indexes of expired exports.
+            for key in [key for key, entry in cls._store.items() if entry[0]() is None]:
+                cls._store.pop(key)
+            entry = cls._store.get(exportid)
+            if entry is not None and entry[0]() is dfexport:
+                cls._store.move_to_end(exportid)
+                return entry[1]
+
+        index = DonorIndex(dfexport=dfexport)
+        maxindexes = max(int(AppConfig().getfield(key='QUERY_INDEX_CACHE', default='4')), 1)
+        with cls._lock:
+            cls._store[exportid] = (weakref.ref(dfexport), index)
+            cls._store.move_to_end(exportid)
+            while len(cls._store) > maxindexes:
+                cls._store.popitem(last=False)
+        return index
+
+    def getconceptdonors(self, concept: str) -> np.ndarray:
+        """
+        Returns the codes of donors with an element for a concept.
+        """
+
+        return self.concepts.get(concept, np.array([], dtype=self.alldonors.dtype))
+
+    def getrangedonors(self, grouping_concept: str, bounds: dict, units: str = None) -> np.ndarray:
+        """
+        Returns the codes of donors with a numeric data value in a range for a grouping concept.
+        :param grouping_concept: grouping concept
+        :param bounds: dict with optional keys gt, gte, lt, lte
+        :param units: units of the values (case-insensitive). Required if the values of the grouping concept have
+                      more than one unit, so that values in different units are not compared with the same bounds.
+        """
+
+        dictunits = self.numbers.get(grouping_concept, {})
+        if units is None:
+            if len(dictunits) > 1:
+                raise ValueError(f'The values of {grouping_concept} have more than one unit '
+                                 f'({", ".join(sorted(dictunits))}). Specify the units of the range.')
+            units = next(iter(dictunits), '')
+        units = str(units).strip().lower()
+        if units not in dictunits:
+            return np.array([], dtype=self.alldonors.dtype)
+        values, donors = dictunits[units]
+        start = 0
+        end = len(values)
+        for bound, side in RANGEBOUNDS.items():
+            if bound in bounds:
+                position = int(np.searchsorted(values, float(bounds[bound]), side=side))
+                if bound in ['gt', 'gte']:
+                    start = max(start, position)
+                else:
+                    end = min(end, position)
+        return np.unique(donors[start:end])
+
+    def query(self, dictquery: dict) -> np.ndarray:
+        """
+        Evaluates a query.
+        :param dictquery: query, in the format described for the module
+        :return: sorted array of the codes of matching donors
+        """
+
+        if not isinstance(dictquery, dict) or len(dictquery) == 0:
+            raise ValueError(f'A query must be a JSON object; found {dictquery}.')
+        if 'concept' in dictquery:
+            return self.getconceptdonors(concept=str(dictquery['concept']).strip())
+        if 'range' in dictquery:
+            bounds = {bound: dictquery[bound] for bound in RANGEBOUNDS if bound in dictquery}
+            if len(bounds) == 0:
+                raise ValueError(f'A range query must have at least one of {", ".join(RANGEBOUNDS)}.')
+            try:
+                bounds = {bound: float(value) for bound, value in bounds.items()}
+            except (TypeError, ValueError):
+                raise ValueError(f'The bounds of a range query must be numbers; found {bounds}.')
+            return self.getrangedonors(grouping_concept=str(dictquery['range']).strip(), bounds=bounds,
+                                       units=dictquery.get('units'))
+        if 'and' in dictquery or 'or' in dictquery:
+            operator = 'and' if 'and' in dictquery else 'or'
+            subqueries = dictquery[operator]
+            if not isinstance(subqueries, list) or len(subqueries) == 0:
+                raise ValueError(f'The value of {operator} must be a list of queries.')
+            results = [self.query(dictquery=subquery) for subquery in subqueries]
+            donors = results[0]
+            for result in results[1:]:
+                if operator == 'and':
+                    donors = np.intersect1d(donors, result, assume_unique=True)
+                else:
+                    donors = np.union1d(donors, result)
+            return donors
+        if 'not' in dictquery:
+            return np.setdiff1d(self.alldonors, self.query(dictquery=dictquery['not']), assume_unique=True)
+        raise ValueError(f'Unknown query {dictquery}. A query must have one of the keys concept, range, and, or, not.')
+
+    def getdonorids(self, donors: np.ndarray) -> list:
+        """
+        Converts donor codes to donor ids.
+        """
+
+        return self.donorids[donors].tolist()
@@ -0,0 +1,141 @@
+# Local SQLite replica of the flattened metadata of the donors in the consortia.
+# Building the flattened metadata for all donors in a consortium requires a sweep of the search-api. The replica
+# keeps the result of the latest sweep for each consortium in a SQLite database, with indexes on donor id,
+# concept_id and grouping_concept, so that reports and ad hoc analyses can run indexed SQL instead of sweeping
+# the search-api again. The database is a single file that can be copied--e.g., to an analyst's machine.
+#
+# The metadata table has a row for each metadata element, with a consortium column, the columns of the
+# flattened metadata (all text), and a data_value_number column with the data value parsed as a number.
+# Metadata keys that are new to the replica are added as columns.
+# Because this file is used by both the donor-metadata app and scripts in the
+# validate path, it does not import other helper classes.
+
+import sqlite3
+import time
+from contextlib import closing
+import numpy as np
+import pandas as pd
+
+# Columns of the metadata table that are not columns of the flattened metadata.
+REPLICACOLUMNS = ['consortium', 'data_value_number']
+
+
+class DonorReplica:
+
+    def __init__(self, dbfile: str):
+        """
+        :param dbfile: path to the SQLite database file. The database is created if it does not exist.
+        """
+
+        self.dbfile = dbfile
+        self._createtables()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.dbfile, timeout=30)
+
+    def _createtables(self):
+        with closing(self._connect()) as conn:
+            with conn:
+                # Write-ahead logging allows reports to read while a sweep is written.
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.execute('CREATE TABLE IF NOT EXISTS metadata ('
+                             'consortium TEXT NOT NULL, '
+                             'id TEXT NOT NULL, '
+                             'source_name TEXT, '
+                             'concept_id TEXT, '
+                             'grouping_concept TEXT, '
+                             'data_value TEXT, '
+                             'data_value_number REAL, '
+                             'units TEXT)')
+                conn.execute('CREATE INDEX IF NOT EXISTS metadata_id ON metadata (id)')
+                conn.execute('CREATE INDEX IF NOT EXISTS metadata_concept ON metadata (concept_id)')
+                conn.execute('CREATE INDEX IF NOT EXISTS metadata_grouping ON metadata (grouping_concept)')
+                conn.execute('CREATE INDEX IF NOT EXISTS metadata_consortium ON metadata (consortium)')
+                conn.execute('CREATE TABLE IF NOT EXISTS sweeps ('
+                             'consortium TEXT PRIMARY KEY, '
+                             'refreshed REAL, '  # time of the sweep, in seconds since the epoch
+                             'donors INTEGER, '
+                             'elements INTEGER)')
+
+    def replaceconsortium(self, consortium: str, dfmetadata: pd.DataFrame):
+        """
+        Replaces the metadata of a consortium with the result of a sweep, in a single transaction, so that readers
+        see either the previous or the new sweep.
+        :param consortium: consortium (e.g., CONTEXT_HUBMAP)
+        :param dfmetadata: DataFrame of flattened metadata for all donors in the consortium
+                           (SearchAPI.getalldonormetadata), in either representation
+        """
+
+        columns = [col for col in dfmetadata.columns if col not in REPLICACOLUMNS]
+        dfrows = dfmetadata[columns].astype(str).where(dfmetadata[columns].notna(), '')
+        number = pd.to_numeric(dfmetadata['data_value'], errors='coerce') if 'data_value' in columns \
+            else pd.Series(np.nan, index=dfmetadata.index)
+        dfrows.insert(0, 'consortium', consortium)
+        dfrows['data_value_number'] = number.astype(object).where(number.notna(), None)
+
+        with closing(self._connect()) as conn:
+            with conn:
+                tablecolumns = [row[1] for row in conn.execute('PRAGMA table_info(metadata)').fetchall()]
+                for col in columns:
+                    if col not in tablecolumns:
+                        conn.execute(f'ALTER TABLE metadata ADD COLUMN {self._quote(col)} TEXT')
+                conn.execute('DELETE FROM metadata WHERE consortium=?', (consortium,))
+                sqlcolumns = ', '.join(self._quote(col) for col in dfrows.columns)
+                placeholders = ', '.join('?' * len(dfrows.columns))
+                conn.executemany(f'INSERT INTO metadata ({sqlcolumns}) VALUES ({placeholders})',
+                                 dfrows.itertuples(index=False, name=None))
+                conn.execute('INSERT OR REPLACE INTO sweeps (consortium, refreshed, donors, elements) '
+                             'VALUES (?, ?, ?, ?)',
+                             (consortium, time.time(), int(dfrows['id'].nunique()), len(dfrows)))
+            # Move the transaction from the write-ahead log to the database file, so that the file can be copied.
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    @staticmethod
+    def _quote(col: str) -> str:
+        return '"' + col.replace('"', '""') + '"'
+
+    def getsweep(self, consortium: str) -> dict:
+        """
+        Returns information on the latest sweep of a consortium.
+        :param consortium: consortium
+        :return: dict with keys refreshed (seconds since the epoch), donors, elements; or None if the replica has
+                 no sweep for the consortium
+        """
+
+        with closing(self._connect()) as conn:
+            row = conn.execute('SELECT refreshed, donors, elements FROM sweeps WHERE consortium=?',
+                               (consortium,)).fetchone()
+        if row is None:
+            return None
+        return {'refreshed': row[0], 'donors': row[1], 'elements': row[2]}
+
+    def getdonormetadata(self, consortium: str, donorids: list = None) -> pd.DataFrame:
+        """
+        Returns flattened donor metadata from the replica, in the format of SearchAPI.getalldonormetadata.
+        :param consortium: consortium
+        :param donorids: optional list of donor ids; by default, all donors
+        :return: DataFrame of flattened metadata, or None if the replica has no sweep for the consortium
+        """
+
+        if self.getsweep(consortium=consortium) is None:
+            return None
+        sql = 'SELECT * FROM metadata WHERE consortium=?'
+        params = [consortium]
+        if donorids is not None:
+            sql = f'{sql} AND id IN (SELECT value FROM json_each(?))'
+            params.append(pd.Series(donorids, dtype=str).to_json(orient='values'))
+        dfmetadata = self.query(sql=f'{sql} ORDER BY rowid', params=params)
+        # Columns for metadata keys of other consortia are empty.
+        dfmetadata = dfmetadata.drop(columns=REPLICACOLUMNS).dropna(axis='columns', how='all')
+        return dfmetadata.fillna('')
+
+    def query(self, sql: str, params: list = None) -> pd.DataFrame:
+        """
+        Runs a SQL query against the replica--e.g., for a report.
+        :param sql: SELECT statement
+        :param params: optional parameters for the placeholders of the statement
+        :return: DataFrame of results
+        """
+
+        with closing(self._connect()) as conn:
+            return pd.read_sql_query(sql, conn, params=params)
@@ -71,33 +71,8 @@ class Entity:
         url = f'{self.urlbase}.{self.consortium}.org/entities/{self.donorid}'
         response = requests.get(url=url, headers=self.headers)
 
-        donor = {}
         if response.status_code == 200:
-            rjson = response.json()
-            entity_type = rjson.get('entity_type')
-
-            if entity_type not in ['Donor', 'Source']:
-                if self.consortium == 'hubmapconsortium':
-                    target = "Donors"
-                else:
-                    target = "Sources"
-
-                msg = (f'ID {self.donorid} is an entity of type {entity_type}. '
-                       f'This application works only with {target}.')
-                abort(400, msg)
-
-            if self.consortium == 'sennetconsortium':
-                source_type = rjson.get('source_type')
-                if source_type != 'Human':
-                    msg = (f'ID {self.donorid} is an source of type {source_type}. '
-                           f'This application works only with human sources.')
-                    abort(400, msg)
-                self.source_type = source_type
-            else:
-                self.source_type = 'Human'
-
-            donor = rjson.get('metadata')
-            return donor
+            return self.getdonormetadatafromentity(rjson=response.json())
 
         elif response.status_code == 404:
             abort(404, f'No donor with id {self.donorid} found in provenance for {self.consortium} '
@@ -114,6 +89,39 @@ class Entity:
             abort(response.status_code, f'Error after calling /entities GET endpoint in entity-api '
                                         f'for donor {self.donorid}')
 
+    def getdonormetadatafromentity(self, rjson: dict) -> dict:
+        """
+        Checks that an entity is a donor (or a human source), and returns the entity's metadata.
+        Used for both the response of the entity-api and the _source of a search-api hit--e.g., for donors
+        loaded in a batch.
+        :param rjson: dict of the entity, with keys entity_type, source_type (SenNet), and metadata
+        :return: a dict that corresponds to the metadata object, or aborts
+        """
+
+        entity_type = rjson.get('entity_type')
+
+        if entity_type not in ['Donor', 'Source']:
+            if self.consortium == 'hubmapconsortium':
+                target = "Donors"
+            else:
+                target = "Sources"
+
+            msg = (f'ID {self.donorid} is an entity of type {entity_type}. '
+                   f'This application works only with {target}.')
+            abort(400, msg)
+
+        if self.consortium == 'sennetconsortium':
+            source_type = rjson.get('source_type')
+            if source_type != 'Human':
+                msg = (f'ID {self.donorid} is an source of type {source_type}. '
+                       f'This application works only with human sources.')
+                abort(400, msg)
+            self.source_type = source_type
+        else:
+            self.source_type = 'Human'
+
+        return rjson.get('metadata')
+
     def updatedonormetadata(self, dict_metadata: dict):
         """
         Updates  metadata for donor in a consortium, using the entity-api.
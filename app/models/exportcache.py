@@ -0,0 +1,86 @@
+"""
+Server-side store for export DataFrames.
+
+The export review workflow renders a table of donor metadata and then downloads the same metadata
+as a file. Building the DataFrame for all donors in a consortium requires a full sweep of the search-api and
+flattening of every donor's metadata, so the DataFrame is computed once and stored in the worker process under
+an export id. The export id is passed between the pages of the workflow; the DataFrame is too large to be stored
+in the session cookie.
+
+Stored exports expire after a time to live (TTL), set in minutes by the optional EXPORT_CACHE_TTL key of the
+app.cfg file.
+
+"""
+import threading
+import time
+import uuid
+import pandas as pd
+
+# Helper classes
+from models.appconfig import AppConfig
+
+
+class ExportCache:
+
+    # The store is shared by all instances of the class in the worker process.
+    # Each entry is keyed by export id and is a dict with keys:
+    #   dfexport: the export DataFrame
+    #   scope: the consortium or donor id for the export
+    #   expires: expiration time, in seconds since the epoch
+    _store = {}
+    _lock = threading.Lock()
+
+    def __init__(self):
+
+        cfg = AppConfig()
+        # Default TTL of 30 minutes.
+        self.ttl = int(cfg.getfield(key='EXPORT_CACHE_TTL', default='30')) * 60
+
+    def addexport(self, dfexport: pd.DataFrame, scope: str, exportid: str = None) -> str:
+        """
+        Stores an export DataFrame.
+        :param dfexport: DataFrame of flattened donor metadata
+        :param scope: consortium or donor id for the export
+        :param exportid: optional export id--e.g., the id of the background job that built the export.
+        :return: the export id for the stored DataFrame
+        """
+
+        if exportid is None:
+            exportid = uuid.uuid4().hex
+        with self._lock:
+            self._purge()
+            self._store[exportid] = {'dfexport': dfexport,
+                                     'scope': scope,
+                                     'expires': time.time() + self.ttl}
+        return exportid
+
+    def getexport(self, exportid: str, scope: str = None) -> pd.DataFrame:
+        """
+        Returns a stored export DataFrame.
+        :param exportid: export id returned by addexport
+        :param scope: optional consortium or donor id that the stored export must match
+        :return: the DataFrame, or None if there is no unexpired export for the id.
+        """
+
+        if exportid is None:
+            return None
+
+        with self._lock:
+            entry = self._store.get(exportid)
+            if entry is None:
+                return None
+            if entry['expires'] < time.time():
+                self._store.pop(exportid)
+                return None
+            if scope is not None and entry['scope'] != scope:
+                return None
+            return entry['dfexport']
+
+    def _purge(self):
+        """
+        Removes expired exports. Called with the lock held.
+        """
+
+        now = time.time()
+        for exportid in [k for k, v in self._store.items() if v['expires'] < now]:
+            self._store.pop(exportid)
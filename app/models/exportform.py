@@ -2,7 +2,7 @@
 Form used to select a set of donors to export.
 """
 
-from wtforms import Form, SelectField
+from wtforms import Form, SelectField, BooleanField
 from models.appconfig import AppConfig
 
 
@@ -16,6 +16,10 @@ class ExportForm(Form):
     consortia = cfg.getfieldlist(prefix='CONTEXT_')
     consortium = SelectField('Globus Consortium', choices=consortia)
 
+    # Combine the donors of all consortia in one export. This requires a login to each consortium.
+    combined = BooleanField('Combine with the donors of all other consortia')
+
     # Clear validation errors. This handles the common use case in which the user returns to the search form after
     # seeing a 4XX error.
     consortium.errors = []
+    combined.errors = []
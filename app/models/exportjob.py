@@ -0,0 +1,153 @@
+# Background job for the export of metadata for all donors in a consortium. Works with JobManager.
+
+import os
+import sqlite3
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import pyarrow.parquet as pq
+
+# Helper classes
+from models.searchapi import SearchAPI
+from models.exportcache import ExportCache
+from models.compactframe import getcompactframe
+from models.donorreplica import DonorReplica
+from models.appconfig import AppConfig
+from models.snapshot import writesnapshot, publishsnapshot, SnapshotReader
+
+# Configure consistent logging. This is done at the beginning of each module instead of with a superclass of
+# logger to avoid the need to overload function calls to logger.
+logging.basicConfig(format='[%(asctime)s] %(levelname)s in %(module)s: %(message)s',
+                    level=logging.INFO, datefmt='%Y-%m-%d %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+# Scope of the export that combines the donors of all consortia.
+COMBINEDSCOPE = 'COMBINED'
+
+
+def runexportjob(progress, artifactpath: str, consortium: str, token: str) -> str:
+    """
+    Builds the export DataFrame for all donors in a consortium, in the memory-compact representation.
+    The DataFrame is stored in the export cache under the job id, and written to an Arrow IPC snapshot so that
+    other worker processes--and this one, after the export expires from the cache--can memory-map it. The snapshot
+    is also published as the latest snapshot for the consortium.
+
+    :param progress: JobProgress for the job
+    :param artifactpath: folder for the artifact
+    :param consortium: consortium
+    :param token: globus groups_token for the consortium
+    :return: path to the artifact
+    """
+
+    progress(phase='searching and flattening donor metadata')
+    search = SearchAPI(consortium=consortium, token=token)
+    dfexport = search.getalldonormetadata(progress=progress, compact=True)
+
+    progress(phase='updating local replica')
+    updatereplica(consortium=consortium, dfexport=dfexport)
+
+    progress(phase='storing export')
+    artifact = os.path.join(artifactpath, f'{progress.jobid}.arrow')
+    storesnapshot(dfexport=dfexport, artifact=artifact, scope=consortium)
+    ExportCache().addexport(dfexport=dfexport, scope=consortium, exportid=progress.jobid)
+
+    return artifact
+
+
+def runcombinedexportjob(progress, artifactpath: str, tokens: dict) -> str:
+    """
+    Builds a single export DataFrame for the donors of several consortia. The search-api sweeps of the
+    consortia run concurrently, so that the job takes about as long as the slowest sweep.
+    The id column has the hubmap_id or sennet_id of the donor; a consortium column identifies the consortium.
+    The DataFrame is stored in the export cache and written to a snapshot, as for runexportjob.
+
+    :param progress: JobProgress for the job
+    :param artifactpath: folder for the artifact
+    :param tokens: globus groups_tokens, keyed by consortium
+    :return: path to the artifact
+    """
+
+    names = {consortium: consortium.split('_')[1].lower() for consortium in tokens}
+    progress(phase=f'searching and flattening donor metadata for {", ".join(names.values())}')
+
+    # Counts from the concurrent sweeps are reported both by consortium (e.g., hubmap_pages) and as totals.
+    dictcounts = {}
+    lock = threading.Lock()
+
+    def getconsortiumprogress(name: str):
+        def consortiumprogress(phase: str = None, **counts):
+            with lock:
+                for key, value in counts.items():
+                    dictcounts[f'{name}_{key}'] = value
+                totals = {key: sum(dictcounts.get(f'{n}_{key}', 0) for n in names.values()) for key in counts}
+                progress(**dictcounts, **totals)
+        return consortiumprogress
+
+    def getconsortiumexport(consortium: str) -> pd.DataFrame:
+        search = SearchAPI(consortium=consortium, token=tokens[consortium])
+        dfconsortium = search.getalldonormetadata(progress=getconsortiumprogress(name=names[consortium]))
+        updatereplica(consortium=consortium, dfexport=dfconsortium)
+        dfconsortium.insert(1, 'consortium', names[consortium])
+        return dfconsortium
+
+    with ThreadPoolExecutor(max_workers=len(tokens), thread_name_prefix='export') as executor:
+        # Results are in the order of the consortia; result() raises the error of a failed sweep.
+        listexport = [future.result() for future in [executor.submit(getconsortiumexport, consortium)
+                                                     for consortium in tokens]]
+
+    progress(phase='storing export')
+    # The consortia can have different metadata keys. The frames of the consortia have different categories, so
+    # the combined frame is made compact after it is concatenated.
+    dfexport = getcompactframe(pd.concat(listexport, ignore_index=True).fillna(''))
+    artifact = os.path.join(artifactpath, f'{progress.jobid}.arrow')
+    storesnapshot(dfexport=dfexport, artifact=artifact, scope=COMBINEDSCOPE)
+    ExportCache().addexport(dfexport=dfexport, scope=COMBINEDSCOPE, exportid=progress.jobid)
+
+    return artifact
+
+
+def storesnapshot(dfexport: pd.DataFrame, artifact: str, scope: str):
+    """
+    Writes the snapshot of an export and publishes the snapshot as the latest snapshot for the scope.
+    :param dfexport: export DataFrame
+    :param artifact: path for the snapshot
+    :param scope: export scope
+    """
+
+    writesnapshot(dfsnapshot=dfexport, path=artifact)
+    publishsnapshot(artifact=artifact, scope=scope)
+
+
+def updatereplica(consortium: str, dfexport: pd.DataFrame):
+    """
+    Replaces the metadata of a consortium in the local replica (donors.db in the folder of the app.cfg) with the
+    result of a sweep. The replica is secondary to the export, so a failure is logged instead of failing the job.
+    :param consortium: consortium
+    :param dfexport: DataFrame of flattened donor metadata for the consortium
+    """
+
+    try:
+        replica = DonorReplica(dbfile=os.path.join(AppConfig().path, 'donors.db'))
+        replica.replaceconsortium(consortium=consortium, dfmetadata=dfexport)
+    except sqlite3.Error as e:
+        logger.error(f'Failed to update the donor replica for {consortium}: {e}', exc_info=True)
+
+
+def loadexportartifact(artifact: str) -> pd.DataFrame:
+    """
+    Reads the export DataFrame from the artifact of an export job.
+    :param artifact: path to the artifact
+    :return: DataFrame of flattened donor metadata: for an Arrow IPC snapshot, a DataFrame backed by the
+             memory-mapped file; for the Parquet artifact of an earlier version of the app, the memory-compact
+             representation
+    """
+
+    if artifact.endswith('.arrow'):
+        return SnapshotReader.getsnapshot(path=artifact)
+
+    dfexport = pq.read_table(artifact).to_pandas()
+    # Restore the dictionary-encoded columns to strings, and then build the compact representation.
+    for col in dfexport.select_dtypes(include='category').columns:
+        dfexport[col] = dfexport[col].astype(str)
+    return getcompactframe(dfexport)
@@ -0,0 +1,51 @@
+# Returns a page of rows from an export DataFrame, for incremental display of large exports in the
+# export review page.
+
+import pandas as pd
+
+# Helper classes
+from models.compactframe import getexportframe
+
+
+def getexportpage(dfexport: pd.DataFrame, page: int = 1, size: int = 100, sort: str = None,
+                  ascending: bool = True, filters: dict = None) -> dict:
+    """
+    Filters, sorts, and slices an export DataFrame.
+    :param dfexport: DataFrame of flattened donor metadata
+    :param page: 1-based page number
+    :param size: number of rows in a page
+    :param sort: optional column by which to sort rows
+    :param ascending: sort order
+    :param filters: optional dict of column: value. A row is kept if the column contains the value,
+                    ignoring case.
+    :return: dict with keys
+             columns: list of column names
+             rows: list of lists of row values for the page
+             page: page number
+             size: page size
+             total: number of rows in the export
+             filtered: number of rows after filtering
+    """
+
+    # Derived columns of the compact representation are not displayed.
+    dfexport = getexportframe(dfexport)
+    dfpage = dfexport
+
+    if filters is not None:
+        for col, value in filters.items():
+            if col in dfpage.columns and value != '':
+                dfpage = dfpage.loc[dfpage[col].astype(str).str.contains(value, case=False, regex=False)]
+
+    if sort is not None and sort in dfpage.columns:
+        # Use a stable sort, so that the rows for a donor stay in order.
+        dfpage = dfpage.sort_values(by=sort, ascending=ascending, kind='stable')
+
+    start = (page - 1) * size
+    dfslice = dfpage.iloc[start:start + size]
+
+    return {'columns': dfexport.columns.to_list(),
+            'rows': dfslice.fillna('').astype(str).values.tolist(),
+            'page': page,
+            'size': size,
+            'total': len(dfexport),
+            'filtered': len(dfpage)}
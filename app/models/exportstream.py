@@ -0,0 +1,192 @@
+# Generators that serialize an export DataFrame in chunks of rows, for streamed download responses.
+# A streamed response sends the first rows of a large export without waiting for the complete file to be
+# built in memory.
+
+import zlib
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+
+# Helper classes
+from models.compactframe import getexportframe
+
+# Export formats, keyed by file extension, with the content type of the download.
+exportcontenttypes = {'csv': 'text/csv',
+                      'tsv': 'text/tsv',
+                      'csv.gz': 'application/gzip',
+                      'tsv.gz': 'application/gzip',
+                      'jsonl': 'application/x-ndjson',
+                      'parquet': 'application/vnd.apache.parquet',
+                      'arrow': 'application/vnd.apache.arrow.file'}
+
+# Columns with values that repeat heavily across donors. The binary formats store these columns with
+# dictionary encoding.
+categoricalcolumns = ['concept_id', 'grouping_concept', 'preferred_term', 'SAB', 'units', 'consortium']
+
+
+class _ChunkSink:
+    """
+    Write-only file object for pyarrow writers. Bytes written since the last drain are returned by drain, so that
+    a generator can yield the output of a writer as it is produced.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        self.buffer += bytes(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        # Writers record file offsets, so tell reports the total number of bytes written.
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+def gzipchunks(chunks):
+    """
+    Compresses a sequence of byte strings into a gzip stream.
+    :param chunks: iterable of bytes
+    :return: generator of gzip-compressed bytes
+    """
+
+    # A wbits value of 31 writes a gzip header and trailer.
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def streamdelimited(dfexport: pd.DataFrame, sep: str, chunksize: int = 5000, compress: bool = False):
+    """
+    Serializes an export DataFrame as delimited text, a chunk of rows at a time.
+    :param dfexport: DataFrame of flattened donor metadata
+    :param sep: delimiter--e.g., ',' for CSV or '\\t' for TSV
+    :param chunksize: number of rows to serialize at a time
+    :param compress: if true, gzip-compress the stream
+    :return: generator of bytes
+    """
+
+    # An empty export still has a header.
+    dfchunks = (dfexport.iloc[start:start + chunksize] for start in range(0, max(len(dfexport), 1), chunksize))
+    return streamdelimitedframes(dfchunks=dfchunks, sep=sep, compress=compress)
+
+
+def streamdelimitedframes(dfchunks, sep: str, compress: bool = False):
+    """
+    Serializes a sequence of DataFrames with the same columns--e.g., chunks of rows read from a database--as
+    delimited text.
+    :param dfchunks: iterable of DataFrames
+    :param sep: delimiter
+    :param compress: if true, gzip-compress the stream
+    :return: generator of bytes
+    """
+
+    def chunks():
+        # The header is written with the first chunk.
+        header = True
+        for dfchunk in dfchunks:
+            yield dfchunk.to_csv(index=False, sep=sep, header=header).encode('utf-8')
+            header = False
+
+    if compress:
+        return gzipchunks(chunks())
+    return chunks()
+
+
+def streamjsonlines(dfexport: pd.DataFrame, chunksize: int = 5000, compress: bool = False):
+    """
+    Serializes an export DataFrame as JSON Lines (one JSON object per row), a chunk of rows at a time.
+    :param dfexport: DataFrame of flattened donor metadata
+    :param chunksize: number of rows to serialize at a time
+    :param compress: if true, gzip-compress the stream
+    :return: generator of bytes
+    """
+
+    def chunks():
+        for start in range(0, len(dfexport), chunksize):
+            dfchunk = dfexport.iloc[start:start + chunksize]
+            yield dfchunk.to_json(orient='records', lines=True, force_ascii=False).encode('utf-8')
+
+    if compress:
+        return gzipchunks(chunks())
+    return chunks()
+
+
+def getarrowtable(dfexport: pd.DataFrame) -> pa.Table:
+    """
+    Converts an export DataFrame to an Arrow table, with dictionary encoding for columns with repetitive values.
+    :param dfexport: DataFrame of flattened donor metadata
+    :return: Arrow table
+    """
+
+    # Metadata elements for different donors can have different keys, so the concatenated DataFrame can
+    # have missing values. All metadata values are strings.
+    dfarrow = getexportframe(dfexport).fillna('').astype(str)
+    for col in categoricalcolumns:
+        if col in dfarrow.columns:
+            dfarrow[col] = dfarrow[col].astype('category')
+
+    return pa.Table.from_pandas(dfarrow, preserve_index=False)
+
+
+def streamarrow(dfexport: pd.DataFrame, format: str, chunksize: int = 50000):
+    """
+    Serializes an export DataFrame as a Parquet or Arrow IPC file, a chunk of rows at a time.
+    Each chunk is a row group (Parquet) or record batch (Arrow IPC).
+    :param dfexport: DataFrame of flattened donor metadata
+    :param format: parquet or arrow
+    :param chunksize: number of rows in a row group or record batch
+    :return: generator of bytes
+    """
+
+    table = getarrowtable(dfexport)
+    sink = _ChunkSink()
+    if format == 'parquet':
+        writer = pq.ParquetWriter(sink, table.schema)
+    else:
+        writer = ipc.new_file(sink, table.schema)
+
+    for start in range(0, len(table), chunksize):
+        writer.write_table(table.slice(start, chunksize))
+        yield sink.drain()
+
+    writer.close()
+    yield sink.drain()
+
+
+def streamexport(dfexport: pd.DataFrame, format: str, compress: bool = False):
+    """
+    Serializes an export DataFrame in the specified format.
+    :param dfexport: DataFrame of flattened donor metadata
+    :param format: a key of exportcontenttypes
+    :param compress: if true, gzip-compress the stream of a text format (csv, tsv, jsonl) for transfer.
+                     Formats that are gzip files (csv.gz, tsv.gz) are always compressed.
+    :return: generator of bytes
+    """
+
+    # Derived columns of the compact representation are not exported.
+    dfexport = getexportframe(dfexport)
+    if format in ['csv', 'csv.gz']:
+        return streamdelimited(dfexport, sep=',', compress=compress or format == 'csv.gz')
+    if format in ['tsv', 'tsv.gz']:
+        return streamdelimited(dfexport, sep='\t', compress=compress or format == 'tsv.gz')
+    if format == 'jsonl':
+        return streamjsonlines(dfexport, compress=compress)
+    return streamarrow(dfexport, format=format)
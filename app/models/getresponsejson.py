@@ -4,7 +4,14 @@ Employs a retry loop.
 Can be invoked from within either a Flask app or in a script.
 If this will ever be called from a script, the import of flask does not apply.
 
+Identical requests that are in flight at the same time in different threads of the process--e.g., two curators
+who open the export for the same consortium--share one call to the API and its response (single flight).
+Requests are identical if they have the same method, URL, body, and authorization.
+
 """
+import threading
+from hashlib import sha256
+from json import dumps
 import requests
 
 # For retry loop
@@ -13,18 +20,78 @@ from urllib3.util import Retry
 
 from flask import abort, current_app
 
-def getresponsejson(url: str, method: str, headers=None, json=None) -> dict:
+# Requests in flight, shared by all threads in the process. Each entry is keyed by the identity of the request
+# (getflightkey) and is the _Flight of the thread that sends the request.
+_flights = {}
+_flightslock = threading.Lock()
+
+
+class _Flight:
     """
-    Obtains a response from a REST API.
-    Employs a retry loop in case of timeout or other failures.
+    A request in flight, with its outcome: either a response or an exception.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+
+def getflightkey(url: str, method: str, headers=None, json=None) -> tuple:
+    """
+    Returns the identity of a request: the method, the URL, and hashes of the body and of the authorization
+    header, so that requests with different tokens do not share a response.
+    """
+
+    body = '' if json is None else dumps(json, sort_keys=True, default=str)
+    authorization = '' if headers is None else str(headers.get('Authorization', ''))
+    return (method.upper(), url, sha256(body.encode('utf-8')).hexdigest(),
+            sha256(authorization.encode('utf-8')).hexdigest())
+
+
+def getresponse(url: str, method: str, headers=None, json=None, retry: bool = True) -> requests.Response:
+    """
+    Sends a request to a REST API, unless an identical request is in flight in another thread, in which case
+    waits for the response to that request.
 
     :param url: the URL to the REST API
     :param method: GET or POST
     :param headers: optional headers
-    :param json: optional response body for POST
-    :return:
+    :param json: optional request body for POST
+    :param retry: if true, retry in case of timeout or other failures
+    :return: the response. If the request failed, raises the exception of the request in every thread that
+             shared it.
     """
 
+    key = getflightkey(url=url, method=method, headers=headers, json=json)
+    with _flightslock:
+        flight = _flights.get(key)
+        sender = flight is None
+        if sender:
+            flight = _Flight()
+            _flights[key] = flight
+
+    if not sender:
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.response
+
+    try:
+        flight.response = _sendrequest(url=url, method=method, headers=headers, json=json, retry=retry)
+        return flight.response
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        # Later requests are sent again.
+        with _flightslock:
+            _flights.pop(key, None)
+        flight.done.set()
+
+
+def _sendrequest(url: str, method: str, headers=None, json=None, retry: bool = True) -> requests.Response:
+
     # Use the HTTPAdapter's retry strategy, as described here:
     # https://oxylabs.io/blog/python-requests-retry
 
@@ -32,7 +99,8 @@ def getresponsejson(url: str, method: str, headers=None, json=None) -> dict:
     # A backoff factor of 2, which results in exponential increases in delays before each attempt.
     # Retry for scenarios such as Service Unavailable or Too Many Requests that often are returned in case
     # of an overloaded server.
-    try:
+    session = requests.Session()
+    if retry:
         retry = Retry(
             total=10,
             backoff_factor=2,
@@ -40,15 +108,29 @@ def getresponsejson(url: str, method: str, headers=None, json=None) -> dict:
         )
 
         adapter = HTTPAdapter(max_retries=retry)
-
-        session = requests.Session()
         session.mount('https://', adapter)
-        # r = session.get('https://httpbin.org/status/502', timeout=180)
-        if method == 'GET':
-            r = session.get(url=url, timeout=180)
-        else:
-            r = session.post(url=url, timeout=180, headers=headers, json=json)
 
+    # r = session.get('https://httpbin.org/status/502', timeout=180)
+    if method == 'GET':
+        return session.get(url=url, timeout=180, headers=headers)
+    return session.post(url=url, timeout=180, headers=headers, json=json)
+
+
+def getresponsejson(url: str, method: str, headers=None, json=None) -> dict:
+    """
+    Obtains a response from a REST API.
+    Employs a retry loop in case of timeout or other failures.
+
+    :param url: the URL to the REST API
+    :param method: GET or POST
+    :param headers: optional headers
+    :param json: optional response body for POST
+    :return:
+    """
+
+    try:
+        # Each caller parses its own copy of the shared response.
+        r = getresponse(url=url, method=method, headers=headers, json=json)
         return r.json()
 
     except Exception as e:
@@ -56,4 +138,4 @@ def getresponsejson(url: str, method: str, headers=None, json=None) -> dict:
         if current_app is not None:
             abort(500)
         else:
-            raise(e)
\ No newline at end of file
+            raise(e)
@@ -0,0 +1,292 @@
+"""
+Class for running long workflows (e.g., the export of metadata for all donors in a consortium) as background
+jobs, so that a request does not wait for the workflow to finish.
+
+Jobs run in a pool of worker threads in the application process. The state of each job is kept in a table
+of a local SQLite database, so that a page can poll for the progress of a job. Artifacts of jobs (e.g.,
+export files) are written to a folder next to the database.
+
+The database and artifact folder are in the folder of the app.cfg file. Optional keys of the app.cfg file set:
+- JOB_WORKERS: the number of worker threads (default 2)
+- JOB_RETENTION: the number of hours to keep finished jobs and their artifacts (default 24)
+
+Several application processes (e.g., the workers of a WSGI server) can share the database. Each job records the
+process that owns it (host and process id), and each process periodically updates the jobs that it owns
+(a heartbeat). A queued or running job is marked as failed only if its owner is a process on the same host that
+is no longer running, or if its heartbeat is stale--so that a process that starts does not fail the jobs of
+the other processes.
+
+"""
+import os
+import json
+import sqlite3
+import threading
+import time
+import uuid
+import logging
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+
+from werkzeug.exceptions import HTTPException
+
+# Helper classes
+from models.appconfig import AppConfig
+from models.snapshot import SnapshotReader
+
+# Configure consistent logging. This is done at the beginning of each module instead of with a superclass of
+# logger to avoid the need to overload function calls to logger.
+logging.basicConfig(format='[%(asctime)s] %(levelname)s in %(module)s: %(message)s',
+                    level=logging.INFO, datefmt='%Y-%m-%d %H:%M:%S')
+logger = logging.getLogger(__name__)
+
+# Seconds between heartbeats of the jobs owned by a process.
+HEARTBEAT = 60
+# Seconds without a heartbeat after which a queued or running job is considered orphaned.
+HEARTBEAT_STALE = 5 * HEARTBEAT
+
+
+class JobProgress:
+
+    # Passed to the function of a job to report progress.
+
+    def __init__(self, manager, jobid: str):
+        self.manager = manager
+        self.jobid = jobid
+
+    def __call__(self, phase: str = None, **counts):
+        """
+        Updates the progress of the job.
+        :param phase: optional description of the current phase of the job
+        :param counts: counts of work done in the phase--e.g., pages=2, donors=150
+        """
+        self.manager.updatejob(jobid=self.jobid, phase=phase, counts=counts)
+
+
+class JobManager:
+
+    # The worker pool is shared by all instances of the class in the application process.
+    _executor = None
+    _lock = threading.Lock()
+    # Owner of the jobs submitted by the application process.
+    _owner = f'{socket.gethostname()}:{os.getpid()}'
+
+    def __init__(self):
+
+        cfg = AppConfig()
+        self.dbfile = os.path.join(cfg.path, 'jobs.db')
+        self.artifactpath = os.path.join(cfg.path, 'jobs')
+        os.makedirs(self.artifactpath, exist_ok=True)
+
+        with JobManager._lock:
+            if JobManager._executor is None:
+                # The process id of a forked worker differs from the id of the process that imported the module.
+                JobManager._owner = f'{socket.gethostname()}:{os.getpid()}'
+                self._createtable()
+                self._failorphanjobs()
+                self.purgejobs(maxage=int(cfg.getfield(key='JOB_RETENTION', default='24')) * 3600)
+                workers = int(cfg.getfield(key='JOB_WORKERS', default='2'))
+                JobManager._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+                threading.Thread(target=self._heartbeat, name='jobheartbeat', daemon=True).start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.dbfile, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _execute(self, sql: str, params: tuple = ()):
+        with closing(self._connect()) as conn:
+            with conn:
+                conn.execute(sql, params)
+
+    def _createtable(self):
+        with closing(self._connect()) as conn:
+            with conn:
+                # Write-ahead logging allows status polls to read while a job writes.
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.execute('CREATE TABLE IF NOT EXISTS jobs ('
+                             'jobid TEXT PRIMARY KEY, '
+                             'kind TEXT, '
+                             'scope TEXT, '
+                             'status TEXT, '
+                             'phase TEXT, '
+                             'counts TEXT, '  # JSON object of counts of work done
+                             'message TEXT, '
+                             'artifact TEXT, '
+                             'created REAL, '
+                             'updated REAL, '
+                             'owner TEXT)')  # host:process id of the process that runs the job
+                # Databases created before jobs had owners.
+                columns = [row['name'] for row in conn.execute('PRAGMA table_info(jobs)')]
+                if 'owner' not in columns:
+                    conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT DEFAULT ''")
+
+    def _heartbeat(self):
+        """
+        Periodically marks the queued and running jobs of the process as alive, and fails orphaned jobs of other
+        processes. Runs in a daemon thread for the life of the process.
+        """
+
+        while True:
+            time.sleep(HEARTBEAT)
+            try:
+                self._execute("UPDATE jobs SET updated=? WHERE owner=? AND status IN ('queued', 'running')",
+                              (time.time(), JobManager._owner))
+                self._failorphanjobs()
+            except Exception as e:
+                logger.error(e, exc_info=True)
+
+    def _failorphanjobs(self):
+        """
+        Marks as failed the queued and running jobs that will never finish: jobs of processes on this host that
+        are no longer running (including earlier processes with the id of this process, which has not yet
+        submitted jobs when this is first called), and jobs without a recent heartbeat.
+        """
+
+        host = socket.gethostname()
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT jobid, owner, updated FROM jobs WHERE status IN ('queued', 'running')"
+                                ).fetchall()
+
+        now = time.time()
+        for row in rows:
+            owner = row['owner'] if row['owner'] is not None else ''
+            if owner == JobManager._owner and JobManager._executor is not None:
+                continue
+            ownerhost, _, ownerpid = owner.rpartition(':')
+            if now - row['updated'] > HEARTBEAT_STALE:
+                message = 'Interrupted: the process that ran the job stopped responding.'
+            elif ownerhost == host and (owner == JobManager._owner or not self._isrunning(pid=ownerpid)):
+                message = 'Interrupted by application restart.'
+            else:
+                continue
+            self._execute("UPDATE jobs SET status='failed', message=?, updated=? "
+                          "WHERE jobid=? AND status IN ('queued', 'running')", (message, now, row['jobid']))
+
+    @staticmethod
+    def _isrunning(pid: str) -> bool:
+        """
+        Checks whether a process on this host is running.
+        :param pid: process id
+        """
+
+        try:
+            os.kill(int(pid), 0)
+        except (ValueError, ProcessLookupError):
+            return False
+        except PermissionError:
+            # The process exists, but belongs to another user.
+            return True
+        return True
+
+    def submitjob(self, kind: str, scope: str, target, **kwargs) -> str:
+        """
+        Queues a job.
+        :param kind: type of job--e.g., export
+        :param scope: consortium or donor id for the job
+        :param target: function that does the work of the job. The function is called with the keyword
+                       arguments progress (a JobProgress), artifactpath (a path for output files of the job),
+                       and kwargs. The function returns the path to the artifact of the job, or None.
+        :param kwargs: arguments for target
+        :return: job id
+        """
+
+        jobid = uuid.uuid4().hex
+        now = time.time()
+        self._execute('INSERT INTO jobs (jobid, kind, scope, status, phase, counts, message, artifact, '
+                      'created, updated, owner) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                      (jobid, kind, scope, 'queued', 'waiting for a worker', '{}', '', '', now, now,
+                       JobManager._owner))
+        JobManager._executor.submit(self._runjob, jobid, target, kwargs)
+        return jobid
+
+    def _runjob(self, jobid: str, target, kwargs: dict):
+        """
+        Runs the function of a job in a worker thread, recording the outcome.
+        """
+
+        self._execute("UPDATE jobs SET status='running', updated=? WHERE jobid=?", (time.time(), jobid))
+        try:
+            artifact = target(progress=JobProgress(manager=self, jobid=jobid),
+                              artifactpath=self.artifactpath, **kwargs)
+            if artifact is None:
+                artifact = ''
+            self._execute("UPDATE jobs SET status='complete', phase='complete', artifact=?, updated=? "
+                          "WHERE jobid=?", (artifact, time.time(), jobid))
+        except HTTPException as e:
+            # Helper classes call abort for errors from APIs.
+            self._execute("UPDATE jobs SET status='failed', message=?, updated=? WHERE jobid=?",
+                          (f'{e.code}: {e.description}', time.time(), jobid))
+        except Exception as e:
+            logger.error(e, exc_info=True)
+            self._execute("UPDATE jobs SET status='failed', message=?, updated=? WHERE jobid=?",
+                          (str(e), time.time(), jobid))
+
+    def updatejob(self, jobid: str, phase: str = None, counts: dict = None):
+        """
+        Records the progress of a job.
+        :param jobid: job id
+        :param phase: optional description of the current phase
+        :param counts: optional dict of counts of work done--e.g., {'pages': 2, 'donors': 150}
+        """
+
+        job = self.getjob(jobid=jobid)
+        if phase is None:
+            phase = job['phase']
+        dictcounts = job['counts']
+        if counts is not None:
+            dictcounts.update(counts)
+        self._execute('UPDATE jobs SET phase=?, counts=?, updated=? WHERE jobid=?',
+                      (phase, json.dumps(dictcounts), time.time(), jobid))
+
+    def getjob(self, jobid: str) -> dict:
+        """
+        Returns the state of a job.
+        :param jobid: job id
+        :return: dict of the columns of the job, with counts as a dict; or None if there is no job with the id.
+        """
+
+        with closing(self._connect()) as conn:
+            row = conn.execute('SELECT * FROM jobs WHERE jobid=?', (jobid,)).fetchone()
+
+        if row is None:
+            return None
+
+        job = dict(row)
+        job['counts'] = json.loads(job['counts'])
+        return job
+
+    def getactivejob(self, kind: str, scope: str) -> dict:
+        """
+        Returns the most recent queued or running job of a kind for a scope.
+        :param kind: type of job
+        :param scope: consortium or donor id
+        :return: dict of job state, or None if there is no active job.
+        """
+
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT jobid FROM jobs WHERE kind=? AND scope=? AND status IN ('queued', 'running') "
+                               "ORDER BY created DESC", (kind, scope)).fetchone()
+
+        if row is None:
+            return None
+        return self.getjob(jobid=row['jobid'])
+
+    def purgejobs(self, maxage: int):
+        """
+        Deletes finished jobs, and their artifacts, that are older than a maximum age.
+        :param maxage: maximum age, in seconds
+        """
+
+        cutoff = time.time() - maxage
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT jobid, artifact FROM jobs WHERE updated < ? AND status IN ('complete', 'failed')",
+                                (cutoff,)).fetchall()
+
+        for row in rows:
+            if row['artifact'] != '':
+                # Release the mapping of an export snapshot in this process before the file is deleted.
+                SnapshotReader.release(path=row['artifact'])
+                if os.path.exists(row['artifact']):
+                    os.remove(row['artifact'])
+            self._execute('DELETE FROM jobs WHERE jobid=?', (row['jobid'],))
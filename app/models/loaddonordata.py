@@ -0,0 +1,52 @@
+# Loads the existing metadata of a set of donors in a batch--e.g., for a worklist of donors to curate.
+# Instead of an entity-api request for each donor, the metadata is obtained with search-api queries for chunks
+# of donors.
+
+from werkzeug.exceptions import HTTPException
+
+# Helper classes
+from models.donor import DonorData
+from models.searchapi import SearchAPI
+
+
+def loaddonordata(donorids: list, token: str) -> tuple:
+    """
+    Builds DonorData objects for a set of donors.
+    :param donorids: list of donor ids. The ids can be from either consortium (HBM or SNT prefix).
+    :param token: globus groups_token for the consortium
+    :return: tuple of:
+             - dict of DonorData objects, keyed by donor id
+             - dict of error messages for donors that could not be loaded, keyed by donor id
+    """
+
+    dictdonors = {}
+    dicterrors = {}
+
+    # Group the donor ids by consortium.
+    dictconsortia = {'CONTEXT_HUBMAP': [], 'CONTEXT_SENNET': []}
+    for donorid in dict.fromkeys(donorids):
+        if donorid[0:3] == 'HBM':
+            dictconsortia['CONTEXT_HUBMAP'].append(donorid)
+        elif donorid[0:3] == 'SNT':
+            dictconsortia['CONTEXT_SENNET'].append(donorid)
+        else:
+            dicterrors[donorid] = (f'Invalid donor id format: {donorid}. The first three characters of the id '
+                                   f'should be either HBM (for HuBMAP) or SNT (for SenNet).')
+
+    for consortium, listdonorid in dictconsortia.items():
+        if len(listdonorid) == 0:
+            continue
+
+        search = SearchAPI(consortium=consortium, token=token)
+        dictentities, listmissing = search.getdonorentities(donorids=listdonorid)
+        for donorid in listmissing:
+            dicterrors[donorid] = f'No donor with id {donorid} found in provenance for {search.consortium}'
+
+        for donorid, dictentity in dictentities.items():
+            try:
+                dictdonors[donorid] = DonorData(donorid=donorid, token=token, dictentity=dictentity)
+            except HTTPException as e:
+                # The entity is not a donor or a human source.
+                dicterrors[donorid] = e.description
+
+    return dictdonors, dicterrors
@@ -0,0 +1,131 @@
+# Vectorized data-quality scan of flattened donor metadata for all donors in a consortium.
+# The rules correspond to the conditions that the setdefaults function of the edit route handles one donor
+# at a time--in particular, the conditions that disable the Edit form--so that problem donors can be found
+# before editing.
+# Because this file is used by both the donor-metadata app and scripts in the
+# validate path, it does not import other helper classes.
+
+import numpy as np
+import pandas as pd
+
+# Grouping concepts
+HEIGHT = 'C0005890'
+WEIGHT = 'C0005910'
+WAIST = 'C0455829'
+MECHANISM = 'C0449413'
+MEDHX = 'C0262926'
+# Legacy concept for "unknown race", replaced by the concept for "unknown" (C1532697)
+UNKNOWN_RACE = 'C0439673'
+# The Edit form has fields for 20 medical history conditions.
+MAX_MEDHX = 20
+
+# Expected units of measurements, with known variants.
+UNITS = {HEIGHT: (['in', 'cm'], {'inches': 'in'}, 'height'),
+         WEIGHT: (['lb', 'kg'], {'pounds': 'lb'}, 'weight'),
+         WAIST: (['in', 'cm'], {'inches': 'in'}, 'waist circumference')}
+
+# Rules for which the Edit form is disabled, so that the donor must be edited manually.
+BLOCKINGRULES = ['height_units', 'weight_units', 'waist_units', 'medhx_count']
+
+ISSUECOLUMNS = ['id', 'rule', 'concept_id', 'grouping_concept', 'data_value', 'units', 'message']
+
+
+def getqualityissues(dfalldonormetadata: pd.DataFrame, mechanismconcepts: list = None,
+                     medhxconcepts: list = None) -> pd.DataFrame:
+    """
+    Applies data-quality rules to the metadata elements of all donors at once.
+    :param dfalldonormetadata: DataFrame of flattened metadata for all donors (SearchAPI.getalldonormetadata)
+    :param mechanismconcepts: optional concepts of the Mechanism of Injury valueset. If provided, elements
+                              with these concepts and another grouping concept are reported.
+    :param medhxconcepts: optional concepts of the Medical History valueset. If provided, elements with these
+                          concepts and another grouping concept are reported, and only elements with these
+                          concepts are counted as conditions.
+    :return: DataFrame with a row for each issue, with columns id, rule, concept_id, grouping_concept,
+             data_value, units, message
+    """
+
+    dfm = dfalldonormetadata.reindex(columns=['id', 'concept_id', 'grouping_concept', 'data_value', 'units'])
+    dfm = dfm.fillna('').astype(str).apply(lambda col: col.str.strip())
+
+    listissues = []
+
+    def addissues(mask: pd.Series, rule: str, message):
+        # message is either a string or a function that builds messages from the rows with issues.
+        dfrule = dfm.loc[mask].copy()
+        dfrule['rule'] = rule
+        dfrule['message'] = message(dfrule) if callable(message) else message
+        listissues.append(dfrule)
+
+    # Decimal values with trailing zeros--e.g., 11.0--which complicate comparison with DOI titles.
+    values = dfm['data_value']
+    trailingzero = values.str.contains('.', regex=False) & values.str.endswith('0') \
+        & (pd.to_numeric(values, errors='coerce').notna())
+    addissues(trailingzero, 'trailing_zero',
+              lambda df: 'data_value ' + df['data_value'] + ' is a decimal with a trailing zero.')
+
+    # Unexpected units of measurements. The Edit form is disabled for an unexpected unit, but not for a missing
+    # unit, which is reported under a separate rule.
+    for grouping_concept, (expected, variants, name) in UNITS.items():
+        units = dfm['units'].replace(variants)
+        ismeasurement = dfm['grouping_concept'] == grouping_concept
+        addissues(ismeasurement & (units != '') & ~units.isin(expected), f"{name.split(' ')[0]}_units",
+                  lambda df, name=name, expected=expected:
+                  f'unexpected {name} unit ' + df['units'] + '; expected one of ' + ', '.join(expected) + '.')
+        addissues(ismeasurement & (units == ''), f"{name.split(' ')[0]}_units_missing",
+                  f'missing {name} unit; expected one of {", ".join(expected)}.')
+
+    # Legacy concept for unknown race.
+    addissues(dfm['concept_id'] == UNKNOWN_RACE, 'unknown_race',
+              f'legacy concept {UNKNOWN_RACE} for unknown race; the current concept is C1532697.')
+
+    # Wrong grouping concepts.
+    if mechanismconcepts is not None:
+        mask = dfm['concept_id'].isin(mechanismconcepts) & (dfm['grouping_concept'] != MECHANISM)
+        addissues(mask, 'mechanism_grouping',
+                  lambda df: 'grouping_concept ' + df['grouping_concept']
+                  + f' for Mechanism of Injury; expected {MECHANISM}.')
+    if medhxconcepts is not None:
+        mask = dfm['concept_id'].isin(medhxconcepts) & (dfm['grouping_concept'] != MEDHX)
+        addissues(mask, 'medhx_grouping',
+                  lambda df: 'grouping_concept ' + df['grouping_concept'] + f' for Medical History; expected {MEDHX}.')
+
+    # More conditions than the Edit form can display.
+    ismedhx = dfm['grouping_concept'] == MEDHX
+    if medhxconcepts is not None:
+        ismedhx = ismedhx & dfm['concept_id'].isin(medhxconcepts)
+    medhxcount = ismedhx.groupby(dfm['id']).transform('sum')
+    # Report once per donor.
+    mask = (medhxcount > MAX_MEDHX) & ~dfm['id'].duplicated()
+    addissues(mask, 'medhx_count',
+              lambda df: medhxcount[df.index].astype(str)
+              + f' Medical History conditions; the Edit form allows {MAX_MEDHX}.')
+
+    dfissues = pd.concat(listissues, ignore_index=True)[ISSUECOLUMNS]
+    # The medhx_count rule applies to the donor, not an element.
+    dfissues.loc[dfissues['rule'] == 'medhx_count', ['concept_id', 'grouping_concept', 'data_value', 'units']] = ''
+    return dfissues.sort_values(by=['id', 'rule'], ignore_index=True)
+
+
+def getdonorqualityreport(dfissues: pd.DataFrame) -> pd.DataFrame:
+    """
+    Summarizes issues by donor.
+    :param dfissues: DataFrame from getqualityissues
+    :return: DataFrame with a row for each donor with issues, with columns:
+             id
+             issues: number of issues
+             rules: the rules with issues
+             editable: no if an issue disables the Edit form for the donor
+             messages: the messages of the issues
+    """
+
+    if len(dfissues) == 0:
+        return pd.DataFrame(columns=['id', 'issues', 'rules', 'editable', 'messages'])
+
+    # Issues are sorted by donor and rule, so the distinct rules of a donor are in order.
+    dfrules = dfissues[['id', 'rule']].drop_duplicates()
+    dfreport = pd.DataFrame({'issues': dfissues.groupby('id').size(),
+                             'rules': dfrules.groupby('id')['rule'].agg(';'.join),
+                             'blocking': dfissues['rule'].isin(BLOCKINGRULES).groupby(dfissues['id']).any(),
+                             'messages': dfissues.groupby('id')['message'].agg(' '.join)}).reset_index()
+    dfreport['editable'] = np.where(dfreport['blocking'], 'no', 'yes')
+    return dfreport[['id', 'issues', 'rules', 'editable', 'messages']]
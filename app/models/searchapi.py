@@ -7,6 +7,7 @@ import os
 import sys
 
 from flask import abort
+from werkzeug.exceptions import HTTPException
 import requests
 import pandas as pd
 from tqdm import tqdm
@@ -20,7 +21,8 @@ fpath = os.path.join(fpath, 'app/models')
 sys.path.append(fpath)
 from metadataframe import MetadataFrame
 from getmetadatabytype import getmetadatabytype
-from getresponsejson import getresponsejson
+from getresponsejson import getresponsejson, getresponse
+from compactframe import getcompactframe
 # to obtain DOI information for published datasets
 from datacite import DataCiteAPI
 
@@ -52,9 +54,15 @@ class SearchAPI:
         self.datacite = DataCiteAPI(consortium=self.consortium)
 
 
-    def getalldonormetadata(self) -> pd.DataFrame:
+    def getalldonormetadata(self, progress=None, pagesize: int = 1000, compact: bool = False) -> pd.DataFrame:
         """
         Searches for metadata for donor in a consortium, using the search-api.
+        :param progress: optional function called with keyword arguments pages (number of pages of search
+                         results fetched) and donors (number of donors flattened), to report progress to
+                         a background job.
+        :param pagesize: number of donors in a page of search results.
+        :param compact: if true, return the memory-compact representation of the DataFrame (getcompactframe),
+                        with categorical columns for repetitive values and a column of numeric data values.
         :return: a DataFrame with flattened donor metadata.
         """
         listalldonordf = []
@@ -119,43 +127,65 @@ class SearchAPI:
                 "_source": ["sennet_id", "metadata"]
             }
 
+        # Page through the search results, in order of donor id. Each page starts after the sort value of the
+        # last hit of the previous page (search_after), because paging with from and size stops at the
+        # max_result_window of the index (by default, 10,000 hits).
+        data['size'] = pagesize
+        data['sort'] = [{f'{idfield}.keyword': {'order': 'asc'}}]
         url = f'{self.urlbase}/search'
-        response = requests.post(url=url, headers=self.headers, json=data)
+        pages = 0
+        donorcount = 0
 
-        if response.status_code == 200:
+        while True:
+            # Sessions that sweep the same consortium at the same time share the request for each page.
+            response = getresponse(url=url, method='POST', headers=self.headers, json=data, retry=False)
+
+            if response.status_code == 404:
+                abort(404, f'No donors found in provenance for {self.consortium} '
+                           f'in environment {self.urlbase}')
+            elif response.status_code == 400:
+                abort(response.status_code, response.json().get('error'))
+            elif response.status_code != 200:
+                abort(500, 'Error when calling the param-search endpoint in search-api')
+
+            pages = pages + 1
+            if progress is not None:
+                progress(pages=pages, donors=donorcount)
 
             respjson = response.json()
             # Navigate through the ElasticSearch response.
 
             donors = respjson.get('hits').get('hits')
-            if len(donors) > 0:
-                for donor in donors:
-                    source = donor.get('_source')
-                    donorid = source.get(idfield)
-                    dictmetadata = source.get('metadata')
-                    if dictmetadata is not None and dictmetadata != {}:
-                        # Normalize living_donor_data and organ_donor_data objects.
-                        metadata = getmetadatabytype(dictmetadata=dictmetadata)
-                        # Flatten metadata to level of donor.
-                        donorexport = MetadataFrame(metadata=metadata, donorid=donorid)
-                        # Add to list.
-                        listalldonordf.append(donorexport.dfexport)
-
-            if len(listalldonordf) == 0:
-                abort(404, f'No human donors found in provenance for {self.consortium }'
-                           f' in environment {self.urlbase}')
-
-            # Build a DataFrame for all human donors with metadata in the consortium.
-            dfconsortium = pd.concat(listalldonordf, ignore_index=True)
-            return dfconsortium
-
-        elif response.status_code == 404:
-            abort(404, f'No donors found in provenance for {self.consortium} '
-                       f'in environment {self.urlbase}')
-        elif response.status_code == 400:
-            abort(response.status_code, response.json().get('error'))
-        else:
-            abort(500, 'Error when calling the param-search endpoint in search-api')
+            for donor in donors:
+                source = donor.get('_source')
+                donorid = source.get(idfield)
+                dictmetadata = source.get('metadata')
+                if dictmetadata is not None and dictmetadata != {}:
+                    # Normalize living_donor_data and organ_donor_data objects.
+                    metadata = getmetadatabytype(dictmetadata=dictmetadata)
+                    # Flatten metadata to level of donor.
+                    donorexport = MetadataFrame(metadata=metadata, donorid=donorid)
+                    # Add to list.
+                    listalldonordf.append(donorexport.dfexport)
+                    donorcount = donorcount + 1
+
+            if progress is not None:
+                progress(pages=pages, donors=donorcount)
+
+            # The last page has fewer hits than the page size.
+            if len(donors) < pagesize:
+                break
+            data['search_after'] = donors[-1].get('sort')
+
+        if len(listalldonordf) == 0:
+            abort(404, f'No human donors found in provenance for {self.consortium }'
+                       f' in environment {self.urlbase}')
+
+        # Build a DataFrame for all human donors with metadata in the consortium.
+        dfconsortium = pd.concat(listalldonordf, ignore_index=True)
+        if compact:
+            return getcompactframe(dfconsortium)
+        return dfconsortium
 
     def getalldonordoimetadata(self, start: int, end: int, geturls: bool=False) -> pd.DataFrame:
         """
@@ -175,38 +205,54 @@ class SearchAPI:
             end = start
 
         for donorid in tqdm(listdonorid[start:end], desc="Donors"):
-
-            # Get the donor.
-            donor = self.dfalldonormetadata[self.dfalldonormetadata['id'] == donorid]
-            # Get relevant metadata values in lowercase.
-            age = donor.loc[donor['grouping_concept'] == 'C0001779']['data_value'].values[0]
-            ageunits = donor.loc[donor['grouping_concept'] == 'C0001779']['units'].values[0]
-            sex = donor.loc[donor['grouping_concept'] == 'C1522384']['data_value'].values[0].lower()
-            race = donor.loc[donor['grouping_concept'] == 'C0034510']['data_value'].values
-            if len(race) == 1:
-                race = race[0].lower()
+            listdonor = listdonor + self.getdonordoimetadata(donorid=donorid, geturls=geturls)
             if geturls:
-                # Get DOI titles for any published datasets associated with the donor.
-                listdatasets = self.getdatasetdoisfordonor(donorid=donorid)
-                if len(listdatasets) == 0:
-                    listdonor.append({"id": donorid, "age": age, "ageunits": ageunits,
-                                      "sex": sex, "race": race,
-                                      "doi_url": "no published datasets",
-                                      "doi_title": "no published datasets"})
-                else:
-                    for ds in listdatasets:
-                        listdonor.append({"id": donorid, "age": age, "ageunits": ageunits,
-                                          "sex": sex, "race": race,
-                                          "doi_url": ds.get('doi_url'),
-                                          "doi_title": ds.get('doi_title')})
-
                 time.sleep(10)
-            else:
-                listdonor.append({"id": donorid, "age": age, "ageunits": ageunits,
-                                  "sex": sex, "race": race})
 
         return pd.DataFrame(listdonor)
 
+    def getdonordoimetadata(self, donorid: str, geturls: bool = False) -> list:
+        """
+        Extracts from the dfalldonormetadata DataFrame the metadata for a donor that is relevant to
+        DOIs for published datasets.
+        :param donorid: id of the donor
+        :param geturls: if true, obtain DOI urls for published datasets.
+        :return: list of dicts. If geturls is true, there is a dict for each published dataset of the donor.
+        """
+
+        listdonor = []
+
+        # Get the donor.
+        donor = self.dfalldonormetadata[self.dfalldonormetadata['id'] == donorid]
+        # Get relevant metadata values in lowercase. A donor without an age or sex element has empty values.
+        dfage = donor.loc[donor['grouping_concept'] == 'C0001779']
+        dfsex = donor.loc[donor['grouping_concept'] == 'C1522384']
+        age = dfage['data_value'].values[0] if len(dfage) > 0 else ''
+        ageunits = dfage['units'].values[0] if len(dfage) > 0 else ''
+        sex = str(dfsex['data_value'].values[0]).lower() if len(dfsex) > 0 else ''
+        race = donor.loc[donor['grouping_concept'] == 'C0034510']['data_value'].values
+        if len(race) == 1:
+            race = race[0].lower()
+        if geturls:
+            # Get DOI titles for any published datasets associated with the donor.
+            listdatasets = self.getdatasetdoisfordonor(donorid=donorid)
+            if len(listdatasets) == 0:
+                listdonor.append({"id": donorid, "age": age, "ageunits": ageunits,
+                                  "sex": sex, "race": race,
+                                  "doi_url": "no published datasets",
+                                  "doi_title": "no published datasets"})
+            else:
+                for ds in listdatasets:
+                    listdonor.append({"id": donorid, "age": age, "ageunits": ageunits,
+                                      "sex": sex, "race": race,
+                                      "doi_url": ds.get('doi_url'),
+                                      "doi_title": ds.get('doi_title')})
+        else:
+            listdonor.append({"id": donorid, "age": age, "ageunits": ageunits,
+                              "sex": sex, "race": race})
+
+        return listdonor
+
     def getdatasetdoisfordonor(self, donorid: str) -> list:
         """
         Obtains DOI information on published datasets of a donor.
@@ -424,35 +470,132 @@ class SearchAPI:
         :return:
         """
 
+        dictterms, listmissing = self.getdonorsraceandageterms(donorids=[donorid])
+        if len(listmissing) > 0:
+            # A missing donor is not fatal to the caller--e.g., a web worker.
+            abort(404, f'Error: missing donor {donorid}')
+        return dictterms[donorid]
+
+    def getdonorsraceandageterms(self, donorids: list, chunksize: int = 500) -> tuple:
+        """
+        Returns case-insensitive terms for the race and sex of a set of donors.
+        Searches for the donors in chunks, with one search-api request per chunk instead of one per donor.
+        :param donorids: list of hubmap or sennet ids
+        :param chunksize: number of donors in a search-api request
+        :return: tuple of:
+                 - dict of terms, keyed by donor id. Each value is a dict with keys race and sex.
+                 - list of the donor ids that were not found, do not have metadata, or were in a chunk for
+                   which the search failed
+        """
+
         if self.consortium == 'hubmapconsortium.org':
             id_field = 'hubmap_id'
         else:
             id_field = 'sennet_id'
 
-        # Search for donor
-        donor = self._searchmatch(id_field=id_field, id_value=donorid, source =["metadata"])
+        dictterms = {}
+        listdonorid = list(dict.fromkeys(donorids))
+        dictsource = self._searchterms(id_field=id_field, id_values=listdonorid, source=[id_field, 'metadata'],
+                                       chunksize=chunksize)
+        for donorid, source in dictsource.items():
+            metadata = source.get('metadata')
+            if metadata is not None and metadata != {}:
+                dictterms[donorid] = self._getraceandsexterms(metadata=metadata)
+
+        listmissing = [donorid for donorid in listdonorid if donorid not in dictterms]
+        if len(listmissing) > 0:
+            print(f'Warning: {len(listmissing)} donors not found or without metadata: {listmissing}')
 
-        if donor is None:
-            print(f'Error: missing donor {donorid}')
-            exit(-1)
+        return dictterms, listmissing
+
+    def getdonorentities(self, donorids: list, chunksize: int = 500) -> tuple:
+        """
+        Obtains the metadata of a set of donors, with one search-api request per chunk of donors instead of
+        an entity-api request per donor.
+        :param donorids: list of hubmap or sennet ids
+        :param chunksize: number of donors in a search-api request
+        :return: tuple of:
+                 - dict keyed by donor id. Each value is a dict with keys metadata, entity_type, and source_type
+                   (SenNet).
+                 - list of the donor ids that were not found
+        """
+
+        if self.consortium == 'hubmapconsortium.org':
+            id_field = 'hubmap_id'
         else:
-            metadata = donor.get('hits').get('hits')[0].get('_source').get('metadata')
-            if 'living_donor_data' in metadata.keys():
-                listkey = 'living_donor_data'
-            else:
-                listkey = 'organ_donor_data'
-            listmeta = metadata.get(listkey)
-            # Get terms for race and sex.
-            for m in listmeta:
-                grouping_concept = m.get('grouping_concept')
-                if grouping_concept == 'C1522384':
-                    # sex
-                    sex = m.get('preferred_term').lower()
-                elif grouping_concept == 'C0034510':
-                    # race
-                    race = m.get('preferred_term').lower()
-
-            dictret = {'race': race, 'sex': sex}
-            return dictret
+            id_field = 'sennet_id'
 
+        listdonorid = list(dict.fromkeys(donorids))
+        dictentities = self._searchterms(id_field=id_field, id_values=listdonorid,
+                                         source=[id_field, 'metadata', 'entity_type', 'source_type'],
+                                         chunksize=chunksize)
+        listmissing = [donorid for donorid in listdonorid if donorid not in dictentities]
+        return dictentities, listmissing
 
+    def _searchterms(self, id_field: str, id_values: list, source: list, chunksize: int = 500) -> dict:
+        """
+        Obtain information for a set of ids, using terms queries in chunks of ids.
+        :param id_field: the field name to match
+        :param id_values: the field values to match
+        :param source: list of specific fields, including id_field
+        :param chunksize: number of ids in a query
+        :return: dict of the _source of hits, keyed by the value of id_field. Ids for a chunk for which the
+                 search-api returned an error are not in the dict.
+        """
+
+        dictsource = {}
+        url = f'{self.urlbase}/search'
+
+        for start in range(0, len(id_values), chunksize):
+            chunk = id_values[start:start + chunksize]
+            data = {
+                "size": len(chunk),
+                "query": {
+                    "terms": {
+                        f'{id_field}.keyword': chunk
+                    }
+                },
+                "_source": source
+            }
+            try:
+                response = getresponsejson(url=url, method='POST', headers=self.headers, json=data)
+            except HTTPException as e:
+                # getresponsejson aborts if the request fails after retries. The ids of the chunk are missing
+                # from the result, so that the other chunks are still returned.
+                response = {'error': f'{e.code}: {e.description}'}
+            if response is None or 'error' in response.keys():
+                print(f'Error searching for {id_field} {chunk[0]} to {chunk[-1]}: {response}')
+                continue
+
+            for hit in response.get('hits').get('hits'):
+                hitsource = hit.get('_source')
+                dictsource[hitsource.get(id_field)] = hitsource
+
+        return dictsource
+
+    def _getraceandsexterms(self, metadata: dict) -> dict:
+        """
+        Returns case-insensitive terms for a donor's race and sex from the donor's metadata.
+        :param metadata: the metadata object of the donor
+        :return: dict with keys race and sex
+        """
+
+        if 'living_donor_data' in metadata.keys():
+            listkey = 'living_donor_data'
+        else:
+            listkey = 'organ_donor_data'
+        listmeta = metadata.get(listkey, [])
+
+        race = None
+        sex = None
+        # Get terms for race and sex.
+        for m in listmeta:
+            grouping_concept = m.get('grouping_concept')
+            if grouping_concept == 'C1522384':
+                # sex
+                sex = m.get('preferred_term').lower()
+            elif grouping_concept == 'C0034510':
+                # race
+                race = m.get('preferred_term').lower()
+
+        return {'race': race, 'sex': sex}
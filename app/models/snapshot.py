@@ -0,0 +1,168 @@
+"""
+Snapshots of flattened donor metadata as Arrow IPC files that worker processes memory-map read-only.
+
+When the app runs with more than one worker process, a DataFrame built in one worker--e.g., the export for all
+donors in a consortium--would otherwise be loaded into the memory of every worker that uses it. A snapshot is
+written once as an uncompressed Arrow IPC file. A worker reads the snapshot by memory-mapping the file, and
+wraps the Arrow columns in a DataFrame without copying them (pandas ArrowDtype columns), so that all workers
+share one physical copy of the snapshot through the page cache of the operating system.
+
+A snapshot is written to a temporary file in the same folder and then moved into place with os.replace, which is
+atomic. A reader never maps a partially written file, and a new version of a snapshot replaces the previous
+version for every worker at once: readers detect the new version by the identity of the file, and a worker that
+still holds the previous version keeps a valid mapping of it until the worker releases it.
+
+The latest snapshot for each export scope (e.g., a consortium) is published in the snapshots subfolder of the
+folder of the app.cfg file. The age of a published snapshot is the age of the file.
+
+"""
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+# Helper classes
+from models.appconfig import AppConfig
+
+
+def writesnapshot(dfsnapshot: pd.DataFrame, path: str):
+    """
+    Writes a DataFrame of flattened donor metadata as an Arrow IPC file, replacing any earlier version atomically.
+    :param dfsnapshot: DataFrame, in any representation
+    :param path: path to the snapshot file
+    """
+
+    dfwrite = dfsnapshot.copy()
+    # Categorical columns are written as strings, which workers can read without copying. Missing values stay
+    # missing (astype(str) would write them as the string "nan").
+    for col in dfwrite.select_dtypes(include='category').columns:
+        dfwrite[col] = dfwrite[col].astype(object).where(dfwrite[col].notna(), None)
+    table = pa.Table.from_pandas(dfwrite, preserve_index=False)
+
+    tmppath = f'{path}.{uuid.uuid4().hex}.tmp'
+    try:
+        with ipc.new_file(tmppath, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(tmppath, path)
+    finally:
+        if os.path.exists(tmppath):
+            os.remove(tmppath)
+
+
+def readsnapshot(path: str) -> pd.DataFrame:
+    """
+    Memory-maps a snapshot file. SnapshotReader.getsnapshot keeps the mapping for reuse.
+    :param path: path to the snapshot file
+    :return: DataFrame with columns backed by the memory-mapped file
+    """
+
+    with pa.memory_map(path, 'r') as source:
+        table = ipc.open_file(source).read_all()
+    return table.to_pandas(types_mapper=pd.ArrowDtype)
+
+
+def publishsnapshot(artifact: str, scope: str) -> str:
+    """
+    Publishes a snapshot file as the latest snapshot for a scope, replacing the previous snapshot atomically.
+    The published snapshot is a hard link to the file, so that it shares the storage of the file and remains
+    after the file is deleted--e.g., when the job that wrote it is purged.
+    :param artifact: path to a snapshot file written by writesnapshot
+    :param scope: export scope--e.g., a consortium
+    :return: path to the published snapshot
+    """
+
+    path = getsnapshotpath(scope=scope)
+    tmppath = f'{path}.{uuid.uuid4().hex}.tmp'
+    try:
+        os.link(artifact, tmppath)
+        os.replace(tmppath, path)
+    finally:
+        if os.path.exists(tmppath):
+            os.remove(tmppath)
+    return path
+
+
+def getsnapshotpath(scope: str) -> str:
+    """
+    Returns the path of the latest snapshot for an export scope.
+    :param scope: export scope--e.g., a consortium
+    """
+
+    snapshotpath = os.path.join(AppConfig().path, 'snapshots')
+    os.makedirs(snapshotpath, exist_ok=True)
+    return os.path.join(snapshotpath, f'{scope}.arrow')
+
+
+class SnapshotReader:
+
+    # Memory-mapped snapshots, shared by all instances of the class in the worker process, in order of last use.
+    # Each entry is keyed by path and is a tuple of the identity of the file (device, inode, modification time)
+    # and the DataFrame. The optional SNAPSHOT_CACHE key of the app.cfg file sets the number of snapshots to keep
+    # mapped (default 4).
+    _store = OrderedDict()
+    _lock = threading.Lock()
+
+    @classmethod
+    def getsnapshot(cls, path: str) -> pd.DataFrame:
+        """
+        Returns the current version of a snapshot.
+        :param path: path to the snapshot file
+        :return: DataFrame with columns backed by the memory-mapped file, or None if there is no snapshot
+        """
+
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        identity = (stat.st_dev, stat.st_ino, stat.st_mtime_ns)
+
+        with cls._lock:
+            entry = cls._store.get(path)
+            if entry is not None and entry[0] == identity:
+                cls._store.move_to_end(path)
+                return entry[1]
+
+        # Map the version of the file that was checked. If the file was replaced after the check, the newer
+        # version is mapped, and the check on the next read finds the identity of the newer version.
+        dfsnapshot = readsnapshot(path=path)
+
+        maxsnapshots = max(int(AppConfig().getfield(key='SNAPSHOT_CACHE', default='4')), 1)
+        with cls._lock:
+            cls._store[path] = (identity, dfsnapshot)
+            cls._store.move_to_end(path)
+            while len(cls._store) > maxsnapshots:
+                cls._store.popitem(last=False)
+        return dfsnapshot
+
+    @classmethod
+    def release(cls, path: str):
+        """
+        Releases the mapping of a snapshot in the worker process--e.g., after the snapshot file is deleted.
+        :param path: path to the snapshot file
+        """
+
+        with cls._lock:
+            cls._store.pop(path, None)
+
+
+def getpublishedsnapshot(scope: str) -> tuple:
+    """
+    Returns the latest published snapshot for an export scope, with its age.
+    :param scope: export scope--e.g., a consortium
+    :return: tuple of the DataFrame (SnapshotReader.getsnapshot) and the age of the snapshot in seconds; or
+             (None, None) if no snapshot is published for the scope
+    """
+
+    path = getsnapshotpath(scope=scope)
+    try:
+        age = max(time.time() - os.stat(path).st_mtime, 0)
+    except FileNotFoundError:
+        return None, None
+    dfsnapshot = SnapshotReader.getsnapshot(path=path)
+    if dfsnapshot is None:
+        return None, None
+    return dfsnapshot, age
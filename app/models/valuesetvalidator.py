@@ -0,0 +1,115 @@
+"""
+Vectorized validation of flattened donor metadata against the valuesets of the Valueset Manager.
+
+The Edit form validates the fields of one donor with WTForms validators. A bulk update can have thousands of
+metadata rows, for which row-by-row validation is too slow. The functions here join the rows of a flattened
+metadata frame (the format of the export) with the content of all tabs of the Valueset Manager, and apply
+the rules of the Edit form validators to all rows at once:
+- concept: the concept_id is a member of a valueset
+- grouping_concept: the grouping_concept matches the valueset for the concept
+- numeric: values of numeric concepts are numbers (stringisintegerorfloat)
+- integer: values of the measures of pregnancy (gravida, parity, abortus) are integers
+- age: ages over 89 years are 90 years
+
+"""
+
+import pandas as pd
+
+# Helper classes
+from models.stringnumber import stringisintegerorfloat
+
+# Grouping concept for age; also the concept for age in years.
+AGE_YEARS = 'C0001779'
+# Grouping concepts for measures of pregnancy, which must be integers.
+INTEGER_CONCEPTS = {'C0600457': 'gravida', 'C0030563': 'parity', 'C0429912': 'abortus'}
+
+ERRORCOLUMNS = ['row', 'id', 'concept_id', 'grouping_concept', 'data_value', 'check', 'message']
+
+
+def getvaluesetcontent(valuesetmanager) -> pd.DataFrame:
+    """
+    Combines the valuesets in all tabs of the Valueset Manager.
+    :param valuesetmanager: ValueSetManager
+    :return: DataFrame with columns concept_id, grouping_concept, data_type, tab
+    """
+
+    listtabs = []
+    for tab, dftab in valuesetmanager.Sheets.items():
+        if 'concept_id' not in dftab.columns or 'grouping_concept' not in dftab.columns:
+            # e.g., the UMLS tab
+            continue
+        dftab = dftab.reindex(columns=['concept_id', 'grouping_concept', 'data_type'])
+        dftab['tab'] = tab
+        listtabs.append(dftab)
+
+    dfvaluesets = pd.concat(listtabs, ignore_index=True).dropna(subset=['concept_id'])
+    for col in ['concept_id', 'grouping_concept', 'data_type']:
+        dfvaluesets[col] = dfvaluesets[col].fillna('').astype(str).str.strip()
+    return dfvaluesets.drop_duplicates(subset=['concept_id', 'grouping_concept'])
+
+
+def getnumbertypes(values: pd.Series) -> pd.Series:
+    """
+    Classifies values as numbers with the rules of stringisintegerorfloat. Each distinct value is
+    classified once.
+    :param values: Series of strings
+    :return: Series of "integer", "float", or "not a number"
+    """
+
+    values = values.fillna('').astype(str)
+    dicttypes = {value: stringisintegerorfloat(value) for value in values.unique()}
+    return values.map(dicttypes)
+
+
+def validatemetadata(dfmetadata: pd.DataFrame, dfvaluesets: pd.DataFrame) -> pd.DataFrame:
+    """
+    Validates flattened donor metadata against valuesets.
+    :param dfmetadata: DataFrame of flattened metadata, with columns id, concept_id, grouping_concept and
+                       data_value. The index identifies rows in the error table--e.g., the row number in an
+                       uploaded file.
+    :param dfvaluesets: DataFrame from getvaluesetcontent
+    :return: DataFrame with a row for each error, with columns row (the index of dfmetadata), id, concept_id,
+             grouping_concept, data_value, check (the rule) and message. Empty if there are no errors.
+    """
+
+    dfrows = dfmetadata.reindex(columns=['id', 'concept_id', 'grouping_concept', 'data_value'])
+    dfrows = dfrows.fillna('').astype(str).apply(lambda col: col.str.strip())
+    dfrows['row'] = dfmetadata.index
+
+    # Membership of concepts, and of concept-grouping concept pairs.
+    concepts = set(dfvaluesets['concept_id'])
+    dfpairs = dfvaluesets[['concept_id', 'grouping_concept', 'data_type']].copy()
+    dfpairs['pair'] = True
+    dfrows = dfrows.merge(dfpairs, how='left', on=['concept_id', 'grouping_concept'])
+    isconcept = dfrows['concept_id'].isin(concepts)
+    ispair = dfrows['pair'].notna()
+
+    numbertype = getnumbertypes(dfrows['data_value'])
+    isnumeric = dfrows['data_type'].fillna('').str.lower() == 'numeric'
+    isage = dfrows['concept_id'] == AGE_YEARS
+    isinteger = dfrows['grouping_concept'].isin(INTEGER_CONCEPTS.keys())
+    agenum = pd.to_numeric(dfrows['data_value'].where(numbertype != 'not a number'), errors='coerce')
+
+    listerrors = [
+        (~isconcept, 'concept',
+         'concept_id ' + dfrows['concept_id'] + ' is not in a valueset.'),
+        (isconcept & ~ispair, 'grouping_concept',
+         'grouping_concept ' + dfrows['grouping_concept'] + ' does not match the valueset for concept_id '
+         + dfrows['concept_id'] + '.'),
+        ((isnumeric | isage) & (numbertype == 'not a number'), 'numeric',
+         'data_value ' + dfrows['data_value'] + ' must be a number.'),
+        (isinteger & (numbertype != 'integer'), 'integer',
+         dfrows['grouping_concept'].map(INTEGER_CONCEPTS).fillna('') + ' must be an integer.'),
+        (isage & (agenum > 89) & (agenum != 90), 'age',
+         pd.Series('All ages over 89 years must be set to 90 years.', index=dfrows.index)),
+    ]
+
+    dferrors = []
+    for mask, check, message in listerrors:
+        dfcheck = dfrows.loc[mask, ['row', 'id', 'concept_id', 'grouping_concept', 'data_value']]
+        dfcheck['check'] = check
+        dfcheck['message'] = message[mask]
+        dferrors.append(dfcheck)
+
+    return pd.concat(dferrors, ignore_index=True)[ERRORCOLUMNS].sort_values(by=['row', 'check'],
+                                                                             ignore_index=True)
@@ -0,0 +1,96 @@
+# Wide representation of flattened donor metadata: one row per donor, with a column per clinical variable.
+# The flattened (long) DataFrame has a row for each metadata element of a donor. The wide DataFrame pivots the
+# elements by grouping concept, so that each variable (e.g., Age, Sex, Height) is a column.
+# Variables for which a donor can have more than one element (e.g., Race, Social History) are list columns, with
+# the values of the elements separated by semicolons. Medical History is represented with an indicator column
+# for each condition.
+# Because this file is used by both the donor-metadata app and scripts in the
+# validate path, it does not import other helper classes.
+
+import numpy as np
+import pandas as pd
+
+# Grouping concept for Medical History
+MEDHX = 'C0262926'
+# Grouping concepts represented with indicator columns
+INDICATORGROUPS = [MEDHX]
+# Separator of the values in a list column
+LISTSEPARATOR = '; '
+# Columns of the long DataFrame that have one value per donor, and are kept as columns of the wide DataFrame.
+DONORCOLUMNS = ['id', 'consortium', 'source_name']
+
+
+def getgroupnames(dfm: pd.DataFrame) -> pd.Series:
+    """
+    Names the columns for grouping concepts.
+    :param dfm: DataFrame of metadata elements with columns grouping_concept and grouping_concept_preferred_term
+    :return: Series of column names, indexed by grouping concept. The name is the preferred term of the grouping
+             concept (or the grouping concept, if there is no preferred term). A name shared by more than one
+             grouping concept is qualified with the grouping concept.
+    """
+
+    dfgroups = dfm[['grouping_concept', 'grouping_concept_preferred_term']]
+    dfgroups = dfgroups[dfgroups['grouping_concept_preferred_term'] != ''].drop_duplicates(subset='grouping_concept')
+    names = pd.Series(dfm['grouping_concept'].unique(), index=dfm['grouping_concept'].unique())
+    names.update(dfgroups.set_index('grouping_concept')['grouping_concept_preferred_term'])
+    duplicated = names.duplicated(keep=False)
+    names[duplicated] = names[duplicated] + ' (' + names.index[duplicated] + ')'
+    return names
+
+
+def getwideframe(dfmetadata: pd.DataFrame, indicatorgroups: list = None) -> pd.DataFrame:
+    """
+    Pivots flattened donor metadata to one row per donor.
+    :param dfmetadata: DataFrame of flattened donor metadata (e.g., SearchAPI.getalldonormetadata)
+    :param indicatorgroups: optional list of grouping concepts represented with indicator columns; by default,
+                            INDICATORGROUPS
+    :return: DataFrame with a row for each donor, with columns:
+             id, and consortium and source_name, if in dfmetadata
+             for a grouping concept with at most one element per donor, the value of the element (the data value,
+                or the preferred term if there is no data value), and a column "name units" if any element has units
+             for another grouping concept, the values of the elements of the donor, separated by LISTSEPARATOR
+             for a grouping concept in indicatorgroups, a column "name: preferred term" for each concept, with
+                value yes or no
+    """
+
+    if indicatorgroups is None:
+        indicatorgroups = INDICATORGROUPS
+
+    dfm = dfmetadata.reindex(columns=['id', 'concept_id', 'preferred_term', 'grouping_concept',
+                                      'grouping_concept_preferred_term', 'data_value', 'units'])
+    dfm = dfm.fillna('').astype(str).apply(lambda col: col.str.strip())
+    dfm['value'] = dfm['data_value'].where(dfm['data_value'] != '', dfm['preferred_term'])
+    dfm['name'] = dfm['grouping_concept'].map(getgroupnames(dfm))
+
+    donorcolumns = [col for col in DONORCOLUMNS if col in dfmetadata.columns]
+    dfwide = dfmetadata[donorcolumns].fillna('').astype(str).drop_duplicates(subset='id').set_index('id')
+
+    # Classify grouping concepts by the largest number of elements for a donor.
+    isindicator = dfm['grouping_concept'].isin(indicatorgroups)
+    maxcount = dfm.groupby(['grouping_concept', 'id']).size().groupby(level='grouping_concept').max()
+    ismulti = dfm['grouping_concept'].map(maxcount) > 1
+    listwide = [dfwide]
+
+    # Single-valued grouping concepts: one pivot of values and one of units.
+    dfsingle = dfm[~isindicator & ~ismulti]
+    listwide.append(dfsingle.pivot(index='id', columns='name', values='value'))
+    unitnames = dfsingle.loc[dfsingle['units'] != '', 'name'].unique()
+    dfunits = dfsingle[dfsingle['name'].isin(unitnames)].pivot(index='id', columns='name', values='units')
+    listwide.append(dfunits.add_suffix(' units'))
+
+    # Multi-valued grouping concepts: list columns, with values in alphabetical order.
+    dfmulti = dfm[~isindicator & ismulti].sort_values(by='value', kind='stable')
+    listwide.append(dfmulti.groupby(['id', 'name'])['value'].agg(LISTSEPARATOR.join).unstack('name'))
+
+    # Indicator columns
+    dfindicator = dfm[isindicator]
+    dfcounts = pd.crosstab(index=dfindicator['id'], columns=dfindicator['name'] + ': ' + dfindicator['value'])
+    listwide.append(pd.DataFrame(np.where(dfcounts > 0, 'yes', 'no'), index=dfcounts.index, columns=dfcounts.columns))
+
+    dfwide = pd.concat(listwide, axis=1)
+    variablecolumns = sorted(col for col in dfwide.columns if col not in donorcolumns)
+    dfwide = dfwide[[col for col in donorcolumns if col != 'id'] + variablecolumns]
+    # Donors without elements for an indicator group have no indicators.
+    indicatorcolumns = list(dfcounts.columns)
+    dfwide[indicatorcolumns] = dfwide[indicatorcolumns].fillna('no')
+    return dfwide.fillna('').rename_axis('id').reset_index()
@@ -0,0 +1,257 @@
+"""
+Worklist of donors for the curation workflow.
+
+A curator can load a list of donor ids--e.g., from the *_donors_to_update.csv file written by the doi_donor.py
+validation script--and step through the donors in the edit page. While the curator edits a donor, the
+information needed for the next donors in the worklist is obtained in a pool of background threads:
+- the donor's current metadata, loaded for the upcoming donors in a batch (loaddonordata; search-api)
+- whether the donor is associated with published datasets, which locks the donor for updates (entity-api)
+- DOI information for the donor's published datasets (search-api and DataCite)
+
+Worklists are stored in the worker process under a worklist id, which is kept in the session cookie; the list
+of ids can be too large for the cookie. Worklists expire after the lifetime of the session.
+
+The number of upcoming donors to prefetch is set by the optional WORKLIST_PREFETCH key of the app.cfg file
+(default 3).
+
+"""
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, Future, CancelledError
+
+from werkzeug.exceptions import HTTPException
+
+# Helper classes
+from models.appconfig import AppConfig
+from models.donor import DonorData
+from models.loaddonordata import loaddonordata
+from models.searchapi import SearchAPI
+
+
+def fetchdonor(donorid: str, token: str, consortium: str, donordata: DonorData = None) -> dict:
+    """
+    Obtains the information for a donor in a worklist.
+    :param donorid: donor id
+    :param token: globus groups_token for the consortium
+    :param consortium: consortium
+    :param donordata: optional DonorData with the current metadata of the donor, already loaded--e.g., by
+                      loaddonordata. If not specified, the metadata is obtained from the entity-api.
+    :return: dict with keys:
+             donordata: DonorData with the current metadata of the donor
+             locked: whether the donor is associated with published datasets
+             dois: list of dicts of DOI information for the donor's published datasets
+             error: message if the donor could not be obtained; otherwise, None
+    """
+
+    try:
+        if donordata is None:
+            donordata = DonorData(donorid=donorid, token=token, isforupdate=False)
+        locked = donordata.entity.has_published_datasets()
+        dois = SearchAPI(consortium=consortium, token=token).getdatasetdoisfordonor(donorid=donorid)
+        return {'donordata': donordata, 'locked': locked, 'dois': dois, 'error': None}
+    except HTTPException as e:
+        return {'donordata': None, 'locked': None, 'dois': [], 'error': f'{e.code}: {e.description}'}
+
+
+def fetchdonors(futures: dict, token: str, consortium: str, executor: ThreadPoolExecutor):
+    """
+    Obtains the information for a set of upcoming donors in a worklist. The current metadata of the donors is
+    loaded in a batch (loaddonordata), with search-api queries for chunks of donors instead of an entity-api
+    request for each donor.
+    :param futures: dict of Futures for the results of fetchdonor, keyed by donor id. Futures that were cancelled
+                    are skipped.
+    :param token: globus groups_token for the consortium
+    :param consortium: consortium
+    :param executor: pool in which the rest of the information for each donor is obtained
+    """
+
+    running = {donorid: future for donorid, future in futures.items() if future.set_running_or_notify_cancel()}
+    if len(running) == 0:
+        return
+
+    try:
+        dictdonors = loaddonordata(donorids=list(running), token=token)[0]
+    except Exception:
+        dictdonors = {}
+
+    # Donors that were not loaded in the batch--e.g., because a search-api chunk failed--are obtained
+    # individually from the entity-api, which also reports why a donor cannot be obtained.
+    for donorid, future in running.items():
+        executor.submit(_completefetch, future, donorid, token, consortium, dictdonors.get(donorid))
+
+
+def _completefetch(future: Future, donorid: str, token: str, consortium: str, donordata: DonorData):
+    # Sets the result of a donor's Future from fetchdonor.
+    try:
+        future.set_result(fetchdonor(donorid=donorid, token=token, consortium=consortium, donordata=donordata))
+    except Exception as e:
+        future.set_exception(e)
+
+
+class Worklist:
+
+    # The store and the prefetch pool are shared by all instances of the class in the worker process.
+    # Each entry of the store is keyed by worklist id and is a dict with keys:
+    #   donorids: list of donor ids
+    #   position: index of the current donor
+    #   consortium: consortium of the donors
+    #   updated: set of ids of donors that were updated
+    #   prefetch: dict of Futures of fetchdonor, keyed by donor id
+    #   expires: expiration time, in seconds since the epoch
+    _store = {}
+    _lock = threading.Lock()
+    _executor = None
+
+    # Worklists expire after the lifetime of the session cookie (300 minutes).
+    ttl = 300 * 60
+
+    def __init__(self, worklistid: str = None):
+
+        cfg = AppConfig()
+        self.prefetchcount = int(cfg.getfield(key='WORKLIST_PREFETCH', default='3'))
+        with Worklist._lock:
+            if Worklist._executor is None:
+                Worklist._executor = ThreadPoolExecutor(max_workers=max(self.prefetchcount, 1),
+                                                        thread_name_prefix='worklist')
+        self.worklistid = worklistid
+
+    def create(self, donorids: list, consortium: str) -> str:
+        """
+        Stores a new worklist.
+        :param donorids: list of donor ids
+        :param consortium: consortium of the donors
+        :return: worklist id
+        """
+
+        self.worklistid = uuid.uuid4().hex
+        with self._lock:
+            self._purge()
+            self._store[self.worklistid] = {'donorids': list(dict.fromkeys(donorids)),
+                                            'position': 0,
+                                            'consortium': consortium,
+                                            'updated': set(),
+                                            'prefetch': {},
+                                            'expires': time.time() + self.ttl}
+        return self.worklistid
+
+    def _getentry(self) -> dict:
+        # Called with the lock held.
+        entry = self._store.get(self.worklistid)
+        if entry is None or entry['expires'] < time.time():
+            self._store.pop(self.worklistid, None)
+            return None
+        entry['expires'] = time.time() + self.ttl
+        return entry
+
+    def getstatus(self) -> dict:
+        """
+        Returns the state of the worklist.
+        :return: dict with keys donorids, position, donorid (the current donor), updated; or None if the worklist
+                 expired.
+        """
+
+        with self._lock:
+            entry = self._getentry()
+            if entry is None:
+                return None
+            donorid = None
+            if entry['position'] < len(entry['donorids']):
+                donorid = entry['donorids'][entry['position']]
+            return {'donorids': list(entry['donorids']),
+                    'position': entry['position'],
+                    'donorid': donorid,
+                    'updated': set(entry['updated'])}
+
+    def move(self, step: int, updated: bool = False) -> str:
+        """
+        Moves to another donor in the worklist.
+        :param step: number of positions to move--e.g., 1 for the next donor, -1 for the previous donor
+        :param updated: whether the current donor was updated
+        :return: the id of the new current donor, or None at the end of the worklist
+        """
+
+        with self._lock:
+            entry = self._getentry()
+            if entry is None:
+                return None
+            donorids = entry['donorids']
+            if entry['position'] < len(donorids):
+                current = donorids[entry['position']]
+                if updated:
+                    entry['updated'].add(current)
+                    # The prefetched metadata for the donor is out of date.
+                    entry['prefetch'].pop(current, None)
+            entry['position'] = min(max(entry['position'] + step, 0), len(donorids))
+            if entry['position'] < len(donorids):
+                return donorids[entry['position']]
+            return None
+
+    def prefetch(self, token: str):
+        """
+        Starts background fetches of the current donor and the next donors in the worklist, and discards
+        prefetched information for donors that are no longer upcoming.
+        :param token: globus groups_token for the consortium
+        """
+
+        with self._lock:
+            entry = self._getentry()
+            if entry is None:
+                return
+            position = entry['position']
+            upcoming = entry['donorids'][position:position + self.prefetchcount + 1]
+            # Keep the previous donor, so that the curator can move back without a fetch.
+            keep = set(upcoming + entry['donorids'][max(position - 1, 0):position])
+            for donorid in [d for d in entry['prefetch'] if d not in keep]:
+                entry['prefetch'].pop(donorid).cancel()
+            # The donors that are not already prefetched are fetched together.
+            futures = {donorid: Future() for donorid in upcoming if donorid not in entry['prefetch']}
+            if len(futures) > 0:
+                entry['prefetch'].update(futures)
+                self._executor.submit(fetchdonors, futures, token, entry['consortium'], self._executor)
+
+    def getdonor(self, donorid: str, token: str) -> dict:
+        """
+        Returns the information for a donor in the worklist--from the prefetch if it was started, waiting for it
+        to finish if necessary; otherwise, by fetching it.
+        :param donorid: donor id
+        :param token: globus groups_token for the consortium
+        :return: dict of fetchdonor
+        """
+
+        with self._lock:
+            entry = self._getentry()
+            future = None
+            consortium = None
+            if entry is not None:
+                future = entry['prefetch'].get(donorid)
+                consortium = entry['consortium']
+
+        if future is not None:
+            try:
+                return future.result()
+            except CancelledError:
+                # The prefetch was discarded--e.g., after a move in another request.
+                pass
+        return fetchdonor(donorid=donorid, token=token, consortium=consortium)
+
+    def delete(self):
+        """
+        Deletes the worklist.
+        """
+
+        with self._lock:
+            entry = self._store.pop(self.worklistid, None)
+            if entry is not None:
+                for future in entry['prefetch'].values():
+                    future.cancel()
+
+    def _purge(self):
+        """
+        Removes expired worklists. Called with the lock held.
+        """
+
+        now = time.time()
+        for worklistid in [k for k, v in self._store.items() if v['expires'] < now]:
+            for future in self._store.pop(worklistid)['prefetch'].values():
+                future.cancel()
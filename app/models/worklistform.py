@@ -0,0 +1,61 @@
+"""
+Form used to load a worklist of donors for curation--e.g., from the *_donors_to_update.csv file written by
+the doi_donor.py validation script.
+"""
+
+import re
+from wtforms import Form, ValidationError, SelectField, TextAreaField, FileField
+from models.appconfig import AppConfig
+from models.globusform import GlobusForm
+
+
+def getworklistids(text: str) -> list:
+    """
+    Extracts donor ids from text, in order of first appearance.
+    :param text: pasted text or the content of an uploaded file, with ids delimited by any non-id characters
+    :return: list of unique donor ids
+    """
+
+    return list(dict.fromkeys(id.upper() for id in re.findall(GlobusForm.regex, text)))
+
+
+def validate_donorids(form, field):
+    """
+    Custom validator.
+    Checks that the worklist has ids and that the first three characters of each id correspond to the
+    selected context.
+    :param form: the WorklistForm
+    :param field: the donorids field
+    :return: Nothing or raises ValidationError
+    """
+
+    if len(form.worklist) == 0:
+        raise ValidationError('No donor IDs in the pasted text or uploaded file. ' + GlobusForm.message)
+
+    prefix = {'CONTEXT_HUBMAP': 'HBM', 'CONTEXT_SENNET': 'SNT'}.get(form.consortium.data)
+    listwrong = [donorid for donorid in form.worklist if donorid[0:3] != prefix]
+    if len(listwrong) > 0:
+        raise ValidationError(f'Incorrect consortium for donor IDs: {", ".join(listwrong[0:10])}')
+
+
+class WorklistForm(Form):
+
+    # Read the app.cfg file outside the Flask application context.
+    cfg = AppConfig()
+
+    # Application context for entity-api URLs, corresponding to a consortium.
+    consortia = cfg.getfieldlist(prefix='CONTEXT_')
+    consortium = SelectField('Globus Consortium', choices=consortia)
+
+    # Donor ids can be pasted or uploaded in a file. Ids are extracted from any text, so that a CSV file
+    # with other columns can be uploaded.
+    donorids = TextAreaField('Donor IDs', validators=[validate_donorids])
+    donorfile = FileField('Donor ID file (e.g., consortium_donors_to_update.csv)')
+
+    # Ids from both the pasted text and the uploaded file, set by the route before validation.
+    worklist = []
+
+    # Clear validation errors. This handles the common use case in which the user returns to the form after
+    # seeing a 4XX error.
+    consortium.errors = []
+    donorids.errors = []
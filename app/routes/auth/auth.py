@@ -105,6 +105,10 @@ def login():
         user_info = get_user_info(auth_token)
 
         session['groups_token'] = groups_token
+        # Keep the tokens for each consortium, for workflows that work with more than one consortium.
+        tokens = session.get('groups_tokens', {})
+        tokens[consortium] = groups_token
+        session['groups_tokens'] = tokens
         session['consortium'] = consortium
         session['donorid'] = donorid
         session['userid'] = user_info.get('preferred_username')
@@ -113,7 +117,17 @@ def login():
         # April 2025 added DOI workflow.
         if donorid == 'ALL':
             return redirect(f'/export/review')
+        elif donorid == 'COMBINED':
+            # The combined export needs tokens for all consortia. Log in to the next consortium without a token.
+            consortia = [c[0] for c in AppConfig().getfieldlist(prefix='CONTEXT_')]
+            missing = [c for c in consortia if c not in tokens]
+            if len(missing) > 0:
+                session['consortium'] = missing[0]
+                return redirect(f'/login')
+            return redirect(f'/export/review')
         elif donorid == 'DOI':
             return redirect(f'/doi/review')
+        elif donorid == 'BULK':
+            return redirect(f'/bulk/review')
         else:
             return redirect(f'/edit')
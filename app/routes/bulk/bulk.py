@@ -0,0 +1,230 @@
+"""
+Routes for the bulk update of donor metadata from an uploaded TSV in the format of the export.
+
+After the user is authenticated, the metadata of each donor in the TSV is compared with the donor's current
+metadata, and the differences are displayed for review. When the user confirms, the updates for the changed
+donors run as a background job that makes concurrent, rate-limited PUT calls to the entity-api and writes a
+per-donor status report.
+
+"""
+
+import io
+import os
+import uuid
+import pandas as pd
+from flask import Blueprint, request, redirect, render_template, session, abort, jsonify, send_file, flash
+
+# Helper classes
+from models.bulkform import BulkForm
+from models.bulkupdate import readbulkfile, getbulkmetadata, getbulkdiffs, runbulkupdate
+from models.jobmanager import JobManager
+from models.editform import EditForm
+from models.valuesetvalidator import getvaluesetcontent, validatemetadata
+
+# Maximum number of validation errors to display.
+MAXERRORS = 500
+
+bulk_select_blueprint = Blueprint('bulk_select', __name__, url_prefix='/bulk/select')
+
+
+@bulk_select_blueprint.route('', methods=['GET', 'POST'])
+def bulk_select():
+
+    # Load form that allows for the upload of a TSV of donor metadata for a consortium.
+    form = BulkForm(request.form)
+
+    # Clear messages.
+    if 'flashes' in session:
+        session['flashes'].clear()
+
+    if request.method == 'POST' and form.validate():
+        bulkfile = request.files.get('bulkfile')
+        if bulkfile is None or bulkfile.filename == '':
+            form.bulkfile.errors = ['Select a TSV file.']
+            return render_template('bulk_select.html', form=form)
+
+        # Check the file before authenticating.
+        content = bulkfile.read()
+        try:
+            dfupdate = readbulkfile(stream=io.BytesIO(content))
+        except ValueError as e:
+            form.bulkfile.errors = [str(e)]
+            return render_template('bulk_select.html', form=form)
+        # Validate all rows against the valuesets used by the Edit form. The row numbers are the lines of the file.
+        dfvalidation = validatemetadata(dfmetadata=dfupdate.set_axis(dfupdate.index + 2),
+                                        dfvaluesets=getvaluesetcontent(EditForm.valuesetmanager))
+        if len(dfvalidation) > 0:
+            form.bulkfile.errors = [f'{len(dfvalidation)} rows of the file do not conform to the valuesets. '
+                                    f'Correct the rows and upload the file again.']
+            errortable = dfvalidation.head(MAXERRORS).to_html(
+                index=False, classes='table table-hover table-bordered table-responsive-sm')
+            return render_template('bulk_select.html', form=form, errortable=errortable)
+
+        dictmetadata, dicterrors = getbulkmetadata(dfupdate=dfupdate, consortium=form.consortium.data)
+        if len(dictmetadata) == 0:
+            form.bulkfile.errors = ['The file has no valid donors for the consortium.']
+            return render_template('bulk_select.html', form=form)
+
+        # The upload can be too large for the session cookie. Keep it on the server until the user is
+        # authenticated.
+        uploadid = uuid.uuid4().hex
+        with open(getuploadfile(uploadid=uploadid), 'wb') as f:
+            f.write(content)
+        session['bulkupload'] = uploadid
+
+        # Pass the Globus environment to which to authenticate.
+        session['consortium'] = form.consortium.data
+        # Indicate to the Globus auth that this is for a bulk update.
+        session['donorid'] = 'BULK'
+        # Authenticate to Globus via the login route.
+        # If login is successful, Globus will redirect to the bulk review page.
+        return redirect(f'/login')
+
+    # Render the bulk update form.
+    return render_template('bulk_select.html', form=form)
+
+
+bulk_review_blueprint = Blueprint('bulk_review', __name__, url_prefix='/bulk/review')
+
+
+@bulk_review_blueprint.route('', methods=['GET', 'POST'])
+def bulk_review():
+
+    # Redirected from the Globus authorization (the /login route in the auth path), which
+    # was invoked by the bulk_select function.
+    # For a new upload, the bulk review page displays the differences between the metadata in the file and the
+    # current metadata of the donors, for confirmation. After confirmation, the page polls the progress of the
+    # background update job.
+
+    consortium = session['consortium']
+    token = session['groups_token']
+
+    if request.method == 'POST':
+        # Confirmation or cancellation of the update previewed for the upload.
+        uploadid = session.pop('bulkpreview', None)
+        if uploadid is None or not os.path.exists(getuploadfile(uploadid=uploadid)) \
+                or not os.path.exists(getpreviewfile(uploadid=uploadid)):
+            abort(404, 'The uploaded file expired. Upload the file again.')
+        with open(getuploadfile(uploadid=uploadid), 'rb') as f:
+            dfupdate = readbulkfile(stream=f)
+        dfpreview = pd.read_csv(getpreviewfile(uploadid=uploadid), dtype=str, keep_default_na=False)
+        os.remove(getuploadfile(uploadid=uploadid))
+        os.remove(getpreviewfile(uploadid=uploadid))
+
+        if request.form.get('action') != 'confirm':
+            flash('Bulk update cancelled.')
+            return redirect('/')
+
+        # Update only the donors with differences from their current metadata.
+        dictmetadata, dicterrors = getbulkmetadata(dfupdate=dfupdate, consortium=consortium)
+        changed = set(dfpreview.loc[dfpreview['status'] == 'changed', 'id'])
+        dictskipped = dfpreview[dfpreview['status'] != 'changed'].set_index('id')['status'].to_dict()
+        dictmetadata = {donorid: metadata for donorid, metadata in dictmetadata.items() if donorid in changed}
+        jobid = JobManager().submitjob(kind='bulk', scope=consortium, target=runbulkupdate,
+                                       consortium=consortium, token=token, dictmetadata=dictmetadata,
+                                       dicterrors=dicterrors, dictskipped=dictskipped)
+        session['bulkjobid'] = jobid
+        return redirect('/bulk/review')
+
+    # Preview a new upload, or the upload that is waiting for confirmation--e.g., after a reload; otherwise,
+    # display the job for the last upload.
+    uploadid = session.pop('bulkupload', None)
+    if uploadid is None:
+        uploadid = session.get('bulkpreview')
+        if uploadid is None or not os.path.exists(getpreviewfile(uploadid=uploadid)):
+            session.pop('bulkpreview', None)
+            jobid = session.get('bulkjobid')
+            if jobid is None:
+                return redirect('/bulk/select')
+            return render_template('bulk_review.html', jobid=jobid)
+
+    uploadfile = getuploadfile(uploadid=uploadid)
+    if not os.path.exists(uploadfile):
+        abort(404, 'The uploaded file expired. Upload the file again.')
+    with open(uploadfile, 'rb') as f:
+        dfupdate = readbulkfile(stream=f)
+    dictmetadata, dicterrors = getbulkmetadata(dfupdate=dfupdate, consortium=consortium)
+
+    previewfile = getpreviewfile(uploadid=uploadid)
+    if session.get('bulkpreview') == uploadid:
+        dfpreview = pd.read_csv(previewfile, dtype=str, keep_default_na=False)
+    else:
+        dfpreview = getbulkdiffs(dictmetadata=dictmetadata, token=token)
+        # Keep the preview with the upload until the user confirms.
+        dfpreview.to_csv(previewfile, index=False)
+        session['bulkpreview'] = uploadid
+
+    counts = dfpreview['status'].value_counts().to_dict()
+    counts['invalid'] = len(dicterrors)
+    dfdisplay = dfpreview[dfpreview['status'] != 'unchanged']
+    difftable = dfdisplay.head(MAXERRORS).to_html(
+        index=False, classes='table table-hover table-bordered table-responsive-sm')
+    return render_template('bulk_preview.html', counts=counts, difftable=difftable,
+                           truncated=len(dfdisplay) > MAXERRORS, maxrows=MAXERRORS)
+
+
+bulk_jobs_blueprint = Blueprint('bulk_jobs', __name__, url_prefix='/bulk/jobs')
+
+
+@bulk_jobs_blueprint.route('/<jobid>', methods=['GET'])
+def bulk_job(jobid: str):
+    """
+    Returns the status of a background bulk update job as JSON.
+    """
+
+    job = getbulkjob(jobid=jobid)
+    dictjob = {'jobid': jobid,
+               'status': job['status'],
+               'phase': job['phase'],
+               'counts': job['counts'],
+               'message': job['message']}
+    if job['status'] == 'complete':
+        dictjob['report'] = f'/bulk/jobs/{jobid}/report'
+    return jsonify(dictjob)
+
+
+@bulk_jobs_blueprint.route('/<jobid>/report', methods=['GET'])
+def bulk_job_report(jobid: str):
+    """
+    Downloads the per-donor status report of a bulk update job, as CSV.
+    """
+
+    job = getbulkjob(jobid=jobid)
+    if job['status'] != 'complete' or not os.path.exists(job['artifact']):
+        abort(404, f'No report for bulk update job {jobid}.')
+
+    fname = job['scope'].split('_')[1].lower()
+    return send_file(job['artifact'], mimetype='text/csv', as_attachment=True,
+                     download_name=f'{fname}_bulk_update_report.csv')
+
+
+def getbulkjob(jobid: str) -> dict:
+    """
+    Returns a bulk update job for the consortium of the session.
+    :param jobid: job id
+    :return: dict of job state, or aborts
+    """
+
+    job = JobManager().getjob(jobid=jobid)
+    if job is None or job['kind'] != 'bulk' or job['scope'] != session.get('consortium'):
+        abort(404, f'No bulk update job with id {jobid}')
+    return job
+
+
+def getuploadfile(uploadid: str) -> str:
+    """
+    Returns the path to an uploaded TSV that is kept until the user confirms the update.
+    :param uploadid: id of the upload
+    """
+
+    return os.path.join(JobManager().artifactpath, f'{uploadid}_upload.tsv')
+
+
+def getpreviewfile(uploadid: str) -> str:
+    """
+    Returns the path to the preview (getbulkdiffs) of an uploaded TSV, which is kept until the user confirms
+    the update.
+    :param uploadid: id of the upload
+    """
+
+    return os.path.join(JobManager().artifactpath, f'{uploadid}_preview.csv')
@@ -0,0 +1,116 @@
+"""
+Routes for comparing donor clinical metadata with DOI titles for
+associated published datasets.
+
+April 2025
+
+The comparison for all donors in a consortium runs as a background job that records completed donors in a
+checkpoint. An interrupted comparison resumes with the donors that were not complete. The rows for completed
+donors can be downloaded while the job runs.
+
+"""
+
+from flask import Blueprint, request, redirect, render_template, session, flash, abort, jsonify, Response
+
+# Helper classes
+from models.doiform import DOIForm
+from models.jobmanager import JobManager
+from models.doijob import rundoijob
+from models.doicheckpoint import DOICheckpoint
+from models.exportstream import streamdelimitedframes
+
+doi_select_blueprint = Blueprint('doi_select', __name__, url_prefix='/doi/select')
+
+@doi_select_blueprint.route('', methods=['GET','POST'])
+def doi_select():
+
+    # Load form that allows for specification of the consortium for which donor metadata will be
+    # compared with DOI titles.
+
+    form = DOIForm(request.form)
+
+    # Clear messages.
+    if 'flashes' in session:
+        session['flashes'].clear()
+
+    if request.method == 'POST' and form.validate():
+        # Pass the Globus environment to which to authenticate.
+        session['consortium'] = form.consortium.data
+        # Indicate to the Globus auth that this is for DOI comparison of all donors in the consortium.
+        session['donorid'] = 'DOI'
+        session['doirestart'] = form.restart.data
+
+        # Authenticate to Globus via the login route.
+        # If login is successful, Globus will redirect to the DOI review page.
+        return redirect(f'/login')
+
+    # Render the DOI selection form.
+    return render_template('doi_select.html', form=form)
+
+
+doi_review_blueprint = Blueprint('doi_review', __name__, url_prefix='/doi/review')
+
+@doi_review_blueprint.route('', methods=['GET'])
+def doi_review():
+
+    # Redirected from the Globus authorization (the /login route in the auth path), which
+    # was invoked by the doi_select function.
+    # The DOI review page polls the progress of the background DOI job.
+
+    consortium = session['consortium']
+    token = session['groups_token']
+    restart = session.pop('doirestart', False)
+
+    # Only one job at a time writes to the checkpoint for a consortium. Reuse an active job unless the user
+    # chose to start over.
+    jobmanager = JobManager()
+    job = jobmanager.getactivejob(kind='doi', scope=consortium)
+    if job is not None and restart:
+        flash('A DOI comparison for the consortium is already running, so the comparison cannot start over.')
+    if job is None:
+        jobid = jobmanager.submitjob(kind='doi', scope=consortium, target=rundoijob,
+                                     consortium=consortium, token=token, restart=restart)
+    else:
+        jobid = job['jobid']
+
+    return render_template('doi_review.html', jobid=jobid)
+
+
+doi_jobs_blueprint = Blueprint('doi_jobs', __name__, url_prefix='/doi/jobs')
+
+@doi_jobs_blueprint.route('/<jobid>', methods=['GET'])
+def doi_job(jobid: str):
+    """
+    Returns the status of a background DOI job as JSON.
+    """
+
+    job = JobManager().getjob(jobid=jobid)
+    if job is None or job['kind'] != 'doi' or job['scope'] != session.get('consortium'):
+        abort(404, f'No DOI job with id {jobid}')
+
+    return jsonify({'jobid': jobid,
+                    'status': job['status'],
+                    'phase': job['phase'],
+                    'counts': job['counts'],
+                    'message': job['message']})
+
+
+doi_results_blueprint = Blueprint('doi_results', __name__, url_prefix='/doi/results')
+
+@doi_results_blueprint.route('', methods=['GET'])
+def doi_results():
+    """
+    Downloads, as CSV, the DOI metadata rows for the donors of the consortium of the session that are complete.
+    The download can be requested while the DOI job runs.
+    """
+
+    consortium = session.get('consortium')
+    if consortium is None or session.get('groups_token') is None:
+        abort(401, 'Log in to a consortium to download DOI comparison results.')
+
+    # Stream the rows from the checkpoint in chunks.
+    checkpoint = DOICheckpoint(consortium=consortium)
+    response = Response(streamdelimitedframes(dfchunks=checkpoint.getrows(), sep=','))
+    response.headers["Content-Disposition"] = f"attachment; filename={consortium.split('_')[1]}_doi_metadata.csv"
+    response.headers["Content-Type"] = f"text/csv"
+    return response
@@ -10,7 +10,7 @@ Does the following:
 4. Routes the existing and changed metadata to the review page.
 """
 
-from flask import Blueprint, request, render_template, flash, session, abort
+from flask import Blueprint, request, render_template, flash, session, abort, redirect
 from wtforms import SelectField, Field
 import base64
 import pickle
@@ -26,6 +26,8 @@ from models.editform import EditForm
 from models.setinputdisabled import setinputdisabled
 from models.searchapi import SearchAPI
 from models.stringnumber import stringisintegerorfloat
+# Worklist of donors, with prefetched information for upcoming donors
+from models.worklist import Worklist
 
 edit_blueprint = Blueprint('edit', __name__, url_prefix='/edit')
 
@@ -44,7 +46,20 @@ def edit():
     # Obtain the donor id from the session cookie.
     donorid = session['donorid']
 
-    form.currentdonordata = DonorData(donorid=donorid, token=token, isforupdate=False)
+    # In worklist mode, use the prefetched information for the donor and start prefetching the next donors.
+    worklist = getworklist(donorid=donorid)
+    dictworklist = None
+    if worklist is None:
+        form.currentdonordata = DonorData(donorid=donorid, token=token, isforupdate=False)
+    else:
+        worklist.prefetch(token=token)
+        dictworklist = dict(worklist.getdonor(donorid=donorid, token=token))
+        if dictworklist['error'] is not None:
+            # Skip donors that cannot be curated instead of ending the worklist with an error page.
+            flash(f"Skipped {donorid} ({dictworklist['error']})")
+            return redirect('/worklist/move?step=1')
+        form.currentdonordata = dictworklist['donordata']
+        dictworklist.update(worklist.getstatus())
 
     if request.method == 'GET':
         # This is from the redirect from the login page.
@@ -78,9 +93,12 @@ def edit():
 
         # April 2025
         # Obtain DOI titles for any published datasets associated with the donor.
-        consortium = session['consortium']
-        search = SearchAPI(consortium=consortium, token=token)
-        listdoi = search.getdatasetdoisfordonor(donorid=donorid)
+        if dictworklist is not None:
+            listdoi = dictworklist['dois']
+        else:
+            consortium = session['consortium']
+            search = SearchAPI(consortium=consortium, token=token)
+            listdoi = search.getdatasetdoisfordonor(donorid=donorid)
         if len(listdoi)>0:
             dfdonordoi = pd.DataFrame(listdoi)
             form.donordoitable = dfdonordoi.to_html(classes='table table-hover .table-condensed { font-size: 8px !important; } '
@@ -88,7 +106,7 @@ def edit():
 
         # Pass existing and changed metadata to the review/update form.
         return render_template('review.html', donorid=donorid,
-                               form=form)
+                               form=form, worklist=dictworklist)
     else:
         # Donor id
         form.donorid.data = form.currentdonordata.donorid
@@ -98,7 +116,24 @@ def edit():
         form.consortium.data = form.currentdonordata.consortium
         setinputdisabled(form.consortium, disabled=True)
 
-    return render_template('edit.html', donorid=donorid, form=form)
+    return render_template('edit.html', donorid=donorid, form=form, worklist=dictworklist)
+
+
+def getworklist(donorid: str) -> Worklist:
+    """
+    Returns the worklist of the session if the donor is the current donor of the worklist.
+    :param donorid: donor id
+    :return: Worklist or None
+    """
+
+    if 'worklistid' not in session:
+        return None
+    worklist = Worklist(worklistid=session['worklistid'])
+    status = worklist.getstatus()
+    if status is None or status['donorid'] != donorid:
+        return None
+    return worklist
+
 
 def setdefaults(form):
     """
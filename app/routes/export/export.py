@@ -3,15 +3,30 @@ Routes for the metadata export workflows.
 
 """
 
-from flask import Blueprint, request, redirect, render_template, session, make_response, flash, abort, send_file
+from flask import (Blueprint, request, redirect, render_template, session, make_response, flash, abort, send_file,
+                   jsonify, Response)
+import os
+import time
 import pickle
 import base64
+import pandas as pd
 
 # Helper classes
+from models.appconfig import AppConfig
 from models.exportform import ExportForm
-from models.searchapi import SearchAPI
 from models.metadataframe import MetadataFrame
 from models.getmetadatabytype import getmetadatabytype
+from models.exportcache import ExportCache
+from models.exportpage import getexportpage
+from models.exportstream import streamexport, exportcontenttypes
+from models.jobmanager import JobManager
+from models.exportjob import runexportjob, runcombinedexportjob, loadexportartifact, COMBINEDSCOPE
+from models.snapshot import getpublishedsnapshot
+from models.qualityscan import getqualityissues, getdonorqualityreport
+from models.wideframe import getwideframe
+from models.donorindex import DonorIndex
+from models.compactframe import getexportframe
+from models.editform import EditForm
 
 export_select_blueprint = Blueprint('export_select', __name__, url_prefix='/export/select')
 
@@ -31,8 +46,12 @@ def export_select():
     if request.method == 'POST' and form.validate():
         # Pass the Globus environment to which to authenticate.
         session['consortium'] = form.consortium.data
-        # Indicate to the Globus auth that this is for all donors in the consortium.
-        session['donorid'] = 'ALL'
+        # Indicate to the Globus auth that this is for all donors in the consortium--or, for a combined export,
+        # for all donors in all consortia, in which case the Globus auth logs in to each consortium in turn.
+        if form.combined.data:
+            session['donorid'] = 'COMBINED'
+        else:
+            session['donorid'] = 'ALL'
         # Authenticate to Globus via the login route.
         # If login is successful, Globus will redirect to the export review page.
         return redirect(f'/login')
@@ -47,61 +66,402 @@ export_review_blueprint = Blueprint('export_review', __name__, url_prefix='/expo
 def export_review():
 
     donorid = session['donorid']
+    scope = getexportscope()
 
-    if donorid == 'ALL':
-        # Obtain all donor metadata for a consortium.
-        # Populate review form with consortium donor metadata.
-        consortium = session['consortium']
-        token = session['groups_token']
+    # The export DataFrame is computed once and stored server-side under an export id. The export review page
+    # displays the stored export; the download buttons post the export id back to this route.
+    if request.method == 'POST':
+        exportid = request.form.get('exportid')
+        dfexportmetadata = getstoredexport(exportid=exportid, scope=scope)
+        if dfexportmetadata is None:
+            if donorid in ['ALL', 'COMBINED']:
+                # Rebuild the expired export in the background.
+                flash('The export expired and is being rebuilt.')
+                return redirect('/export/review')
+            dfexportmetadata = getexportmetadata(donorid=donorid)
+
+        # Export the export review form content, indicated by the value of the clicked button in the form.
+        format = request.form.getlist('export')[0]
+        fname = getexportfname(scope=scope)
+        if request.form.get('layout') == 'wide':
+            # One row per donor.
+            dfexportmetadata = getwideexport(exportid=exportid, scope=scope, dfexport=dfexportmetadata)
+            fname = f'{fname}_wide'
+        response = getexportresponse(dfexport=dfexportmetadata, format=format, fname=fname)
+        if exportid is not None and exportid == session.get('staleexportid'):
+            addstaleheaders(response=response)
+        flash(f'Metadata for {fname} exported.')
+        return response
+
+    # Redirected from the Globus authorization (the /login route in the auth path).
+    # The export review page obtains rows of the stored export incrementally from the rows route.
+    if donorid in ['ALL', 'COMBINED']:
+        # Building the export for all donors in a consortium requires a sweep of the search-api, which can take
+        # longer than a request should wait. The latest export for the scope is published as a snapshot.
+        # If the snapshot is within its TTL, display it.
+        # If the snapshot is older than its TTL but within the max-stale bound, display it, marked as stale, while a
+        # background job refreshes it.
+        # Otherwise, build the export in a background job, which the export review page polls for progress.
+        ttl, maxstale = getsnapshotbounds()
+        dfsnapshot, age = getpublishedsnapshot(scope=scope)
+        if dfsnapshot is not None and age <= ttl + maxstale:
+            refreshjobid = None
+            if age > ttl:
+                refreshjobid = submitexportjob(scope=scope)
+            exportid = ExportCache().addexport(dfexport=dfsnapshot, scope=scope)
+            response = make_response(render_template('export_review.html', exportid=exportid, jobid=None,
+                                                     snapshotage=round(age / 60), refreshjobid=refreshjobid))
+            if refreshjobid is not None:
+                # Downloads of the stale export are also marked as stale.
+                session['staleexportid'] = exportid
+                addstaleheaders(response=response, age=age)
+            return response
+
+        # There is no usable snapshot. Reuse the job for this session if it is still running or its export is
+        # stored.
+        jobid = session.get('exportjobid')
+        job = None
+        if jobid is not None:
+            job = JobManager().getjob(jobid=jobid)
+        if job is None or job['scope'] != scope or job['status'] == 'failed' \
+                or (job['status'] == 'complete' and ExportCache().getexport(exportid=jobid, scope=scope) is None):
+            jobid = submitexportjob(scope=scope)
+        return render_template('export_review.html', exportid=jobid, jobid=jobid)
+
+    dfexportmetadata = getexportmetadata(donorid=donorid)
+    exportid = ExportCache().addexport(dfexport=dfexportmetadata, scope=scope)
+    return render_template('export_review.html', exportid=exportid, jobid=None)
+
+
+@export_review_blueprint.route('/rows', methods=['GET'])
+def export_rows():
+    """
+    Returns a page of rows from a stored export as JSON.
+    Query arguments:
+    exportid: id of the stored export
+    page: 1-based page number (default 1)
+    size: rows per page (default 100; maximum 1000)
+    sort: column by which to sort
+    order: asc or desc
+    filter_<column>: case-insensitive text that values in the column must contain
+    """
+
+    exportid = request.args.get('exportid')
+    dfexportmetadata = getstoredexport(exportid=exportid, scope=getexportscope())
+    if dfexportmetadata is None:
+        abort(404, f'No export with id {exportid}. The export may have expired; reload the export review page.')
+
+    try:
+        page = max(int(request.args.get('page', 1)), 1)
+        size = min(max(int(request.args.get('size', 100)), 1), 1000)
+    except ValueError:
+        abort(400, 'page and size must be integers')
+
+    sort = request.args.get('sort')
+    ascending = request.args.get('order', 'asc') != 'desc'
+    filters = {}
+    for key, value in request.args.items():
+        if key.startswith('filter_'):
+            filters[key[len('filter_'):]] = value
+
+    return jsonify(getexportpage(dfexport=dfexportmetadata, page=page, size=size, sort=sort,
+                                 ascending=ascending, filters=filters))
+
+
+export_jobs_blueprint = Blueprint('export_jobs', __name__, url_prefix='/export/jobs')
+
+@export_jobs_blueprint.route('/<jobid>', methods=['GET'])
+def export_job(jobid: str):
+    """
+    Returns the status of a background export job as JSON.
+    """
+
+    job = getexportjob(jobid=jobid)
+    dictjob = {'jobid': jobid,
+               'status': job['status'],
+               'phase': job['phase'],
+               'counts': job['counts'],
+               'message': job['message']}
+    if job['status'] == 'complete':
+        dictjob['download'] = f'/export/jobs/{jobid}/download'
+    return jsonify(dictjob)
+
+
+@export_jobs_blueprint.route('/<jobid>/download', methods=['GET'])
+def export_job_download(jobid: str):
+    """
+    Downloads the export built by a background export job.
+    Query arguments:
+    format: export format (default tsv)
+    layout: long (default; a row per metadata element) or wide (a row per donor)
+    """
+
+    job = getexportjob(jobid=jobid)
+    if job['status'] != 'complete':
+        abort(404, f'Export job {jobid} is {job["status"]}.')
+
+    dfexportmetadata = getstoredexport(exportid=jobid, scope=job['scope'])
+    if dfexportmetadata is None:
+        abort(404, f'The export for job {jobid} expired.')
+
+    fname = getexportfname(scope=job['scope'])
+    if request.args.get('layout', 'long') == 'wide':
+        dfexportmetadata = getwideexport(exportid=jobid, scope=job['scope'], dfexport=dfexportmetadata)
+        fname = f'{fname}_wide'
+    return getexportresponse(dfexport=dfexportmetadata, format=request.args.get('format', 'tsv'), fname=fname)
+
+
+export_quality_blueprint = Blueprint('export_quality', __name__, url_prefix='/export/quality')
+
+@export_quality_blueprint.route('', methods=['POST'])
+def export_quality():
+    """
+    Downloads, as CSV, a per-donor report of data-quality issues in the stored export--e.g., unexpected units
+    or legacy concepts that disable the Edit form--so that problem donors are found before editing.
+    """
+
+    scope = getexportscope()
+    exportid = request.form.get('exportid')
+    dfexportmetadata = getstoredexport(exportid=exportid, scope=scope)
+    if dfexportmetadata is None:
+        abort(404, 'The export expired. Select the export again.')
+
+    valuesetmanager = EditForm.valuesetmanager
+    dfissues = getqualityissues(
+        dfalldonormetadata=dfexportmetadata,
+        mechanismconcepts=valuesetmanager.getcolumnvalues(tab='Mechanism of Injury', col='concept_id'),
+        medhxconcepts=valuesetmanager.getcolumnvalues(tab='Medical History', col='concept_id'))
+    dfreport = getdonorqualityreport(dfissues=dfissues)
+
+    fname = getexportfname(scope=scope)
+    response = Response(dfreport.to_csv(index=False))
+    response.headers["Content-Disposition"] = f"attachment; filename={fname}_quality_report.csv"
+    response.headers["Content-Type"] = "text/csv"
+    return response
+
+
+export_query_blueprint = Blueprint('export_query', __name__, url_prefix='/export/query')
+
+@export_query_blueprint.route('', methods=['POST'])
+def export_query():
+    """
+    Queries the donors of a stored export, with an in-memory index of the export (DonorIndex).
+    The request body is a JSON object with keys:
+    exportid: id of the stored export
+    query: query, in the format described in the donorindex module
+    return: ids (default; the ids of matching donors) or rows (also the metadata rows of matching donors)
+    limit: maximum number of donors for which to return rows (default 100)
+    """
+
+    body = request.get_json(silent=True)
+    if body is None or 'query' not in body:
+        abort(400, 'The request body must be a JSON object with keys exportid and query.')
+
+    exportid = body.get('exportid')
+    dfexportmetadata = getstoredexport(exportid=exportid, scope=getexportscope())
+    if dfexportmetadata is None:
+        abort(404, f'No export with id {exportid}. The export may have expired; reload the export review page.')
 
-        # Get DataFrame of metadata rows.
-        dfexportmetadata = SearchAPI(consortium=consortium, token=token).getalldonormetadata()
+    start = time.perf_counter()
+    index = DonorIndex.getindex(exportid=exportid, dfexport=dfexportmetadata)
+    try:
+        donors = index.query(dictquery=body['query'])
+    except ValueError as e:
+        abort(400, str(e))
+    donorids = index.getdonorids(donors=donors)
+
+    dictresult = {'exportid': exportid, 'count': len(donorids), 'donors': donorids}
+    if body.get('return', 'ids') == 'rows':
+        try:
+            limit = int(body.get('limit', 100))
+        except (TypeError, ValueError):
+            abort(400, 'limit must be an integer')
+        dfrows = getexportframe(dfexportmetadata)
+        dfrows = dfrows[dfrows['id'].isin(donorids[:limit])]
+        dictresult['columns'] = dfrows.columns.to_list()
+        dictresult['rows'] = dfrows.fillna('').astype(str).values.tolist()
+    dictresult['milliseconds'] = round((time.perf_counter() - start) * 1000, 1)
+    return jsonify(dictresult)
+
+
+def getexportjob(jobid: str) -> dict:
+    """
+    Returns an export job for the export scope of the session.
+    :param jobid: job id
+    :return: dict of job state, or aborts
+    """
+
+    job = JobManager().getjob(jobid=jobid)
+    if job is None or job['kind'] != 'export' or job['scope'] != getexportscope():
+        abort(404, f'No export job with id {jobid}')
+    return job
+
+
+def submitexportjob(scope: str) -> str:
+    """
+    Starts a background job that builds the export for all donors of the export scope of the session, unless
+    a job for the scope is already running--e.g., for another session--so that at most one sweep of the
+    search-api runs for a scope.
+    :param scope: export scope (getexportscope)
+    :return: id of the job, which is also stored in the session
+    """
+
+    jobmanager = JobManager()
+    job = jobmanager.getactivejob(kind='export', scope=scope)
+    if job is not None:
+        jobid = job['jobid']
+    elif scope == COMBINEDSCOPE:
+        # The sweeps of the consortia run concurrently in the job.
+        jobid = jobmanager.submitjob(kind='export', scope=scope, target=runcombinedexportjob,
+                                     tokens=session['groups_tokens'])
     else:
-        # Obtain and decode the base64-encoded dictionary of new donor metadata,
-        # which is stored in the session cookie.
-        newdonorb64 = session['newdonortsv']
-        if len(newdonorb64) > 0:
-            newdonor = pickle.loads(base64.b64decode(newdonorb64[0]))  # Decoded back to dictionary
-        else:
-            abort(400, 'No new metadata')
+        jobid = jobmanager.submitjob(kind='export', scope=scope, target=runexportjob,
+                                     consortium=session['consortium'], token=session['groups_token'])
+    session['exportjobid'] = jobid
+    return jobid
 
-        # Flatten for source_name.
-        dfnewdonortype = getmetadatabytype(dictmetadata=newdonor)
 
-        # Flatten for donor id.
-        donorid = session['donorid']
-        consortium = session['consortium']
+def getsnapshotbounds() -> tuple:
+    """
+    Returns the bounds on the age of a published export snapshot, in seconds, from the optional keys of the
+    app.cfg file:
+    SNAPSHOT_TTL: minutes for which a snapshot is displayed as current (default 60)
+    SNAPSHOT_MAX_STALE: minutes after the TTL for which a snapshot is displayed, marked as stale, while it is
+                        refreshed (default 1440)
+    :return: tuple of TTL and max-stale bound
+    """
 
-        dfexportmetadata = MetadataFrame(metadata=dfnewdonortype, donorid=donorid).dfexport
+    cfg = AppConfig()
+    ttl = float(cfg.getfield(key='SNAPSHOT_TTL', default='60')) * 60
+    maxstale = float(cfg.getfield(key='SNAPSHOT_MAX_STALE', default='1440')) * 60
+    return ttl, maxstale
 
-    if request.method == 'GET':
-        # Redirected from the Globus authorization (the /login route in the auth path).
-        # Convert the export metadata dataset to an HTML table that will be displayed
-        # in the associated web page.
-        table = dfexportmetadata.to_html(classes='table table-hover .table-condensed { font-size: 8px !important; } '
-                                                  'table-bordered table-responsive-sm')
 
-    if request.method == 'POST':
-        # Export the export review form content, indicated by the value of the clicked button in the form.
-        format = request.form.getlist('export')[0]
-        if format == 'csv':
-            sep = ','
-        else:
-            sep = '\t'
-        export_string = dfexportmetadata.to_csv(index=False, sep=sep)
+def addstaleheaders(response: Response, age: float = None):
+    """
+    Marks a response that contains a stale export snapshot, with the HTTP Warning and Age headers.
+    :param response: Response
+    :param age: optional age of the snapshot, in seconds
+    """
 
-        # Create a response with the exported data
-        response = make_response(export_string)
-        if donorid == 'ALL':
-            fname = consortium.split('_')[1].lower()
-        else:
-            fname = donorid
-        response.headers["Content-Disposition"] = f"attachment; filename={fname}_metadata.{format}"
-        response.headers["Content-Type"] = f"text/{format}"
-        flash(f'Metadata for {fname} exported.')
-        return response
+    response.headers['Warning'] = '110 - "Response is Stale"'
+    if age is not None:
+        response.headers['Age'] = str(int(age))
+
+
+def getexportscope() -> str:
+    """
+    Returns the scope of the export in the session: the consortium, for all donors; COMBINEDSCOPE, for all
+    donors in all consortia; otherwise, the donor id.
+    """
+
+    donorid = session.get('donorid')
+    if donorid == 'ALL':
+        return session.get('consortium')
+    if donorid == 'COMBINED':
+        return COMBINEDSCOPE
+    return donorid
+
+
+def getexportfname(scope: str) -> str:
+    """
+    Returns the file name prefix for an export: the consortium name (e.g., hubmap) or "combined" for exports of
+    all donors; otherwise, the donor id.
+    :param scope: scope of the export (getexportscope)
+    """
+
+    if scope.startswith('CONTEXT_'):
+        return scope.split('_')[1].lower()
+    if scope == COMBINEDSCOPE:
+        return COMBINEDSCOPE.lower()
+    return scope
+
+
+def getstoredexport(exportid: str, scope: str) -> pd.DataFrame:
+    """
+    Returns a stored export DataFrame.
+    :param exportid: export id--either from the export cache or the id of a background export job
+    :param scope: consortium or donor id of the export
+    :return: DataFrame, or None if the export expired
+    """
+
+    exportcache = ExportCache()
+    dfexport = exportcache.getexport(exportid=exportid, scope=scope)
+    if dfexport is None and exportid is not None:
+        # Reload the export from the artifact of the background job that built it.
+        job = JobManager().getjob(jobid=exportid)
+        if job is not None and job['status'] == 'complete' and job['scope'] == scope \
+                and os.path.exists(job['artifact']):
+            dfexport = loadexportartifact(artifact=job['artifact'])
+            exportcache.addexport(dfexport=dfexport, scope=scope, exportid=exportid)
+    return dfexport
+
+
+def getwideexport(exportid: str, scope: str, dfexport: pd.DataFrame) -> pd.DataFrame:
+    """
+    Returns the wide representation (a row per donor) of a stored export. The wide DataFrame is computed once and
+    stored in the export cache alongside the long DataFrame.
+    :param exportid: export id of the long DataFrame
+    :param scope: consortium or donor id of the export
+    :param dfexport: the long DataFrame
+    :return: DataFrame from getwideframe
+    """
+
+    exportcache = ExportCache()
+    wideid = f'{exportid}_wide'
+    dfwide = exportcache.getexport(exportid=wideid, scope=scope)
+    if dfwide is None:
+        dfwide = getwideframe(dfmetadata=dfexport)
+        if exportid is not None:
+            exportcache.addexport(dfexport=dfwide, scope=scope, exportid=wideid)
+    return dfwide
+
+
+def getexportresponse(dfexport: pd.DataFrame, format: str, fname: str) -> Response:
+    """
+    Builds a streamed download response for an export.
+    :param dfexport: DataFrame of flattened donor metadata
+    :param format: export format--a key of exportcontenttypes
+    :param fname: file name prefix (getexportfname)
+    :return: Response
+    """
+
+    if format not in exportcontenttypes:
+        abort(400, f'Unknown export format {format}')
+
+    # Stream the exported data in chunks of rows. Text formats are compressed with gzip for transfer if the
+    # client accepts it.
+    compress = format in ['csv', 'tsv', 'jsonl'] and 'gzip' in request.accept_encodings
+    response = Response(streamexport(dfexport, format=format, compress=compress))
+    if compress:
+        response.headers["Content-Encoding"] = "gzip"
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Content-Disposition"] = f"attachment; filename={fname}_metadata.{format}"
+    response.headers["Content-Type"] = exportcontenttypes[format]
+    return response
+
+
+def getexportmetadata(donorid: str) -> pd.DataFrame:
+    """
+    Builds the DataFrame of flattened metadata for the export of a single donor.
+    (The export for all donors in a consortium is built by runexportjob.)
+    :param donorid: the id of a donor
+    :return: DataFrame of metadata rows
+    """
+
+    # Obtain and decode the base64-encoded dictionary of new donor metadata,
+    # which is stored in the session cookie.
+    newdonorb64 = session['newdonortsv']
+    if len(newdonorb64) > 0:
+        newdonor = pickle.loads(base64.b64decode(newdonorb64[0]))  # Decoded back to dictionary
+    else:
+        abort(400, 'No new metadata')
+
+    # Flatten for source_name.
+    dfnewdonortype = getmetadatabytype(dictmetadata=newdonor)
 
-    return render_template('export_review.html', table=table)
+    # Flatten for donor id.
+    return MetadataFrame(metadata=dfnewdonortype, donorid=donorid).dfexport
 
 
 export_donor_blueprint = Blueprint('export_tsv_review_new', __name__, url_prefix='/export/donor')
@@ -28,6 +28,8 @@ def globus():
         session['donorid'] = form.donorid.data
         # Apr 2025 - Indicate the workflow (edit, export, doi) to the Globus auth.
         session['workflow'] = 'edit'
+        # A single donor ends any worklist.
+        session.pop('worklistid', None)
         # Authenticate to Globus via the login route.
         # If login is successful, Globus will redirect to the edit page.
         return redirect(f'/login')
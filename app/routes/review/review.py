@@ -11,6 +11,7 @@ import pandas as pd
 
 # Helper classes
 from models.donor import DonorData
+from routes.worklist.worklist import movetodonor
 
 review_blueprint = Blueprint('review', __name__, url_prefix='/review')
 
@@ -44,4 +45,7 @@ def review():
     donordata = DonorData(donorid=donorid, token=token, isforupdate=True)
     if donordata.updatedonormetadata(dict_metadata=newdonor) == 'ok':
         flash(f'Updated metadata for {donorid}')
+        # In worklist mode, continue with the next donor in the worklist.
+        if 'worklistid' in session and session.get('donorid') == donorid:
+            return movetodonor(step=1, updated=True)
         return redirect('/')
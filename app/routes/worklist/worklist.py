@@ -0,0 +1,87 @@
+"""
+Routes for curating a worklist of donors.
+
+A curator loads a list of donor ids--e.g., from the *_donors_to_update.csv file written by the doi_donor.py
+validation script--and steps through the donors in the edit page. The information for the next donors in the
+worklist is prefetched in the background while the curator edits the current donor.
+
+"""
+
+from flask import Blueprint, request, redirect, render_template, session, flash
+
+# Helper classes
+from models.worklistform import WorklistForm, getworklistids
+from models.worklist import Worklist
+
+worklist_select_blueprint = Blueprint('worklist_select', __name__, url_prefix='/worklist')
+
+
+@worklist_select_blueprint.route('', methods=['GET', 'POST'])
+def worklist_select():
+
+    # Load form that allows for specification of the consortium and the list of donor ids.
+    form = WorklistForm(request.form)
+
+    if request.method == 'POST':
+        # Combine ids from the pasted text and the uploaded file.
+        text = form.donorids.data or ''
+        donorfile = request.files.get('donorfile')
+        if donorfile is not None and donorfile.filename != '':
+            text = text + '\n' + donorfile.read().decode('utf-8', errors='ignore')
+        form.worklist = getworklistids(text)
+
+        if form.validate():
+            worklistid = Worklist().create(donorids=form.worklist, consortium=form.consortium.data)
+            session['worklistid'] = worklistid
+            # Pass the Globus environment to which to authenticate.
+            session['consortium'] = form.consortium.data
+            # The first donor in the worklist is passed to the Globus auth as for a single donor.
+            session['donorid'] = form.worklist[0]
+            session['workflow'] = 'edit'
+            # Authenticate to Globus via the login route.
+            # If login is successful, Globus will redirect to the edit page.
+            return redirect(f'/login')
+
+    # Render the worklist form.
+    return render_template('worklist_select.html', form=form)
+
+
+worklist_move_blueprint = Blueprint('worklist_move', __name__, url_prefix='/worklist/move')
+
+
+@worklist_move_blueprint.route('', methods=['GET'])
+def worklist_move():
+
+    # Moves to the next (step=1) or previous (step=-1) donor in the worklist, without updating the current
+    # donor. The review route also moves to the next donor after an update.
+    step = request.args.get('step', default=1, type=int)
+    return movetodonor(step=step, updated=False)
+
+
+def movetodonor(step: int, updated: bool):
+    """
+    Moves to another donor in the session's worklist and redirects to the edit page for the donor, or to the
+    worklist form at the end of the worklist.
+    :param step: number of positions to move
+    :param updated: whether the current donor was updated
+    """
+
+    if 'worklistid' not in session:
+        return redirect('/')
+
+    worklist = Worklist(worklistid=session['worklistid'])
+    donorid = worklist.move(step=step, updated=updated)
+
+    if donorid is None:
+        # The end of the worklist, or the worklist expired.
+        status = worklist.getstatus()
+        if status is not None:
+            flash(f"Worklist complete: updated {len(status['updated'])} of {len(status['donorids'])} donors.")
+        else:
+            flash('The worklist expired.')
+        worklist.delete()
+        session.pop('worklistid', None)
+        return redirect('/worklist')
+
+    session['donorid'] = donorid
+    return redirect('/edit')
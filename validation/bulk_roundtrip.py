@@ -0,0 +1,73 @@
+"""
+Script to check that the bulk update of the donor-metadata app (bulkupdate.py) does not change metadata that is
+uploaded without modification.
+
+The script exports sample donor metadata in the format of the app's TSV export--including elements saved by the
+Edit form, which have keys with empty values--reads the TSV as an upload, and compares the uploaded metadata of
+each donor with the sample. Every donor must have the status unchanged, and the metadata that an update would
+send (with the keys with empty values restored from the current metadata) must equal the sample. A modified value
+must have the status changed.
+
+The script does not call any APIs. It exits with status 1 if a check fails.
+"""
+import pandas as pd
+
+import io
+import os
+import sys
+
+# Import classes originally developed for the donor-metadata app.
+# bulkupdate.py imports other helper classes of the app as models.<class>, so the app folder is in the path.
+fpath = os.path.dirname(os.getcwd())
+sys.path.append(os.path.join(fpath, 'app'))
+from models.metadataframe import MetadataFrame
+from models.getmetadatabytype import getmetadatabytype
+from models.bulkupdate import readbulkfile, getbulkmetadata, comparemetadata, withemptykeys
+
+# Sample metadata. The elements have different sets of keys, so that the export has columns for keys that some
+# donors and elements do not have.
+dictsample = {
+    'HBM123.ABCD.456': {'organ_donor_data': [
+        {'concept_id': 'C0001779', 'data_value': '34', 'data_type': 'Numeric', 'units': 'years',
+         'numeric_operator': 'EQ', 'preferred_term': 'Age', 'grouping_concept': 'C0001779',
+         'grouping_concept_preferred_term': 'Age', 'SAB': 'UMLS', 'code': 'UMLS:C0001779',
+         'start_datetime': '', 'end_datetime': '', 'graph_version': '2024AB'},
+        {'concept_id': 'C0086582', 'data_value': 'Male', 'data_type': 'Nominal', 'units': '',
+         'numeric_operator': '', 'preferred_term': 'Male', 'grouping_concept': 'C1522384',
+         'grouping_concept_preferred_term': 'Sex', 'SAB': 'UMLS', 'code': 'UMLS:C0086582',
+         'start_datetime': '', 'end_datetime': '', 'graph_version': '2024AB'}]},
+    'HBM789.EFGH.012': {'organ_donor_data': [
+        {'concept_id': 'C0007457', 'data_value': 'White', 'data_type': 'Nominal', 'preferred_term': 'White',
+         'grouping_concept': 'C0034510', 'grouping_concept_preferred_term': 'Race', 'SAB': 'UMLS',
+         'code': 'UMLS:C0007457'}]},
+}
+
+# Export the sample as TSV, as the app does.
+listdonordf = [MetadataFrame(metadata=getmetadatabytype(dictmetadata=metadata), donorid=donorid).dfexport
+               for donorid, metadata in dictsample.items()]
+tsv = pd.concat(listdonordf, ignore_index=True).fillna('').to_csv(index=False, sep='\t')
+
+# Read the export as an upload.
+dfupdate = readbulkfile(io.StringIO(tsv))
+dictmetadata, dicterrors = getbulkmetadata(dfupdate=dfupdate, consortium='CONTEXT_HUBMAP')
+
+failed = len(dicterrors) > 0
+for donorid, msg in dicterrors.items():
+    print(f'{donorid}: invalid: {msg}')
+for donorid, metadata in dictsample.items():
+    status, changes = comparemetadata(current=metadata, metadata=dictmetadata[donorid])
+    print(f'{donorid}: {status} {changes}')
+    failed = failed or status != 'unchanged'
+    restored = withemptykeys(current=metadata, metadata=dictmetadata[donorid]) == metadata
+    print(f'{donorid}: update equals current metadata: {restored}')
+    failed = failed or not restored
+
+# A modified value must be found.
+dfupdate.loc[dfupdate['data_value'] == '34', 'data_value'] = '35'
+dictmetadata, dicterrors = getbulkmetadata(dfupdate=dfupdate, consortium='CONTEXT_HUBMAP')
+status, changes = comparemetadata(current=dictsample['HBM123.ABCD.456'], metadata=dictmetadata['HBM123.ABCD.456'])
+print(f'HBM123.ABCD.456 with modified age: {status} {changes}')
+failed = failed or status != 'changed'
+
+if failed:
+    exit(1)
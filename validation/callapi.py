@@ -11,26 +11,42 @@ class RawTextArgumentDefaultsHelpFormatter(
     pass
 
 
-def getconsortiumfromargs() -> str:
+def getargs() -> argparse.Namespace:
 
-    # Obtains the base for urls to the search-api from the -c argument.
+    # Parses the arguments of a validation script:
+    # -c: consortium, from which the base for urls to the search-api is obtained
+    # -r: optional names of cached stages to run again
+    # -d: optional path to a local SQLite replica of donor metadata (donorreplica.py)
 
-    # Get consortium.
     parser = argparse.ArgumentParser(
         description='Compare DOI titles with donor metadata terms',
         formatter_class=RawTextArgumentDefaultsHelpFormatter)
     parser.add_argument("-c", "--consortium", type=str,
                         help='consortium', required=True)
+    parser.add_argument("-r", "--refresh", type=str, nargs='*', default=None,
+                        help='names of stages to run again instead of reading from the stage cache;\n'
+                             'with no names, run all stages again')
+    parser.add_argument("-d", "--database", type=str, default=None,
+                        help='path to a local SQLite replica of donor metadata;\n'
+                             'if provided, donor metadata is read from the replica instead of search-api')
 
     args = parser.parse_args()
     if args.consortium == 'h':
-        return 'CONTEXT_HUBMAP'
+        args.consortium = 'CONTEXT_HUBMAP'
     elif args.consortium == 's':
-        return 'CONTEXT_SENNET'
+        args.consortium = 'CONTEXT_SENNET'
     else:
         print(f'Unknown consortium {args.consortium}')
         exit(-1)
 
+    return args
+
+
+def getconsortiumfromargs() -> str:
+
+    # Obtains the base for urls to the search-api from the -c argument.
+    return getargs().consortium
+
 
 def readglobustoken() -> str:
     """
@@ -12,9 +12,12 @@ This was intended to support a one-time correction of donor metadata, but uses
 classes of the donor-metadata flask app.
 """
 import pandas as pd
-import numpy as np
+import glob
+import inspect
+from hashlib import sha256
 
-from callapi import readglobustoken, getconsortiumfromargs
+from callapi import readglobustoken, getargs
+from stagerunner import StageRunner
 
 import os
 import sys
@@ -30,8 +33,13 @@ fpath = os.path.dirname(os.getcwd())
 fpath = os.path.join(fpath, 'app/models')
 sys.path.append(fpath)
 from searchapi import SearchAPI
+from donorreplica import DonorReplica
+from compactframe import getcompactframe
 # to obtain DOI information for published datasets
 from datacite import DataCiteAPI
+# to compare donor metadata with DOI titles
+import doicomparison
+from doicomparison import getdonordoiterms, getmemoizedcomparison
 
 
 def getdoianddonorid(consortium: str, search: SearchAPI) -> pd.DataFrame:
@@ -98,22 +106,79 @@ def writetocsv(filename: str, line: dict):
         cw.writerow(lineout)
 
 
-def checkageunit(row) -> str:
-    """
-    Compares the singular age unit from the DOI (e.g., year) with the
-    plural age unit from donor metadata (e.g., years).
+def stagedois() -> pd.DataFrame:
+    # Stage: published datasets and their donors, from search-api.
+    return getdoianddonorid(consortium=consortium, search=search)
+
+
+def stagedonormetadata() -> pd.DataFrame:
+    # Stage: flattened metadata for all donors, in the memory-compact representation, from either the local
+    # replica (-d) or search-api.
+    if args.database is not None:
+        print(f'Reading donor metadata for consortium from replica {args.database}...')
+        dfmetadata = DonorReplica(dbfile=args.database).getdonormetadata(consortium=consortium)
+        if dfmetadata is None:
+            print(f'The replica has no donor metadata for {consortium}. Run donor_replica.py.')
+            exit(-1)
+        return getcompactframe(dfmetadata)
+    print('Getting donor metadata for consortium...')
+    return search.getalldonormetadata(compact=True)
+
+
+def stagedonordoimetadata(donormetadata: pd.DataFrame) -> pd.DataFrame:
+    # Stage: DOI-related donor metadata, filtered from the flattened metadata.
+    print('Filtering to DOI-specific metadata...')
+    return getdonordoiterms(dfalldonormetadata=donormetadata)
+
+
+def stagedoititles() -> pd.DataFrame:
+    # Stage: titles of all consortium DOIs, from DataCite.
+    return datacite.getdoititles()
 
-    :return: yes or no
+
+def getcomparisonfingerprint() -> str:
     """
-    doiunitplural = f'{row["ageunits_doi"]}s'
-    if doiunitplural == row["ageunits_donor"]:
-        return 'yes'
-    else:
-        return 'no'
+    Returns a fingerprint of the code that compares donor metadata with DOI titles--the doicomparison module
+    and the parsing of titles--so that comparisons memoized by a different version of the code are not reused.
+    """
+
+    source = inspect.getsource(doicomparison) + inspect.getsource(DataCiteAPI.parsetitles)
+    return sha256(source.encode('utf-8')).hexdigest()[:16]
+
+
+def stagecompare(dois: pd.DataFrame, donormetadata: pd.DataFrame, donordoimetadata: pd.DataFrame,
+                 doititles: pd.DataFrame) -> pd.DataFrame:
+    # Stage: compares donor metadata with metadata parsed from DOI titles.
+    # This stage is not cached, so that changes to the comparison logic take effect without running the
+    # search-api and DataCite stages again. Instead, the results of the previous comparison are reused for
+    # DOIs for which neither the donor's metadata nor the DOI title changed. The memo file is named for the
+    # version of the comparison code; memo files of other versions are discarded.
+    print('Comparing donor metadata with DOI metadata...')
+    memofile = os.path.join(runner.cachepath, f'{consortium}_comparison_{getcomparisonfingerprint()}.pkl')
+    for oldfile in glob.glob(os.path.join(runner.cachepath, f'{consortium}_comparison*.pkl')):
+        if oldfile != memofile:
+            print(f'Discarding comparisons from another version of the comparison code: {oldfile}')
+            os.remove(oldfile)
+    dfprevious = None
+    if os.path.exists(memofile) and not (args.refresh is not None
+                                         and (len(args.refresh) == 0 or 'compare' in args.refresh)):
+        dfprevious = pd.read_pickle(memofile)
+
+    dfcompare = getmemoizedcomparison(dfdois=dois, dfalldonormetadata=donormetadata,
+                                      dfdonordoiterms=donordoimetadata, dfdoititles=doititles,
+                                      dfprevious=dfprevious)
+    dfcompare.to_pickle(memofile)
+
+    counts = dfcompare['result'].value_counts()
+    print(f"DOIs with reused comparisons: {counts.get('reused', 0)}; "
+          f"DOIs with new comparisons: {counts.get('computed', 0)}")
+    return dfcompare
+
 
 # --- MAIN
-# Get the consortium.
-consortium = getconsortiumfromargs()
+# Get the consortium and the stages to refresh.
+args = getargs()
+consortium = args.consortium
 # Get the Globus token from file.
 token = readglobustoken()
 
@@ -122,69 +187,17 @@ search = SearchAPI(consortium=consortium, token=token)
 # Set up the DataCite API interface.
 datacite = DataCiteAPI(consortium=consortium)
 
-# Obtain information on published datasets and their donors.
-dfdonordoi = getdoianddonorid(consortium=consortium, search=search)
-
-# Obtain all DOI-related donor metadata for the consortium.
-print('Getting donor metadata for consortium...')
-search.dfalldonormetadata = search.getalldonormetadata()
-
-# Find any data_value with trailing zeroes.
-dftz = search.dfalldonormetadata
-dftz['last_digit'] = [str(x).strip()[-1] for x in dftz['data_value']]
-dftz['decimal'] = ['.' in str(x) for x in dftz['data_value']]
-dftz['trailing_zero'] = np.where((dftz['last_digit'] =='0') & (dftz['decimal']), 'yes', 'no')
-dftz = dftz[['id', 'trailing_zero']]
-
-dfdonordoitz = pd.merge(left=dfdonordoi, right=dftz,
-                        how='left', left_on='donorid', right_on='id')
-dfdonordoitz = dfdonordoitz.drop('id', axis=1)
-
-print('Filtering to DOI-specific metadata...')
-start = 0
-end = len(search.dfalldonormetadata)
-dfdonor = search.getalldonordoimetadata(start=start, end=end, geturls=False)
-
-
-# Obtain all consortium DOIs from DataCite.
-dfdoi = datacite.getdoititles()
-
-print('Comparing donor metadata with DOI metadata...')
-# Merge doi-donor map with donor metadata.
-dfdoidonor = pd.merge(left=dfdonordoitz, right=dfdonor,
-                 how='left', left_on='donorid', right_on='id')
-
-# Merge doi-donor with metadata with parsed doi title information.
-dfout = pd.merge(left=dfdoidonor, right=dfdoi,
-                 how='left', on='doi',
-                 suffixes=['_donor','_doi'])
-
-# Compare terms for race and sex from donor metadata with corresponding
-# terms parsed from the DOI titles.
-dfout['race_match'] = np.where(dfout['race_doi'] == dfout['race_donor'],
-                               'yes', 'no')
-dfout['sex_match'] = np.where(dfout['sex_doi'] == dfout['sex_donor'],
-                              'yes', 'no')
-dfout['age_match'] = np.where(dfout['age_doi'] == dfout['age_donor'],
-                              'yes', 'no')
-# Age unit is singular in DOI title and plural in donor metadata.
-dfout['ageunits_match'] = dfout.apply(checkageunit, axis=1)
-
-dfout['match'] = np.where(
-    (dfout['race_match'] == 'yes')
-    & (dfout['sex_match'] == 'yes')
-    & (dfout['age_match'] == 'yes')
-    & (dfout['ageunits_match'] == 'yes'),
-    'yes', 'no')
-
-# Explicitly compare number types of donor and doi age to identify synchronization
-# issues--e.g., an integer donor age (11) and a decimal DOI age (11.0).
-# (When Excel opens a CSV with a decimal in format x.0, it truncates the display, so
-# the numeric type mismatch is not apparent.)
-dfout['age_donor_type'] = np.where(dfout['age_donor'].str.contains('.', regex=False), 'decimal', 'integer')
-dfout['age_doi_type'] = np.where(dfout['age_doi'].str.contains('.', regex=False), 'decimal', 'integer')
-# Drop extra id column.
-dfout = dfout.drop('id', axis=1).sort_values(by='donorid')
+# The search-api stages and the DataCite stage are independent, and run concurrently. The output of each
+# stage except the comparison is cached in the stage_cache folder.
+runner = StageRunner(consortium=consortium, refresh=args.refresh)
+runner.addstage(name='dois', function=stagedois)
+# Reading from the replica is fast, so the stage is not cached when the replica is used.
+runner.addstage(name='donormetadata', function=stagedonormetadata, cache=args.database is None)
+runner.addstage(name='donordoimetadata', function=stagedonordoimetadata, inputs=['donormetadata'])
+runner.addstage(name='doititles', function=stagedoititles)
+runner.addstage(name='compare', function=stagecompare,
+                inputs=['dois', 'donormetadata', 'donordoimetadata', 'doititles'], cache=False)
+dfout = runner.run()['compare'].drop(columns=['donor_hash', 'title_hash'])
 
 # Write to output.
 print('Writing output files...')
@@ -201,5 +214,3 @@ dfid.to_csv(idfile, index=False)
 dfzero = dfout[dfout['trailing_zero'] == 'yes']['donorid'].drop_duplicates()
 idfile = f'{cout}_donors_trailing_zeroes.csv'
 dfzero.to_csv(idfile, index=False)
-
-
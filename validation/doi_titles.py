@@ -0,0 +1,64 @@
+"""
+Script to compare the results of the two parsers of DOI titles in DataCiteAPI:
+1. _parsedtitle, which parses one title at a time
+2. parsetitles, which parses a Series of titles with vectorized regular expressions
+
+The titles are the current titles of all DOIs for a consortium in DataCite. The script reports titles for which
+the parsers differ. Titles that _parsedtitle cannot handle (it raises an exception) are expected to be flagged as
+unparseable by parsetitles.
+"""
+import pandas as pd
+
+from callapi import getconsortiumfromargs
+
+import os
+import sys
+import time
+
+# Import DataCiteAPI class originally developed for the donor-metadata app.
+# The following allows for an absolute import from an adjacent script directory--i.e., up and over instead of down.
+fpath = os.path.dirname(os.getcwd())
+fpath = os.path.join(fpath, 'app/models')
+sys.path.append(fpath)
+from datacite import DataCiteAPI
+
+# --- MAIN
+consortium = getconsortiumfromargs()
+datacite = DataCiteAPI(consortium=consortium)
+
+dftitles = pd.DataFrame(datacite.getalldatacitetitles(), columns=['doi', 'title'])
+columns = ['race', 'sex', 'age', 'ageunits']
+
+print('Parsing titles one at a time...')
+start = time.time()
+listparse = []
+for title in dftitles['title']:
+    try:
+        dictparse = datacite._parsedtitle(title=title)
+        listparse.append([dictparse.get(col) for col in columns] + ['no'])
+    except (AttributeError, IndexError):
+        listparse.append([None] * len(columns) + ['yes'])
+dfold = pd.DataFrame(listparse, columns=columns + ['error'], index=dftitles.index)
+print(f'{time.time() - start:.3f} s')
+
+print('Parsing titles with vectorized parser...')
+start = time.time()
+dfnew = datacite.parsetitles(titles=dftitles['title'])
+print(f'{time.time() - start:.3f} s')
+
+# Titles that the single-title parser parses must have the same results. Titles for which the single-title parser
+# fails must be unparseable.
+differs = ((dfold['error'] == 'no') & (dfold[columns] != dfnew[columns]).any(axis=1)) \
+          | ((dfold['error'] == 'yes') & (dfnew['unparseable'] == 'no'))
+
+print(f'Titles: {len(dftitles)}')
+print(f'Titles that the single-title parser cannot handle: {(dfold["error"] == "yes").sum()}')
+print(f'Titles flagged as unparseable: {(dfnew["unparseable"] == "yes").sum()}')
+print(f'Titles with different results: {differs.sum()}')
+
+if differs.sum() > 0:
+    dfout = pd.concat([dftitles, dfold.add_suffix('_single'), dfnew.add_suffix('_vectorized')], axis=1)[differs]
+    cout = consortium.split('_')[1]
+    outfile = f'{cout}_doi_title_parse_differences.csv'
+    print(f'Writing {outfile}...')
+    dfout.to_csv(outfile, index=False)
@@ -0,0 +1,56 @@
+"""
+Script to check the vectorized parser of DOI titles in DataCiteAPI (parsetitles) against a fixed corpus of titles,
+without calls to DataCite.
+
+The corpus file doi_titles_corpus.tsv has a row for each title, with the results of the single-title parser
+(_parsedtitle) when the corpus was built: race, sex, age, ageunits, and error (yes if _parsedtitle raises an
+exception for the title). Titles that _parsedtitle parses must have the same results from parsetitles; titles for
+which _parsedtitle fails must be flagged as unparseable. The script also checks that _parsedtitle still returns
+the results in the corpus.
+
+The script exits with status 1 if any title differs.
+"""
+import pandas as pd
+
+import os
+import sys
+
+# Import DataCiteAPI class originally developed for the donor-metadata app.
+# The following allows for an absolute import from an adjacent script directory--i.e., up and over instead of down.
+fpath = os.path.dirname(os.getcwd())
+fpath = os.path.join(fpath, 'app/models')
+sys.path.append(fpath)
+from datacite import DataCiteAPI
+
+# --- MAIN
+columns = ['race', 'sex', 'age', 'ageunits']
+dfcorpus = pd.read_csv('doi_titles_corpus.tsv', sep='\t', dtype=str, keep_default_na=False)
+# The parsers do not call DataCite, so the consortium does not matter.
+datacite = DataCiteAPI(consortium='CONTEXT_HUBMAP')
+
+# Single-title parser.
+listparse = []
+for title in dfcorpus['title']:
+    try:
+        dictparse = datacite._parsedtitle(title=title)
+        listparse.append([dictparse.get(col) for col in columns] + ['no'])
+    except (AttributeError, IndexError):
+        listparse.append([''] * len(columns) + ['yes'])
+dfold = pd.DataFrame(listparse, columns=columns + ['error'], index=dfcorpus.index)
+olddiffers = (dfold != dfcorpus[columns + ['error']]).any(axis=1)
+
+# Vectorized parser.
+dfnew = datacite.parsetitles(titles=dfcorpus['title'])
+parsed = dfcorpus['error'] == 'no'
+newdiffers = (parsed & (dfnew[columns] != dfcorpus[columns]).any(axis=1)) \
+             | (~parsed & (dfnew['unparseable'] == 'no'))
+
+print(f'Titles in corpus: {len(dfcorpus)}')
+print(f'Titles with different results from _parsedtitle: {olddiffers.sum()}')
+print(f'Titles with different results from parsetitles: {newdiffers.sum()}')
+
+differs = olddiffers | newdiffers
+if differs.sum() > 0:
+    dfout = pd.concat([dfcorpus, dfold.add_suffix('_single'), dfnew.add_suffix('_vectorized')], axis=1)[differs]
+    print(dfout.to_string())
+    exit(1)
@@ -0,0 +1,87 @@
+"""
+Script to compare the metadata of all donors in a consortium with the current valuesets of the Valueset Manager.
+Metadata elements in provenance drift from the valuesets over time--e.g.:
+1. concepts retired from a valueset
+2. concepts moved to another grouping concept
+3. changed preferred terms, SABs or codes
+4. elements written with an earlier UMLS graph version
+
+The comparison is in **conformance.py** in the app's models folder, so that it can also be used by the app.
+The script is intended to be scheduled--e.g., nightly.
+"""
+import pandas as pd
+
+from callapi import readglobustoken, getargs
+from stagerunner import StageRunner
+
+import os
+import sys
+
+# Import classes originally developed for the donor-metadata app.
+# The following allows for an absolute import from an adjacent script directory--i.e., up and over instead of down.
+fpath = os.path.dirname(os.getcwd())
+fpath = os.path.join(fpath, 'app/models')
+sys.path.append(fpath)
+from searchapi import SearchAPI
+from donorreplica import DonorReplica
+from compactframe import getcompactframe
+from appconfig import AppConfig
+from valuesetmanager import ValueSetManager
+from conformance import getconceptindex, getconformance, getconformancesummary
+
+
+def stagedonormetadata() -> pd.DataFrame:
+    # Stage: flattened metadata for all donors, in the memory-compact representation, from either the local
+    # replica (-d) or search-api.
+    if args.database is not None:
+        print(f'Reading donor metadata for consortium from replica {args.database}...')
+        dfmetadata = DonorReplica(dbfile=args.database).getdonormetadata(consortium=consortium)
+        if dfmetadata is None:
+            print(f'The replica has no donor metadata for {consortium}. Run donor_replica.py.')
+            exit(-1)
+        return getcompactframe(dfmetadata)
+    print('Getting donor metadata for consortium...')
+    return search.getalldonormetadata(compact=True)
+
+
+def stagevaluesets() -> dict:
+    # Stage: concept index and UMLS graph version of the current valuesets, from the Valueset Manager.
+    # Not cached, so that every run compares with the current valuesets.
+    cfg = AppConfig()
+    valuesetmanager = ValueSetManager(url=cfg.getfield(key='VALUESETMANAGER'),
+                                      download_full_path=cfg.path + '/valuesets.xlsx')
+    return {'index': getconceptindex(sheets=valuesetmanager.Sheets), 'graph_version': valuesetmanager.umls}
+
+
+def stageconformance(donormetadata: pd.DataFrame, valuesets: dict) -> pd.DataFrame:
+    # Stage: joins donor metadata with the concept index.
+    print('Comparing donor metadata with valuesets...')
+    return getconformance(dfalldonormetadata=donormetadata, dfindex=valuesets['index'],
+                          graph_version=valuesets['graph_version'])
+
+
+# --- MAIN
+# Get the consortium and the stages to refresh.
+args = getargs()
+consortium = args.consortium
+# Get the Globus token from file.
+token = readglobustoken()
+
+# Set up the search-api interface.
+search = SearchAPI(consortium=consortium, token=token)
+
+runner = StageRunner(consortium=consortium, refresh=args.refresh)
+# Reading from the replica is fast, so the stage is not cached when the replica is used.
+runner.addstage(name='donormetadata', function=stagedonormetadata, cache=args.database is None)
+runner.addstage(name='valuesets', function=stagevaluesets, cache=False)
+runner.addstage(name='conformance', function=stageconformance, inputs=['donormetadata', 'valuesets'], cache=False)
+dfconformance = runner.run()['conformance']
+dfsummary = getconformancesummary(dfconformance=dfconformance)
+
+# Write to output.
+print('Writing output files...')
+cout = consortium.split('_')[1]
+dfconformance.to_csv(f'{cout}_conformance_elements.csv', index=False)
+dfsummary.to_csv(f'{cout}_conformance_summary.csv', index=False)
+
+print(dfsummary.to_string(index=False))
@@ -0,0 +1,90 @@
+"""
+Script to scan the metadata of all donors in a consortium for data-quality issues that are otherwise found
+one donor at a time in the Edit page of the donor-metadata app--e.g.:
+1. decimal values with trailing zeros
+2. unexpected units of height, weight and waist circumference
+3. the legacy concept for unknown race
+4. incorrect grouping concepts for Mechanism of Injury and Medical History
+5. more Medical History conditions than the Edit form allows
+
+The rules are in **qualityscan.py** in the app's models folder, so that they can also be used by the app.
+"""
+import pandas as pd
+
+from callapi import readglobustoken, getargs
+from stagerunner import StageRunner
+
+import os
+import sys
+
+# Import classes originally developed for the donor-metadata app.
+# The following allows for an absolute import from an adjacent script directory--i.e., up and over instead of down.
+fpath = os.path.dirname(os.getcwd())
+fpath = os.path.join(fpath, 'app/models')
+sys.path.append(fpath)
+from searchapi import SearchAPI
+from donorreplica import DonorReplica
+from compactframe import getcompactframe
+from appconfig import AppConfig
+from valuesetmanager import ValueSetManager
+from qualityscan import getqualityissues, getdonorqualityreport
+
+
+def stagedonormetadata() -> pd.DataFrame:
+    # Stage: flattened metadata for all donors, in the memory-compact representation, from either the local
+    # replica (-d) or search-api.
+    if args.database is not None:
+        print(f'Reading donor metadata for consortium from replica {args.database}...')
+        dfmetadata = DonorReplica(dbfile=args.database).getdonormetadata(consortium=consortium)
+        if dfmetadata is None:
+            print(f'The replica has no donor metadata for {consortium}. Run donor_replica.py.')
+            exit(-1)
+        return getcompactframe(dfmetadata)
+    print('Getting donor metadata for consortium...')
+    return search.getalldonormetadata(compact=True)
+
+
+def stagevaluesetconcepts() -> dict:
+    # Stage: concepts of the Mechanism of Injury and Medical History valuesets, from the Valueset Manager.
+    cfg = AppConfig()
+    valuesetmanager = ValueSetManager(url=cfg.getfield(key='VALUESETMANAGER'),
+                                      download_full_path=cfg.path + '/valuesets.xlsx')
+    return {'mechanism': valuesetmanager.getcolumnvalues(tab='Mechanism of Injury', col='concept_id'),
+            'medhx': valuesetmanager.getcolumnvalues(tab='Medical History', col='concept_id')}
+
+
+def stagescan(donormetadata: pd.DataFrame, valuesetconcepts: dict) -> pd.DataFrame:
+    # Stage: applies the data-quality rules to all donors. Not cached, so that changes to the rules take effect
+    # without searching again.
+    print('Scanning donor metadata...')
+    return getqualityissues(dfalldonormetadata=donormetadata, mechanismconcepts=valuesetconcepts['mechanism'],
+                            medhxconcepts=valuesetconcepts['medhx'])
+
+
+# --- MAIN
+# Get the consortium and the stages to refresh.
+args = getargs()
+consortium = args.consortium
+# Get the Globus token from file.
+token = readglobustoken()
+
+# Set up the search-api interface.
+search = SearchAPI(consortium=consortium, token=token)
+
+runner = StageRunner(consortium=consortium, refresh=args.refresh)
+# Reading from the replica is fast, so the stage is not cached when the replica is used.
+runner.addstage(name='donormetadata', function=stagedonormetadata, cache=args.database is None)
+runner.addstage(name='valuesetconcepts', function=stagevaluesetconcepts)
+runner.addstage(name='scan', function=stagescan, inputs=['donormetadata', 'valuesetconcepts'], cache=False)
+dfissues = runner.run()['scan']
+dfreport = getdonorqualityreport(dfissues=dfissues)
+
+# Write to output.
+print('Writing output files...')
+cout = consortium.split('_')[1]
+dfissues.to_csv(f'{cout}_donor_quality_issues.csv', index=False)
+dfreport.to_csv(f'{cout}_donor_quality_report.csv', index=False)
+
+print(f'Donors with issues: {len(dfreport)}; donors that cannot be edited in the Edit page: '
+      f'{(dfreport["editable"] == "no").sum()}')
+print(dfissues['rule'].value_counts().to_string())
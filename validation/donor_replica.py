@@ -0,0 +1,40 @@
+"""
+Script to refresh a local SQLite replica of the flattened metadata of all donors in a consortium.
+The replica is written by **donorreplica.py** in the app's models folder, which the app also uses to keep a
+replica of the consortia that it exports. The other validation scripts read donor metadata from a replica with
+the **-d** parameter, instead of sweeping search-api.
+
+The script is intended to be scheduled--e.g., nightly.
+"""
+import os
+import sys
+import time
+
+from callapi import readglobustoken, getargs
+
+# Import classes originally developed for the donor-metadata app.
+# The following allows for an absolute import from an adjacent script directory--i.e., up and over instead of down.
+fpath = os.path.dirname(os.getcwd())
+fpath = os.path.join(fpath, 'app/models')
+sys.path.append(fpath)
+from searchapi import SearchAPI
+from donorreplica import DonorReplica
+
+# --- MAIN
+# Get the consortium and the path to the replica (default donors.db in the current folder).
+args = getargs()
+consortium = args.consortium
+dbfile = args.database if args.database is not None else 'donors.db'
+# Get the Globus token from file.
+token = readglobustoken()
+
+print('Getting donor metadata for consortium...')
+search = SearchAPI(consortium=consortium, token=token)
+dfmetadata = search.getalldonormetadata()
+
+print(f'Writing donor metadata to replica {dbfile}...')
+replica = DonorReplica(dbfile=dbfile)
+replica.replaceconsortium(consortium=consortium, dfmetadata=dfmetadata)
+sweep = replica.getsweep(consortium=consortium)
+print(f"Donors: {sweep['donors']}; metadata elements: {sweep['elements']}; "
+      f"refreshed: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(sweep['refreshed']))}")
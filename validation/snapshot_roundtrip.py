@@ -0,0 +1,60 @@
+"""
+Script to check that the export snapshots of the donor-metadata app (snapshot.py) keep missing values and empty
+strings.
+
+The script writes a sample of flattened donor metadata in the memory-compact representation (compactframe.py)--
+with missing values and empty strings in both categorical and string columns--as a snapshot, reads the snapshot,
+and checks that:
+1. the snapshot has the same missing values as the sample, and no "nan" strings
+2. the CSV export of the snapshot equals the CSV export of the sample
+
+The script does not call any APIs. It exits with status 1 if a check fails.
+"""
+import pandas as pd
+
+import os
+import sys
+import tempfile
+
+# Import classes originally developed for the donor-metadata app.
+# snapshot.py imports other helper classes of the app as models.<class>, so the app folder is in the path.
+fpath = os.path.dirname(os.getcwd())
+sys.path.append(os.path.join(fpath, 'app'))
+from models.compactframe import getcompactframe, getexportframe
+from models.snapshot import writesnapshot, readsnapshot
+from models.exportstream import streamexport
+
+# Sample metadata. units and concept_id are categoricals in the compact representation; data_value is a string
+# column.
+dfsample = getcompactframe(pd.DataFrame({
+    'id': ['HBM123.ABCD.456', 'HBM123.ABCD.456', 'HBM789.EFGH.012', 'HBM789.EFGH.012'],
+    'source_name': ['organ_donor_data', 'organ_donor_data', 'living_donor_data', 'living_donor_data'],
+    'concept_id': ['C0001779', 'C0086582', None, 'C0007457'],
+    'data_value': ['34', 'Male', None, ''],
+    'units': ['years', '', None, None],
+}))
+
+failed = False
+with tempfile.TemporaryDirectory() as tmpdir:
+    path = os.path.join(tmpdir, 'snapshot.arrow')
+    writesnapshot(dfsnapshot=dfsample, path=path)
+    dfsnapshot = readsnapshot(path=path)
+
+    for col in getexportframe(dfsample).columns:
+        nulls = dfsample[col].isna().to_list() == dfsnapshot[col].isna().to_list()
+        nanstrings = (dfsnapshot[col].astype(str) == 'nan').sum()
+        print(f'{col}: same missing values: {nulls}; "nan" strings: {nanstrings}')
+        failed = failed or not nulls or nanstrings > 0
+
+    csvsample = b''.join(streamexport(dfsample, format='csv'))
+    csvsnapshot = b''.join(streamexport(dfsnapshot, format='csv'))
+    print(f'Same CSV export: {csvsample == csvsnapshot}')
+    if csvsample != csvsnapshot:
+        print(csvsample.decode('utf-8'))
+        print(csvsnapshot.decode('utf-8'))
+        failed = True
+    # Release the mapping before the folder is deleted.
+    del dfsnapshot
+
+if failed:
+    exit(1)
@@ -0,0 +1,145 @@
+"""
+Runner for the stages of a validation script.
+
+The stages of a validation script (e.g., searches of search-api and DataCite) are expensive and often
+independent of each other. The runner:
+1. runs stages concurrently once the stages on which they depend are complete
+2. stores the output of each stage in a local cache, so that a rerun of the script--e.g., after a change to
+   the comparison logic--reuses the output of stages that did not change.
+
+The cache key of a stage is built from:
+- the consortium
+- the name of the stage
+- a fingerprint of the stage: the source code of the stage's function and any parameters
+- fingerprints of the outputs of the stages on which the stage depends
+so that a change to a stage, or to the output of an upstream stage, invalidates the cached output.
+
+"""
+
+import os
+import pickle
+import hashlib
+import inspect
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class StageRunner:
+
+    def __init__(self, consortium: str, cachepath: str = 'stage_cache', refresh: list = None, workers: int = 4):
+        """
+        :param consortium: consortium for the stages
+        :param cachepath: folder for cached stage output
+        :param refresh: optional list of names of stages to run even if cached. An empty list refreshes all stages.
+        :param workers: maximum number of stages to run at the same time
+        """
+
+        self.consortium = consortium
+        self.cachepath = cachepath
+        self.refresh = refresh
+        self.workers = workers
+        # Stages, keyed by name, in the order in which they were added.
+        self.stages = {}
+        os.makedirs(self.cachepath, exist_ok=True)
+
+    def addstage(self, name: str, function, inputs: list = None, params: dict = None, cache: bool = True):
+        """
+        Adds a stage.
+        :param name: name of the stage
+        :param function: function that does the work of the stage. The function is called with keyword
+                         arguments for the output of each input stage (by stage name) and for params.
+        :param inputs: optional list of names of stages on which the stage depends
+        :param params: optional dict of other arguments for the function. Parameters are part of the cache key,
+                       so they should be simple values (e.g., strings and numbers) with a stable repr.
+        :param cache: if false, always run the stage--e.g., for a fast stage whose logic changes often.
+        """
+
+        if inputs is None:
+            inputs = []
+        if params is None:
+            params = {}
+        for input in inputs:
+            if input not in self.stages:
+                raise ValueError(f'Stage {name} depends on unknown stage {input}')
+
+        self.stages[name] = {'function': function, 'inputs': inputs, 'params': params, 'cache': cache}
+
+    def _getcachefile(self, name: str, outputhashes: dict) -> str:
+        """
+        Builds the path to the cache file for a stage.
+        :param name: name of the stage
+        :param outputhashes: fingerprints of the outputs of stages, keyed by stage name
+        """
+
+        stage = self.stages[name]
+        try:
+            source = inspect.getsource(stage['function'])
+        except (OSError, TypeError):
+            source = getattr(stage['function'], '__qualname__', repr(stage['function']))
+
+        fingerprint = hashlib.sha256()
+        fingerprint.update(source.encode('utf-8'))
+        fingerprint.update(repr(sorted(stage['params'].items())).encode('utf-8'))
+        for input in stage['inputs']:
+            fingerprint.update(outputhashes[input].encode('utf-8'))
+
+        return os.path.join(self.cachepath, f'{self.consortium}_{name}_{fingerprint.hexdigest()[:16]}.pkl')
+
+    def _runstage(self, name: str, outputs: dict, outputhashes: dict) -> tuple:
+        """
+        Returns the output of a stage, from the cache or by running the stage's function.
+        :return: tuple of output, fingerprint of the output, and source ('cached' or 'computed')
+        """
+
+        stage = self.stages[name]
+        cachefile = self._getcachefile(name=name, outputhashes=outputhashes)
+        refresh = self.refresh is not None and (len(self.refresh) == 0 or name in self.refresh)
+
+        if stage['cache'] and not refresh and os.path.exists(cachefile):
+            with open(cachefile, 'rb') as f:
+                data = f.read()
+            return pickle.loads(data), hashlib.sha256(data).hexdigest(), 'cached'
+
+        kwargs = {input: outputs[input] for input in stage['inputs']}
+        kwargs.update(stage['params'])
+        output = stage['function'](**kwargs)
+
+        data = pickle.dumps(output)
+        if stage['cache']:
+            # Write to a temporary file first, so that an interrupted run does not leave a partial cache file.
+            tmpfile = f'{cachefile}.tmp'
+            with open(tmpfile, 'wb') as f:
+                f.write(data)
+            os.replace(tmpfile, cachefile)
+        return output, hashlib.sha256(data).hexdigest(), 'computed'
+
+    def run(self) -> dict:
+        """
+        Runs all stages, each when the stages on which it depends are complete.
+        :return: dict of the outputs of stages, keyed by stage name
+        """
+
+        outputs = {}
+        outputhashes = {}
+        pending = list(self.stages)
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while pending or running:
+                # Start every stage whose inputs are complete.
+                for name in [n for n in pending if all(i in outputs for i in self.stages[n]['inputs'])]:
+                    pending.remove(name)
+                    print(f'Stage {name}: starting')
+                    running[executor.submit(self._runstage, name, dict(outputs), dict(outputhashes))] = \
+                        (name, time.time())
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name, start = running.pop(future)
+                    # Raises the exception of a failed stage.
+                    output, outputhash, source = future.result()
+                    outputs[name] = output
+                    outputhashes[name] = outputhash
+                    print(f'Stage {name}: {source} ({time.time() - start:.1f} s)')
+
+        return outputs